@@ -3,15 +3,17 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
-import re
-from datetime import datetime
-import io
-import zipfile
 import hmac
+import logging
+
+import pipeline
 
 # Configurazione della pagina
 st.set_page_config(page_title="Validazione, Modellazione e Arricchimento Dati", layout="wide")
 
+# Secondi tra due aggiornamenti dell'avanzamento di un lavoro in background
+INTERVALLO_AVANZAMENTO = 1.0
+
 def check_password():
     """Returns `True` if the user had the correct password."""
 
@@ -38,38 +40,156 @@ def check_password():
 if not check_password():
     st.stop()  # Non continuare se check_password non è True.
 
-# Funzione per caricare il file dei comuni e memorizzarlo nella cache
-@st.cache_data
+# Funzione per caricare il database dei comuni, condiviso in sola lettura tra le sessioni
+@st.cache_resource
 def carica_comuni_db(file_path):
     try:
-        comuni_db_data = pd.read_csv(file_path, sep=";")
-        comuni_db_data = comuni_db_data.drop_duplicates(subset=['denominazione_ita'])
-        # Converti le denominazioni a lowercase per facilitare il matching
-        comuni_db_data['denominazione_ita_lower'] = comuni_db_data['denominazione_ita'].str.lower().str.strip()
-        return comuni_db_data
+        return pipeline.carica_comuni_db(file_path)
     except Exception as e:
         st.error(f"Errore nel caricamento del database comuni: {e}")
         return pd.DataFrame()
 
-# Funzione per caricare il file di dati
+# Funzione per costruire l'indice dei nomi dei comuni, condiviso in sola lettura tra le sessioni
+@st.cache_resource
+def crea_risolutore_comuni(_comuni_db_data):
+    return pipeline.RisolutoreComuni(_comuni_db_data)
+
+# Funzione per caricare i file di dati (uno o più, ad esempio le esportazioni di più sedi)
 def carica_file():
-    uploaded_file = st.sidebar.file_uploader("Carica un file (CSV o Excel)", type=['csv', 'xls', 'xlsx', 'xlsm'])
-    return uploaded_file
+    file_caricati = st.sidebar.file_uploader("Carica uno o più file (CSV o Excel)", type=['csv', 'xls', 'xlsx', 'xlsm'], accept_multiple_files=True)
+    return file_caricati or []
 
-# Funzione per leggere il file caricato
-@st.cache_data
-def leggi_file(uploaded_file, header_option):
+# Funzione per scegliere le sedi da cui calcolare la distanza dei record; None se il calcolo non è richiesto
+def scegli_sedi():
+    if not st.sidebar.checkbox("Calcola la distanza dalle sedi", value=False):
+        return None
+    sedi = st.sidebar.text_input("Sedi (comuni o NOME:LAT:LON, separati da virgole)", ', '.join(pipeline.SEDI_LIGURIA.sedi))
+    raggi = st.sidebar.text_input("Limiti delle fasce di distanza (km)", ', '.join(map(str, pipeline.RAGGI_KM)))
     try:
-        if uploaded_file.name.endswith('.csv'):
-            df = pd.read_csv(uploaded_file, header=header_option)
-        else:
-            df = pd.read_excel(uploaded_file, header=header_option)
-        # Assicurati che i nomi delle colonne siano tutti stringhe
-        df.columns = df.columns.map(str)
-        return df
+        definizione = pipeline.leggi_definizione_sedi(sedi, raggi)
+        pipeline.coordinate_sedi(definizione, carica_comuni_db(pipeline.COMUNI_DB_PATH))
+    except ValueError as e:
+        st.sidebar.error(str(e))
+        return None
+    return definizione
+
+# Funzione per ricavare la parte della chiave delle fasi che dipende dalle sedi
+def chiave_sedi(definizione_sedi):
+    if definizione_sedi is None:
+        return (None,)
+    return (tuple(definizione_sedi.sedi.items()), tuple(definizione_sedi.raggi_km))
+
+# Funzione per ottenere la cache dei risultati delle fasi, una per sessione
+def cache_fasi():
+    if 'cache_fasi' not in st.session_state:
+        st.session_state['cache_fasi'] = pipeline.CacheFasi()
+    return st.session_state['cache_fasi']
+
+# Funzione per ottenere l'impronta del contenuto di un file caricato, calcolata una sola volta: i rerun successivi la
+# ritrovano nella sessione tramite l'identificativo del caricamento e la dimensione, senza rileggere il file
+def impronta_file(uploaded_file):
+    if 'impronte_file' not in st.session_state:
+        st.session_state['impronte_file'] = {}
+    impronte = st.session_state['impronte_file']
+    chiave = (uploaded_file.file_id, uploaded_file.size)
+    if chiave not in impronte:
+        with uploaded_file.getbuffer() as contenuto:
+            impronte[chiave] = pipeline.impronta_contenuto(contenuto)
+    return impronte[chiave]
+
+# Funzione per ottenere la strumentazione delle fasi, una per sessione
+def strumentazione_sessione():
+    if 'strumentazione' not in st.session_state:
+        st.session_state['strumentazione'] = pipeline.Strumentazione()
+    return st.session_state['strumentazione']
+
+# Funzione per scrivere le misure delle fasi nel log del server come righe JSON (solo tempi e conteggi)
+@st.cache_resource
+def configura_log_strumentazione():
+    gestore = logging.StreamHandler()
+    gestore.setFormatter(logging.Formatter('%(message)s'))
+    logger = logging.getLogger('pipeline.strumentazione')
+    logger.addHandler(gestore)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    return logger
+
+# Funzione per ottenere il risultato di una fase dalla cache misurandone tempo, righe, memoria e riuso
+def ottieni_misurato(cache, fase, chiave, calcola, righe_in=None, righe_out=None):
+    with strumentazione_sessione().misura(fase, righe_in) as misura:
+        risultato, riusato = cache.ottieni_con_esito(fase, chiave, calcola)
+        misura.cache = 'hit' if riusato else 'miss'
+        if righe_out is not None:
+            misura.righe_out = righe_out(risultato)
+    return risultato
+
+# Funzione per mostrare il pannello di diagnostica: fasi del lavoro in background e dell'ultima esecuzione,
+# esportazioni della sessione
+def mostra_diagnostica(strumentazione):
+    with st.expander("Diagnostica delle prestazioni"):
+        esportazioni = (*(formato.fase for formato in pipeline.FORMATI.values()),
+                        'archivio_zip', 'cartella_xlsx', 'parquet_partizionato')
+        esecuzioni = dict.fromkeys([st.session_state.get('esecuzione_lavoro'), strumentazione.esecuzione])
+        fasi = [m for esecuzione in esecuzioni if esecuzione is not None
+                for m in strumentazione.misure(esecuzione) if m.fase not in esportazioni]
+        st.table(pd.DataFrame({
+            "Fase": [m.fase for m in fasi],
+            "Esecuzione": ["background" if m.esecuzione == st.session_state.get('esecuzione_lavoro') else "pagina" for m in fasi],
+            "Secondi": [m.secondi for m in fasi],
+            "Righe in": pd.array([m.righe_in for m in fasi], dtype="Int64"),
+            "Righe out": pd.array([m.righe_out for m in fasi], dtype="Int64"),
+            "Δ memoria (MB)": [m.delta_memoria_mb for m in fasi],
+            "Cache": [m.cache for m in fasi]
+        }).style.hide(axis="index"))
+        download = [m for m in strumentazione.misure() if m.fase in esportazioni]
+        if download:
+            st.caption("Esportazioni della sessione (prodotte alla pressione dei bottoni di download)")
+            st.table(pd.DataFrame({
+                "Fase": [m.fase for m in download],
+                "File": [m.dettaglio for m in download],
+                "Secondi": [m.secondi for m in download],
+                "Righe": pd.array([m.righe_in for m in download], dtype="Int64")
+            }).style.hide(axis="index"))
+        st.caption("La memoria è quella dell'intero processo del server. Vengono registrati solo tempi e conteggi, mai dati dei record.")
+
+# Funzione per scegliere i fogli da leggere di un file Excel (più fogli vengono letti in parallelo e concatenati)
+def scegli_fogli(uploaded_file, cache, chiave):
+    if pipeline.e_csv(uploaded_file):
+        return 0
+    try:
+        fogli = cache.ottieni('fogli', chiave, lambda: pipeline.elenca_fogli(uploaded_file))
     except Exception as e:
         st.error(f"Errore nel caricamento del file: {e}")
         return None
+    if len(fogli) == 1:
+        return fogli[0]
+    scelti = st.sidebar.multiselect("Seleziona i fogli da elaborare:", fogli, default=fogli[:1])
+    if not scelti:
+        st.error("Seleziona almeno un foglio da elaborare.")
+        return None
+    return scelti[0] if len(scelti) == 1 else scelti
+
+# Funzione per leggere le prime righe del file: bastano per l'anteprima e per la mappatura delle colonne
+def leggi_anteprima(uploaded_file, header_option, fogli, cache, chiave):
+    foglio = fogli[0] if isinstance(fogli, list) else fogli
+    try:
+        return cache.ottieni('anteprima', chiave, lambda: pipeline.leggi_anteprima(uploaded_file, header_option, foglio))
+    except Exception as e:
+        st.error(f"Errore nel caricamento del file: {e}")
+        return None
+
+# Funzione per leggere il file caricato, solo nelle colonne mappate, mostrando l'avanzamento
+def leggi_file(uploaded_file, header_option, fogli, colonne, cache, chiave):
+    barra = st.progress(0.0, text="Lettura del file...")
+    try:
+        return ottieni_misurato(cache, 'lettura', chiave, lambda: pipeline.leggi_file(
+            uploaded_file, header_option, colonne, fogli, lambda frazione, messaggio: barra.progress(frazione, text=messaggio)
+        ), righe_out=len)
+    except Exception as e:
+        st.error(f"Errore nel caricamento del file: {e}")
+        return None
+    finally:
+        barra.empty()
 
 # Funzione per mappare le colonne
 def mappatura_colonne(df):
@@ -86,166 +206,228 @@ def mappatura_colonne(df):
         st.error("Assicurati che le colonne 'Nome', 'Cognome', 'Sesso', 'Data_Nascita', 'Città' e 'Email' esistano nel file caricato.")
         return None
     
-    df_mappato = df[[nome, cognome, sesso, data_nascita, citta, email]].copy()
-    df_mappato.columns = ['Nome', 'Cognome', 'Sesso', 'Data_Nascita', 'Città', 'Email']
-    return df_mappato
-
-# Funzione per formattare i dati dopo la mappatura
-def formatta_dati(df):
-    st.subheader("Formattazione dei dati")
-    
-    # Identifica le colonne di tipo stringa
-    str_cols = df.select_dtypes(include=['object', 'string']).columns
-    
-    # Rimuovi spazi superflui nelle colonne di tipo stringa
-    df[str_cols] = df[str_cols].apply(lambda x: x.str.strip())
-    
-    # Formatta Nome, Cognome e Città in Titlecase
-    for col in ['Nome', 'Cognome', 'Città']:
-        if col in df.columns:
-            df[col] = df[col].str.title()
-    
-    # Formatta Email in lowercase
-    if 'Email' in df.columns:
-        df['Email'] = df['Email'].str.lower()
-    
-    # Formatta la Data di Nascita
-    df['Data_Nascita'] = pd.to_datetime(df['Data_Nascita'], dayfirst=True, errors='coerce')
-    df['Data_Nascita_Formatta'] = df['Data_Nascita'].dt.strftime('%d/%m/%Y')
+    mappatura = dict(zip(pipeline.CAMPI_RICHIESTI, [nome, cognome, sesso, data_nascita, citta, email]))
     
-    st.success("Formattazione dati completata!")
-    st.dataframe(df.head())
-    return df
+    # Colonne facoltative per distinguere i comuni omonimi
+    nessuna = '(nessuna)'
+    for campo, etichetta in [('Provincia_Indicata', 'Provincia'), ('CAP_Indicato', 'CAP')]:
+        alias = [colonna for colonna in pipeline.CAMPI_OPZIONALI[campo] if colonna in columns]
+        opzioni = [nessuna] + columns
+        scelta = st.sidebar.selectbox(
+            f"Seleziona la colonna per '{etichetta}' (facoltativa):", opzioni,
+            index=opzioni.index(alias[0]) if alias else 0
+        )
+        mappatura[campo] = None if scelta == nessuna else scelta
+    return mappatura
 
-# Funzione per validare l'email
-def valida_email(email):
-    pattern = r'^[\w\.-]+@[\w\.-]+\.\w+$'
-    return bool(re.match(pattern, str(email)))
+# Fasi della pipeline che dipendono anche dalle sedi: in cache con la chiave dei segmenti
+FASI_SEDI = ('distanze', 'segmentazione')
 
-# Funzione per calcolare l'età
-def calcola_eta(data_nascita):
-    if pd.isna(data_nascita):
-        return None
-    try:
-        oggi = datetime.today()
-        eta = oggi.year - data_nascita.year - ((oggi.month, oggi.day) < (data_nascita.month, data_nascita.day))
-        return eta
-    except:
-        return None
+# Avanzamento del lavoro in background e messaggio all'inizio di ogni fase della pipeline
+AVANZAMENTO_FASI = {
+    'formattazione': (0.3, "Formattazione dei dati..."),
+    'eta': (0.5, "Calcolo dell'età e del gruppo di appartenenza..."),
+    'validazione': (0.55, "Validazione dei dati..."),
+    'quasi_duplicati': (0.65, "Ricerca dei quasi duplicati..."),
+    'comuni': (0.8, "Arricchimento dei dati con provincia e regione..."),
+    'distanze': (0.9, "Calcolo della distanza dalle sedi..."),
+    'segmentazione': (0.95, "Segmentazione...")
+}
 
-# Funzione per calcolare la fascia d'età
-def calcola_fascia_eta(eta):
-    if pd.isna(eta) or eta is None:
-        return 'Sconosciuto'
-    elif eta < 18:
-        return 'Minorenni'
-    elif 18 <= eta < 25:
-        return 'Ragazzi'
-    elif 25 <= eta < 40:
-        return 'Giovani adulti'
-    elif 40 <= eta < 60:
-        return 'Adulti'
-    else:
-        return 'Senior'
+# Funzione per eseguire la pipeline con i risultati delle fasi nella cache della sessione, usata dal lavoro in background
+# e dalla visualizzazione (che al termine ritrova tutte le fasi in cache). `ottieni(fase, chiave, calcola, righe_in, righe_out)`
+# prende il risultato di una fase dalla cache o lo calcola. Restituisce il risultato e i risultati delle singole fasi.
+def esegui_pipeline_in_cache(df, mappatura, compatto, data_riferimento, comuni_db_data, risolutore, definizione_sedi,
+                             chiave, chiave_segmenti, ottieni):
+    risultati_fasi = {}
+    def esegui_fase(nome, calcola, righe_in, righe_out):
+        risultati_fasi[nome] = ottieni(nome, chiave_segmenti if nome in FASI_SEDI else chiave, calcola, righe_in, righe_out)
+        return risultati_fasi[nome]
+    
+    risultato = pipeline.esegui_pipeline(df, comuni_db_data, mappatura, data_riferimento, risolutore, pipeline.SEGMENTI_LIGURIA, compatto,
+                                         definizione_sedi=definizione_sedi, esegui_fase=esegui_fase)
+    return risultato, risultati_fasi
 
-# Funzione per aggiungere età e gruppo d'età
-def aggiungi_eta_e_gruppo(df):
-    st.subheader("Calcolo dell'età e gruppo di appartenenza")
-    df.loc[:, 'eta'] = df['Data_Nascita'].apply(calcola_eta)
-    df.loc[:, 'gruppo_eta'] = df['eta'].apply(calcola_fascia_eta)
-    return df
+# Funzione per elaborare il file caricato a blocchi: i segmenti vengono scritti in voci ZIP compresse in memoria.
+# Restituisce l'esportazione, le statistiche complessive e i segmenti da mettere nell'archivio
+def calcola_blocchi(uploaded_file, header_option, fogli, mappatura, data_riferimento, comuni_db_data, risolutore, definizione_sedi,
+                    strumentazione, progresso=None):
+    esportazione = pipeline.EsportazioneCompressa()
+    statistiche, file_zip = pipeline.elabora_a_blocchi(
+        uploaded_file, esportazione, comuni_db_data, header_option, mappatura, data_riferimento, risolutore,
+        pipeline.SEGMENTI_LIGURIA, fogli, strumentazione=strumentazione, progresso=progresso, definizione_sedi=definizione_sedi
+    )
+    return esportazione, statistiche, file_zip
 
-# Funzione per validare i dati
-def validazione_dati(df):
-    st.subheader("Validazione dei dati")
-    
-    email_vuote = df['Email'].isna().sum()
-    email_non_valide = df['Email'].apply(lambda x: not valida_email(x) if pd.notna(x) else False).sum()
-    duplicati_email = df[df['Email'].notna()]['Email'].duplicated(keep=False).sum()
-    duplicati_email_nome_cognome = df.dropna(subset=['Email', 'Nome', 'Cognome']).duplicated(subset=['Email', 'Nome', 'Cognome'], keep=False).sum()
-    
-    invalid_data_nascita = df['Data_Nascita'].isna().sum()
-    
-    condizione_scaricabili_email = (
-        df['Email'].notna() & (
-            df['Email'].apply(lambda x: not valida_email(x)) |
-            df['Email'].duplicated(keep=False)
-        )
+# Funzione per elaborare i file caricati in processi paralleli e unirli in un solo insieme di segmenti
+def calcola_unione(file_caricati, header_option, mappatura, data_riferimento, risolutore, definizione_sedi, strumentazione, progresso=None):
+    return pipeline.elabora_e_unisci(
+        [(f.name, f.getvalue()) for f in file_caricati], pipeline.COMUNI_DB_PATH, header_option, mappatura, data_riferimento,
+        pipeline.SEGMENTI_LIGURIA, strumentazione=strumentazione, progresso=progresso, definizione_sedi=definizione_sedi,
+        risolutore=risolutore
     )
-    scaricabili_data_email = df[condizione_scaricabili_email].copy()
-    numero_scaricabili_email = scaricabili_data_email.shape[0]
-    
-    condizione_scaricabili_no_email = df['Email'].isna()
-    scaricabili_data_no_email = df[condizione_scaricabili_no_email].copy()
-    numero_scaricabili_no_email = scaricabili_data_no_email.shape[0]
+
+# Funzione per calcolare una fase in un lavoro in background: il risultato va nella cache della sessione con la stessa
+# chiave usata dalla visualizzazione, che al termine lo ritrova senza ricalcolarlo (e le fasi già in cache non vengono ripetute)
+def fase_in_background(esecuzione, strumentazione, cache, fase, chiave, calcola, righe_in=None, righe_out=len):
+    with strumentazione.misura(fase, righe_in, esecuzione=esecuzione) as misura:
+        risultato, riusato = cache.ottieni_con_esito(fase, chiave, calcola)
+        misura.cache = 'hit' if riusato else 'miss'
+        misura.righe_out = righe_out(risultato)
+    return risultato
+
+# Funzione eseguita dal lavoro in background dell'elaborazione normale: lettura, poi tutte le fasi della pipeline
+def esegui_fasi(lavoro, esecuzione, uploaded_file, header_option, fogli, colonne, mappatura, compatto, data_riferimento,
+                comuni_db_data, risolutore, definizione_sedi, cache, strumentazione, chiave_lettura, chiave, chiave_segmenti):
+    def ottieni(nome, chiave_fase, calcola, righe_in=None, righe_out=len):
+        lavoro.aggiorna(*AVANZAMENTO_FASI[nome])
+        return fase_in_background(esecuzione, strumentazione, cache, nome, chiave_fase, calcola, righe_in, righe_out)
+    
+    lavoro.aggiorna(0.0, "Lettura del file...")
+    df = fase_in_background(esecuzione, strumentazione, cache, 'lettura', chiave_lettura, lambda: pipeline.leggi_file(
+        uploaded_file, header_option, colonne, fogli, lambda frazione, messaggio: lavoro.aggiorna(0.3 * frazione, messaggio)
+    ))
+    esegui_pipeline_in_cache(df, mappatura, compatto, data_riferimento, comuni_db_data, risolutore, definizione_sedi,
+                             chiave, chiave_segmenti, ottieni)
+
+# Funzione eseguita dal lavoro in background dell'elaborazione a blocchi
+def esegui_blocchi(lavoro, esecuzione, uploaded_file, header_option, fogli, mappatura, data_riferimento, comuni_db_data, risolutore,
+                   definizione_sedi, cache, strumentazione, chiave):
+    lavoro.aggiorna(0.0, "Elaborazione a blocchi...")
+    progresso = lambda righe: lavoro.aggiorna(messaggio=f"Elaborazione a blocchi: {righe:,} righe elaborate...".replace(',', '.'))
+    fase_in_background(esecuzione, strumentazione, cache, 'blocchi', chiave, lambda: calcola_blocchi(
+        uploaded_file, header_option, fogli, mappatura, data_riferimento, comuni_db_data, risolutore, definizione_sedi, strumentazione,
+        progresso
+    ), righe_out=lambda risultato: risultato[1].righe_lette)
+
+# Funzione eseguita dal lavoro in background dell'elaborazione di più file
+def esegui_unione(lavoro, esecuzione, file_caricati, header_option, mappatura, data_riferimento, risolutore, definizione_sedi, cache,
+                  strumentazione, chiave):
+    lavoro.aggiorna(0.0, f"Elaborazione di {len(file_caricati)} file...")
+    progresso = lambda completati, totale: lavoro.aggiorna(completati / totale, f"{completati} file su {totale} elaborati")
+    fase_in_background(esecuzione, strumentazione, cache, 'unione_file', chiave, lambda: calcola_unione(
+        file_caricati, header_option, mappatura, data_riferimento, risolutore, definizione_sedi, strumentazione, progresso
+    ), righe_out=lambda unione: len(unione.risultato.lavorabili))
+
+# Funzione per avviare un lavoro in background; il lavoro precedente della sessione viene annullato
+def avvia_lavoro(chiave, esegui, precedente=None):
+    # Le misure del lavoro hanno una propria esecuzione, mostrata nella diagnostica insieme a quella corrente
+    esecuzione = strumentazione_sessione().nuova_esecuzione()
+    lavoro = pipeline.Lavoro(lambda lavoro: esegui(lavoro, esecuzione), chiave, precedente)
+    st.session_state['lavoro'] = lavoro
+    st.session_state['esecuzione_lavoro'] = esecuzione
+    return lavoro.avvia()
+
+# Funzione per eseguire le fasi pesanti in un lavoro in background, così la pagina resta utilizzabile. Restituisce
+# True quando il lavoro con questa chiave è completato; altrimenti mostra avanzamento, annullamento o errore.
+# Cambiare un'opzione avvia un nuovo lavoro: le fasi già completate restano nella cache e non vengono ripetute.
+def lavoro_in_background(chiave, esegui):
+    lavoro = st.session_state.get('lavoro')
+    if lavoro is None or lavoro.chiave != chiave:
+        lavoro = avvia_lavoro(chiave, esegui, lavoro)
+    if lavoro.stato == pipeline.COMPLETATO:
+        return True
+    if lavoro.stato == pipeline.ANNULLATO:
+        st.warning("Elaborazione annullata. Le fasi già completate sono conservate e non verranno ricalcolate.")
+        if st.button("Riprendi l'elaborazione"):
+            avvia_lavoro(chiave, esegui, lavoro)
+            st.rerun()
+        return False
+    if lavoro.stato == pipeline.ERRORE:
+        st.error(f"Errore durante l'elaborazione: {lavoro.errore}")
+        if st.button("Riprova"):
+            avvia_lavoro(chiave, esegui, lavoro)
+            st.rerun()
+        return False
+    mostra_avanzamento(lavoro)
+    return False
+
+# Funzione per mostrare l'avanzamento del lavoro: il frammento si aggiorna da solo senza rieseguire l'app,
+# che viene rieseguita al termine del lavoro per mostrare i risultati
+@st.fragment(run_every=INTERVALLO_AVANZAMENTO)
+def mostra_avanzamento(lavoro):
+    if not lavoro.in_corso:
+        st.rerun()
+    st.progress(lavoro.avanzamento, text=lavoro.messaggio or "Elaborazione in corso...")
+    if st.button("Annulla l'elaborazione"):
+        lavoro.annulla()
+        st.info("Annullamento in corso: l'elaborazione si ferma alla fine del passo attuale.")
+
+# Funzione per mostrare i dati formattati e i formati riconosciuti nella data di nascita
+def mostra_formattazione(df, formati):
+    st.subheader("Formattazione dei dati")
+    st.success("Formattazione dati completata!")
+    st.dataframe(df.head())
     
-    condizione_lavorabili = ~condizione_scaricabili_email & ~condizione_scaricabili_no_email
-    lavorabili_data = df[condizione_lavorabili].copy()
-    numero_lavorabili = lavorabili_data.shape[0]
+    # Formati riconosciuti nella data di nascita: spiegano il conteggio delle date non valide
+    with st.expander("Formati della data di nascita"):
+        st.table(pd.DataFrame({
+            "Formato": list(formati.keys()),
+            "Numero di record": list(formati.values())
+        }).style.hide(axis="index"))
+
+# Funzione per mostrare statistiche e grafici della validazione e i download dei record per la gestione manuale
+def mostra_validazione(risultato, quasi_duplicati, cache, chiave):
+    statistiche = risultato.statistiche
     
     # Presentazione dei risultati in una tabella senza indici
-    validation_results = pd.DataFrame({
-        "Categoria": [
-            "Email vuote",
-            "Email non valide",
-            "Duplicati Email",
-            "Duplicati Email, Nome, Cognome",
-            "Data di nascita non valida",
-            "Record lavorabili",
-            "Record scaricabili (con Email)",
-            "Record scaricabili (senza Email)"
-        ],
-        "Numero di record": [
-            email_vuote,
-            email_non_valide,
-            duplicati_email,
-            duplicati_email_nome_cognome,
-            invalid_data_nascita,
-            numero_lavorabili,
-            numero_scaricabili_email,
-            numero_scaricabili_no_email
-        ]
-    })
-    
-    st.table(validation_results.style.hide(axis="index"))
+    st.table(statistiche.come_tabella().style.hide(axis="index"))
     
     # Creazione dei grafici in colonne
     col1, col2 = st.columns(2)
     
     with col1:
         crea_grafico_analisi_dettagliata({
-            'Email vuota': email_vuote,
-            'Email non valida': email_non_valide,
-            'Duplicati Email': duplicati_email,
-            'Data nascita non valida': invalid_data_nascita
+            'Email vuota': statistiche.email_vuote,
+            'Email non valida': statistiche.email_non_valide,
+            'Duplicati Email': statistiche.duplicati_email,
+            'Data nascita non valida': statistiche.invalid_data_nascita
         })
     
     with col2:
         crea_grafico_gestione_manuale({
-            'Lavorabili': numero_lavorabili,
-            'Scaricabili con Email': numero_scaricabili_email,
-            'Scaricabili senza Email': numero_scaricabili_no_email
+            'Lavorabili': statistiche.numero_lavorabili,
+            'Scaricabili con Email': statistiche.numero_scaricabili_email,
+            'Scaricabili senza Email': statistiche.numero_scaricabili_no_email
         })
     
-    # Download dei file
+    # Download dei file: il CSV viene prodotto solo quando si preme il bottone e resta in cache per la sessione
+    esportazione = cache.ottieni('esportazione_manuale', chiave, lambda: pipeline.EsportazioneCsv({
+        'data_manuale_email.csv': risultato.scaricabili_email,
+        'data_manuale_no_email.csv': risultato.scaricabili_no_email,
+        pipeline.FILE_QUASI_DUPLICATI: quasi_duplicati
+    }, strumentazione_sessione()))
+    if not quasi_duplicati.empty:
+        st.info(f"Possibili duplicati da rivedere: {quasi_duplicati.shape[0]} record lavorabili in "
+                f"{quasi_duplicati[pipeline.COLONNA_GRUPPO].nunique()} gruppi (stessa persona con un refuso nel nome, "
+                f"un'altra email o Nome e Cognome invertiti). Sono nel file {pipeline.FILE_QUASI_DUPLICATI}.")
     with st.expander("Scarica i record per la gestione manuale"):
-        if not scaricabili_data_email.empty:
+        if not risultato.scaricabili_email.empty:
             st.download_button(
                 label='Scarica data_manuale_email.csv',
-                data=scaricabili_data_email.to_csv(index=False).encode('utf-8'),
+                data=lambda: esportazione.csv('data_manuale_email.csv'),
                 file_name='data_manuale_email.csv',
-                mime='text/csv'
+                mime='text/csv',
+                on_click='ignore'
             )
         
-        if not scaricabili_data_no_email.empty:
+        if not risultato.scaricabili_no_email.empty:
             st.download_button(
                 label='Scarica data_manuale_no_email.csv',
-                data=scaricabili_data_no_email.to_csv(index=False).encode('utf-8'),
+                data=lambda: esportazione.csv('data_manuale_no_email.csv'),
                 file_name='data_manuale_no_email.csv',
-                mime='text/csv'
+                mime='text/csv',
+                on_click='ignore'
+            )
+        
+        if not quasi_duplicati.empty:
+            st.download_button(
+                label=f'Scarica {pipeline.FILE_QUASI_DUPLICATI}',
+                data=lambda: esportazione.csv(pipeline.FILE_QUASI_DUPLICATI),
+                file_name=pipeline.FILE_QUASI_DUPLICATI,
+                mime='text/csv',
+                on_click='ignore'
             )
-    
-    return lavorabili_data
 
 # Funzione per creare grafici di analisi dettagliata
 def crea_grafico_analisi_dettagliata(analisi_dettagliata):
@@ -273,56 +455,53 @@ def crea_grafico_gestione_manuale(gestione_manuale):
     fig.update_layout(uniformtext_minsize=8, uniformtext_mode='hide', xaxis_tickangle=-45)
     st.plotly_chart(fig, use_container_width=True)
 
-# Funzione per mappare le informazioni dei comuni
-@st.cache_data
-def map_comune_info(lavorabili_data, comuni_db_data):
-    # Creazione mappe per provincia e regione
-    lavorabili_data.loc[:, 'citta_lower'] = lavorabili_data['Città'].str.lower().str.strip()
-    
-    # Creazione dei dizionari per mappare le informazioni
-    mappa_provincia = dict(zip(comuni_db_data['denominazione_ita_lower'], comuni_db_data['denominazione_provincia']))
-    mappa_regione = dict(zip(comuni_db_data['denominazione_ita_lower'], comuni_db_data['denominazione_regione']))
-    mappa_cap = dict(zip(comuni_db_data['denominazione_ita_lower'], comuni_db_data['cap']))
-    
-    # Aggiunta delle nuove colonne utilizzando le mappe con .loc
-    lavorabili_data.loc[:, 'provincia'] = lavorabili_data['citta_lower'].map(mappa_provincia)
-    lavorabili_data.loc[:, 'regione'] = lavorabili_data['citta_lower'].map(mappa_regione)
-    
-    # Assegna il CAP e convertilo esplicitamente a stringa
-    lavorabili_data.loc[:, 'cap'] = lavorabili_data['citta_lower'].map(mappa_cap).apply(
-        lambda x: str(int(x)) if pd.notna(x) else None
-    )
-    
-    # Rimuoviamo la colonna ausiliaria 'citta_lower'
-    lavorabili_data = lavorabili_data.drop(columns=['citta_lower'])
-    
-    # Aggiungi la colonna 'residente_citta' usando .loc
-    lavorabili_data.loc[:, 'residente_citta'] = lavorabili_data['Città'].str.lower().str.strip() == lavorabili_data['provincia'].str.lower().str.strip()
-    
-    # Identifica le città non trovate
-    citta_non_trovate = lavorabili_data[lavorabili_data['provincia'].isna()]['Città'].unique()
+# Funzione per segnalare le città non trovate nel database dei comuni e quelle ambigue
+def mostra_citta_non_risolte(citta_non_trovate, citta_ambigue):
     if len(citta_non_trovate) > 0:
         st.warning("Le seguenti città non sono state trovate nel database dei comuni e non hanno informazioni su Provincia, Regione e CAP:")
         st.write(citta_non_trovate)
-    
-    return lavorabili_data
+    if len(citta_ambigue) > 0:
+        st.warning("Le seguenti città corrispondono a più comuni omonimi: mappa le colonne Provincia o CAP per distinguerli. I record ambigui sono segnalati nella colonna 'comune_ambiguo':")
+        st.write(citta_ambigue)
+
+# Funzione per mostrare i record per fascia di distanza e per sede più vicina
+def mostra_distanze(statistiche):
+    st.header("Distanza dalle sedi")
+    col1, col2 = st.columns(2)
+    with col1:
+        crea_grafico_fasce_distanza(statistiche.righe_per_fascia_distanza)
+    with col2:
+        crea_grafico_sedi_vicine(statistiche.righe_per_sede_vicina)
+
+# Funzione per creare il grafico dei record per fascia di distanza dalla sede più vicina
+def crea_grafico_fasce_distanza(righe_per_fascia):
+    fig = px.bar(
+        x=list(righe_per_fascia.keys()),
+        y=list(righe_per_fascia.values()),
+        labels={'x': 'Distanza dalla sede più vicina', 'y': 'Numero di record'},
+        title='Distribuzione dei record per fascia di distanza',
+        text=list(righe_per_fascia.values())
+    )
+    fig.update_traces(marker_color='#1f77b4', textposition='outside')
+    fig.update_layout(uniformtext_minsize=8, uniformtext_mode='hide')
+    st.plotly_chart(fig, use_container_width=True)
+
+# Funzione per creare il grafico dei record per sede più vicina
+def crea_grafico_sedi_vicine(righe_per_sede):
+    fig = px.bar(
+        x=list(righe_per_sede.keys()),
+        y=list(righe_per_sede.values()),
+        labels={'x': 'Sede più vicina', 'y': 'Numero di record'},
+        title='Distribuzione dei record per sede più vicina',
+        text=list(righe_per_sede.values())
+    )
+    fig.update_traces(marker_color='#2ca02c', textposition='outside')
+    fig.update_layout(uniformtext_minsize=8, uniformtext_mode='hide', xaxis_tickangle=-45)
+    st.plotly_chart(fig, use_container_width=True)
 
 # Funzione per creare grafici di distribuzione delle province
-def crea_grafico_distribuzione_province(lavorabili_data):
-    # Definire le province di interesse
-    provincie_interessate = ['Genova', 'Savona', 'La Spezia', 'Imperia']
-    altra_provincia = lavorabili_data[~lavorabili_data['provincia'].isin(provincie_interessate)]
-    
-    # Funzione per calcolare i conteggi
-    def calcola_conteggi(data, column, values):
-        return {value: data[data[column] == value].shape[0] for value in values}
-    
-    # Calcolare il numero di record per ciascuna provincia
-    provincie = ['Altra provincia'] + provincie_interessate
-    conteggi_province = {
-        'Altra provincia': altra_provincia.shape[0],
-        **calcola_conteggi(lavorabili_data, 'provincia', provincie_interessate)
-    }
+def crea_grafico_distribuzione_province(segmentazione):
+    conteggi_province = segmentazione.conteggi_province()
     
     # Creare il grafico per le province
     fig = px.bar(
@@ -339,28 +518,8 @@ def crea_grafico_distribuzione_province(lavorabili_data):
     st.plotly_chart(fig, use_container_width=True)
 
 # Funzione per creare grafici di distribuzione residente_citta
-def crea_grafico_distribuzione_residente(lavorabili_data):
-    # Definire le province di interesse
-    provincie_interessate = ['Genova', 'Savona', 'La Spezia', 'Imperia']
-    combinazioni_residente = {
-        'Genova Città': ('Genova', True),
-        'Genova Prov': ('Genova', False),
-        'Savona Città': ('Savona', True),
-        'Savona Prov': ('Savona', False),
-        'La Spezia Città': ('La Spezia', True),
-        'La Spezia Prov': ('La Spezia', False),
-        'Imperia Città': ('Imperia', True),
-        'Imperia Prov': ('Imperia', False)
-    }
-    
-    # Calcolare i conteggi
-    conteggi_residente = {
-        label: lavorabili_data[
-            (lavorabili_data['provincia'] == provincia) & 
-            (lavorabili_data['residente_citta'] == residente)
-        ].shape[0]
-        for label, (provincia, residente) in combinazioni_residente.items()
-    }
+def crea_grafico_distribuzione_residente(segmentazione):
+    conteggi_residente = segmentazione.conteggi_residente()
     
     # Creare il grafico per provincia e residente_citta
     fig = px.bar(
@@ -377,138 +536,364 @@ def crea_grafico_distribuzione_residente(lavorabili_data):
     st.plotly_chart(fig, use_container_width=True)
 
 # Funzione per creare i bottoni di download
-def crea_bottoni_download(lavorabili_data):
+def crea_bottoni_download(lavorabili_data, segmentazione, cache, chiave):
     st.subheader("Download dei segmenti di dati")
+    formato = st.selectbox("Formato dei segmenti", list(pipeline.FORMATI),
+                           format_func=lambda nome: pipeline.FORMATI[nome].descrizione)
     
-    # Definisci le province di interesse
-    provincie_interessate = ['Genova', 'Savona', 'La Spezia', 'Imperia']
+    # I file vengono serializzati solo quando si preme un bottone e riusati dall'archivio ZIP e nei rerun successivi
+    esportazione = cache.ottieni('esportazione_segmenti', chiave + (formato,), lambda: pipeline.esportazione_segmenti(
+        lavorabili_data, segmentazione, strumentazione_sessione(), formato
+    ))
     
-    # Segmento: fuori Liguria
-    data_fuori_liguria = lavorabili_data[~lavorabili_data['provincia'].isin(provincie_interessate)]
-    if not data_fuori_liguria.empty:
-        csv_fuori_liguria = data_fuori_liguria.to_csv(index=False).encode('utf-8')
-        st.download_button(
-            label='Scarica data_fuori_liguria.csv',
-            data=csv_fuori_liguria,
-            file_name='data_fuori_liguria.csv',
-            mime='text/csv'
-        )
+    mostra_bottoni_download(esportazione, segmentazione.definizione.file_fuori_province, segmentazione.file_non_vuoti())
     
-    # Definisci le combinazioni per le province e residente_citta
-    combinazioni = {
-        'data_ge_citta.csv': ('Genova', True),
-        'data_ge_prov.csv': ('Genova', False),
-        'data_sv_citta.csv': ('Savona', True),
-        'data_sv_prov.csv': ('Savona', False),
-        'data_sp_citta.csv': ('La Spezia', True),
-        'data_sp_prov.csv': ('La Spezia', False),
-        'data_im_citta.csv': ('Imperia', True),
-        'data_im_prov.csv': ('Imperia', False)
-    }
+    # Con le distanze dalle sedi, un file per ogni fascia di distanza non vuota
+    if 'fascia_distanza' in lavorabili_data:
+        fasce = cache.ottieni('esportazione_fasce', chiave + (formato,), lambda: pipeline.Esportazione(
+            pipeline.sorgenti_fasce(lavorabili_data), strumentazione_sessione(), formato
+        ))
+        mostra_bottoni_fasce(fasce, fasce.nomi())
     
-    # Crea un dizionario per raccogliere le coppie nome file e dati
-    segmenti = {}
-    for file_name, (provincia, residente) in combinazioni.items():
-        segmento = lavorabili_data[
-            (lavorabili_data['provincia'] == provincia) & 
-            (lavorabili_data['residente_citta'] == residente)
-        ]
-        if not segmento.empty:
-            segmenti[file_name] = segmento
+    # Cartella Excel con un foglio per segmento e dataset Parquet partizionato, prodotti alla pressione del bottone
+    if esportazione.nomi():
+        st.download_button(
+            label='Scarica tutto in Excel (un foglio per segmento)',
+            data=lambda: esportazione.xlsx(),
+            file_name=pipeline.FILE_XLSX_SEGMENTI,
+            mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            on_click='ignore'
+        )
+        st.download_button(
+            label='Scarica Parquet partizionato per provincia e residente_citta',
+            data=lambda: cache.ottieni('parquet_partizionato', chiave, lambda: parquet_partizionato(lavorabili_data)),
+            file_name=pipeline.FILE_PARQUET_PARTIZIONATO,
+            mime='application/zip',
+            on_click='ignore'
+        )
+
+# Funzione per creare l'archivio ZIP del dataset Parquet partizionato dei record lavorabili
+def parquet_partizionato(lavorabili_data):
+    with strumentazione_sessione().misura('parquet_partizionato', len(lavorabili_data)) as misura:
+        file = pipeline.parquet_partizionato(lavorabili_data)
+        misura.righe_out = len(file)
+        return pipeline.zip_non_compresso(file)
+
+# Funzione per mostrare i bottoni di download di un'esportazione: segmento fuori province, segmenti e archivio ZIP
+def mostra_bottoni_download(esportazione, file_fuori_province, file_segmenti):
+    # Segmento: fuori dalle province di interesse
+    if file_fuori_province in esportazione.nomi():
+        st.download_button(
+            label=f'Scarica {esportazione.nome_file(file_fuori_province)}',
+            data=lambda: esportazione.file(file_fuori_province),
+            file_name=esportazione.nome_file(file_fuori_province),
+            mime=esportazione.formato.mime,
+            on_click='ignore'
+        )
     
     # Organizza i bottoni di download in un accordion
     with st.expander("Scarica segmenti specifici"):
-        for file_name, segmento in segmenti.items():
-            csv_data = segmento.to_csv(index=False).encode('utf-8')
+        for file_name in file_segmenti:
             st.download_button(
-                label=f'Scarica {file_name}',
-                data=csv_data,
-                file_name=file_name,
-                mime='text/csv'
+                label=f'Scarica {esportazione.nome_file(file_name)}',
+                data=lambda file_name=file_name: esportazione.file(file_name),
+                file_name=esportazione.nome_file(file_name),
+                mime=esportazione.formato.mime,
+                on_click='ignore'
             )
     
     # Bottone "Scarica Tutto" fuori dall'accordion
-    if len(segmenti) > 0:
-        with st.spinner('Preparazione del file ZIP...'):
-            # Crea un buffer BytesIO per il file ZIP
-            buffer = io.BytesIO()
-            with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for file_name, segmento in segmenti.items():
-                    zipf.writestr(file_name, segmento.to_csv(index=False))
-            # Resetta il puntatore del buffer
-            buffer.seek(0)
-            st.download_button(
-                label='Scarica tutto',
-                data=buffer,
-                file_name='segmenti_dati.zip',
-                mime='application/zip'
-            )
+    if len(file_segmenti) > 0:
+        st.download_button(
+            label='Scarica tutto',
+            data=lambda: esportazione.zip(file_segmenti),
+            file_name=pipeline.FILE_ZIP_SEGMENTI,
+            mime='application/zip',
+            on_click='ignore'
+        )
     else:
         st.info("Non ci sono segmenti di dati disponibili per il download.")
 
+# Funzione per mostrare i bottoni di download dei record per fascia di distanza e del loro archivio ZIP
+def mostra_bottoni_fasce(esportazione, file_fasce):
+    if len(file_fasce) == 0:
+        return
+    with st.expander("Scarica i record per fascia di distanza"):
+        for file_name in file_fasce:
+            st.download_button(
+                label=f'Scarica {esportazione.nome_file(file_name)}',
+                data=lambda file_name=file_name: esportazione.file(file_name),
+                file_name=esportazione.nome_file(file_name),
+                mime=esportazione.formato.mime,
+                on_click='ignore'
+            )
+        st.download_button(
+            label='Scarica tutte le fasce',
+            data=lambda: esportazione.zip(file_fasce),
+            file_name=pipeline.FILE_ZIP_FASCE,
+            mime='application/zip',
+            on_click='ignore'
+        )
+
+# Funzione per elaborare il file a blocchi, con memoria limitata: i segmenti vengono scritti blocco per blocco
+# in voci ZIP compresse in memoria e i duplicati sono calcolati sull'intero file
+def elabora_a_blocchi(uploaded_file, header_option, fogli, mappatura, data_riferimento, comuni_db_data, risolutore, definizione_sedi,
+                      cache, chiave):
+    # Risultato calcolato dal lavoro in background (ricalcolato qui solo se uscito dalla cache)
+    try:
+        esportazione, statistiche, file_zip = ottieni_misurato(cache, 'blocchi', chiave, lambda: calcola_blocchi(
+            uploaded_file, header_option, fogli, mappatura, data_riferimento, comuni_db_data, risolutore, definizione_sedi,
+            strumentazione_sessione()
+        ), righe_out=lambda risultato: risultato[1].righe_lette)
+    except Exception as e:
+        st.error(f"Errore nell'elaborazione a blocchi: {e}")
+        return
+    
+    st.success(f"Elaborazione a blocchi completata: {statistiche.righe_lette} righe lette.")
+    st.subheader("Validazione dei dati")
+    st.table(statistiche.validazione.come_tabella().style.hide(axis="index"))
+    with st.expander("Formati della data di nascita"):
+        st.table(pd.DataFrame({
+            "Formato": list(statistiche.formati_data_nascita.keys()),
+            "Numero di record": list(statistiche.formati_data_nascita.values())
+        }).style.hide(axis="index"))
+    mostra_citta_non_risolte(statistiche.citta_non_trovate, statistiche.citta_ambigue)
+    
+    st.header("Record per segmento")
+    st.table(pd.DataFrame({
+        "Segmento": list(statistiche.righe_per_segmento.keys()),
+        "Numero di record": list(statistiche.righe_per_segmento.values())
+    }).style.hide(axis="index"))
+    if statistiche.righe_per_fascia_distanza:
+        st.header("Record per fascia di distanza dalle sedi")
+        st.table(pd.DataFrame({
+            "Fascia di distanza": list(statistiche.righe_per_fascia_distanza.keys()),
+            "Numero di record": list(statistiche.righe_per_fascia_distanza.values())
+        }).style.hide(axis="index"))
+    
+    with st.expander("Scarica i record per la gestione manuale"):
+        for file_name in ('data_manuale_email.csv', 'data_manuale_no_email.csv'):
+            if file_name in esportazione.nomi():
+                st.download_button(
+                    label=f'Scarica {file_name}',
+                    data=lambda file_name=file_name: esportazione.csv(file_name),
+                    file_name=file_name,
+                    mime='text/csv',
+                    on_click='ignore'
+                )
+    st.subheader("Download dei segmenti di dati")
+    mostra_bottoni_download(esportazione, pipeline.SEGMENTI_LIGURIA.file_fuori_province, file_zip)
+    mostra_bottoni_fasce(esportazione, [
+        pipeline.file_fascia(fascia) for fascia, numero in statistiche.righe_per_fascia_distanza.items() if numero > 0
+    ])
+
+# Funzione per elaborare più file insieme: lettura, formattazione e arricchimento in processi paralleli, poi un solo
+# insieme di segmenti con i duplicati calcolati su tutti i file. La mappatura scelta sul primo file vale per tutti.
+def elabora_piu_file(file_caricati):
+    has_header = st.sidebar.radio("I file caricati hanno una riga di intestazione?", ('Sì', 'No'))
+    header_option = 0 if has_header == 'Sì' else None
+    diagnostica = st.sidebar.checkbox("Mostra la diagnostica delle prestazioni", value=False)
+    definizione_sedi = scegli_sedi()
+    
+    configura_log_strumentazione()
+    strumentazione = strumentazione_sessione()
+    strumentazione.nuova_esecuzione()
+    
+    cache = cache_fasi()
+    chiave = (tuple((f.name, impronta_file(f)) for f in file_caricati), header_option)
+    anteprima = leggi_anteprima(file_caricati[0], header_option, 0, cache, chiave)
+    if anteprima is None:
+        return
+    st.header("Anteprima dei dati")
+    st.caption(f"{len(file_caricati)} file caricati: anteprima e mappatura del primo file ({file_caricati[0].name}), valide per tutti i file.")
+    st.dataframe(anteprima)
+    mappatura = mappatura_colonne(anteprima)
+    if mappatura is None:
+        st.error("Errore durante la mappatura delle colonne. Assicurati di selezionare correttamente tutte le colonne richieste.")
+        return
+    comuni_db_data = carica_comuni_db(pipeline.COMUNI_DB_PATH)
+    if comuni_db_data.empty:
+        st.error("Il database dei comuni non è stato caricato correttamente.")
+        return
+    risolutore = crea_risolutore_comuni(comuni_db_data)
+    data_riferimento = pd.Timestamp.today().normalize()
+    chiave += (tuple(mappatura.items()), data_riferimento) + chiave_sedi(definizione_sedi)
+    
+    if not lavoro_in_background(chiave, lambda lavoro, esecuzione: esegui_unione(
+        lavoro, esecuzione, file_caricati, header_option, mappatura, data_riferimento, risolutore, definizione_sedi, cache,
+        strumentazione, chiave
+    )):
+        return
+    
+    try:
+        unione = ottieni_misurato(cache, 'unione_file', chiave, lambda: calcola_unione(
+            file_caricati, header_option, mappatura, data_riferimento, risolutore, definizione_sedi, strumentazione
+        ), righe_out=lambda unione: len(unione.risultato.lavorabili))
+    except Exception as e:
+        st.error(f"Errore nell'elaborazione dei file: {e}")
+        return
+    risultato = unione.risultato
+    
+    st.subheader("Record per file")
+    st.table(pd.DataFrame({
+        "File": [f.file for f in unione.file],
+        "Righe lette": [f.righe_lette for f in unione.file],
+        "Email vuote": [f.validazione.email_vuote for f in unione.file],
+        "Email non valide": [f.validazione.email_non_valide for f in unione.file],
+        "Duplicati Email": [f.validazione.duplicati_email for f in unione.file],
+        "Lavorabili (file)": [f.validazione.numero_lavorabili for f in unione.file],
+        "Lavorabili (unione)": [f.lavorabili_unione for f in unione.file],
+        "Errore": [f.errore or '' for f in unione.file]
+    }).style.hide(axis="index"))
+    st.caption("Nell'unione i duplicati sono calcolati su tutti i file: un'email presente in più file va nella gestione manuale. Ogni record riporta il file di provenienza nella colonna 'file_origine'.")
+    
+    st.subheader("Validazione dei dati")
+    mostra_validazione(pipeline.RisultatoValidazione(
+        risultato.lavorabili, risultato.scaricabili_email, risultato.scaricabili_no_email, risultato.statistiche.validazione
+    ), risultato.quasi_duplicati, cache, chiave)
+    
+    st.header("Arricchimento dei dati con informazioni dei comuni")
+    mostra_citta_non_risolte(risultato.statistiche.citta_non_trovate, risultato.statistiche.citta_ambigue)
+    st.dataframe(risultato.lavorabili.head())
+    if definizione_sedi is not None:
+        mostra_distanze(risultato.statistiche)
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        crea_grafico_distribuzione_province(risultato.segmentazione)
+    with col2:
+        crea_grafico_distribuzione_residente(risultato.segmentazione)
+    crea_bottoni_download(risultato.lavorabili, risultato.segmentazione, cache, chiave)
+    
+    if diagnostica:
+        mostra_diagnostica(strumentazione)
+
 # Funzione principale
 def main():
-    # Carica il file
-    uploaded_file = carica_file()
-    if uploaded_file is not None:
+    # Carica i file: con più file l'elaborazione è parallela e i risultati vengono uniti
+    file_caricati = carica_file()
+    uploaded_file = file_caricati[0] if len(file_caricati) == 1 else None
+    if len(file_caricati) > 1:
+        elabora_piu_file(file_caricati)
+    elif uploaded_file is not None:
         # Chiedi se il file ha l'intestazione
         has_header = st.sidebar.radio("Il file caricato ha una riga di intestazione?", ('Sì', 'No'))
         header_option = 0 if has_header == 'Sì' else None
+        compatto = st.sidebar.checkbox("Modalità compatta (meno memoria per i file molto grandi)", value=False)
+        a_blocchi = st.sidebar.checkbox("Elaborazione a blocchi (file più grandi della memoria)", value=False)
+        diagnostica = st.sidebar.checkbox("Mostra la diagnostica delle prestazioni", value=False)
+        definizione_sedi = scegli_sedi()
+        
+        # Ogni rerun è una nuova esecuzione: le misure delle fasi vanno nel log del server e nel pannello
+        configura_log_strumentazione()
+        strumentazione = strumentazione_sessione()
+        strumentazione.nuova_esecuzione()
+        
+        # Chiave delle fasi: impronta del contenuto e scelte dell'utente, estesa fase per fase
+        cache = cache_fasi()
+        chiave = (impronta_file(uploaded_file), header_option)
+        
+        fogli = scegli_fogli(uploaded_file, cache, chiave)
+        if fogli is None:
+            return
+        chiave += (tuple(fogli) if isinstance(fogli, list) else fogli,)
         
         with st.spinner('Caricamento del file...'):
-            df = leggi_file(uploaded_file, header_option)
+            anteprima = leggi_anteprima(uploaded_file, header_option, fogli, cache, chiave)
         
-        if df is not None:
-            if has_header == 'No':
-                df.columns = [f'Colonna_{i}' for i in range(1, len(df.columns) + 1)]
-            
+        if anteprima is not None:
             st.header("Anteprima dei dati")
-            st.dataframe(df.head())
+            st.dataframe(anteprima)
             
             with st.spinner('Mappatura delle colonne...'):
-                df_mappato = mappatura_colonne(df)
-                if df_mappato is None:
+                mappatura = mappatura_colonne(anteprima)
+                if mappatura is None:
                     st.error("Errore durante la mappatura delle colonne. Assicurati di selezionare correttamente tutte le colonne richieste.")
                     return
             
-            with st.spinner('Formattazione dei dati...'):
-                df_mappato = formatta_dati(df_mappato)
+            # Database dei comuni, necessario sia all'elaborazione normale sia a quella a blocchi
+            comuni_db_data = carica_comuni_db(pipeline.COMUNI_DB_PATH)
+            if comuni_db_data.empty:
+                st.error("Il database dei comuni non è stato caricato correttamente.")
+                return
+            risolutore = crea_risolutore_comuni(comuni_db_data)
+            # Data di riferimento per età e anni a due cifre, fissata una volta per esecuzione
+            data_riferimento = pd.Timestamp.today().normalize()
+            
+            # Elaborazione a blocchi: il file non viene mai caricato per intero
+            if a_blocchi:
+                chiave += (tuple(mappatura.items()), data_riferimento) + chiave_sedi(definizione_sedi)
+                if not lavoro_in_background(chiave, lambda lavoro, esecuzione: esegui_blocchi(
+                    lavoro, esecuzione, uploaded_file, header_option, fogli, mappatura, data_riferimento, comuni_db_data, risolutore,
+                    definizione_sedi, cache, strumentazione, chiave
+                )):
+                    return
+                elabora_a_blocchi(uploaded_file, header_option, fogli, mappatura, data_riferimento, comuni_db_data,
+                                  risolutore, definizione_sedi, cache, chiave)
+                if diagnostica:
+                    mostra_diagnostica(strumentazione)
+                return
+            
+            # Lettura completa delle sole colonne mappate
+            colonne = pipeline.colonne_mappate(mappatura)
+            chiave_lettura = chiave + (tuple(colonne),)
+            chiave = chiave_lettura + (tuple(mappatura.items()), compatto, data_riferimento)
+            # Distanze, segmentazione e download dipendono anche dalle sedi; le fasi precedenti no
+            chiave_segmenti = chiave + chiave_sedi(definizione_sedi)
+            
+            # Le fasi pesanti girano in background; al termine vengono mostrate dalla cache
+            if not lavoro_in_background(chiave_segmenti, lambda lavoro, esecuzione: esegui_fasi(
+                lavoro, esecuzione, uploaded_file, header_option, fogli, colonne, mappatura, compatto, data_riferimento,
+                comuni_db_data, risolutore, definizione_sedi, cache, strumentazione, chiave_lettura, chiave, chiave_segmenti
+            )):
+                return
+            
+            df = leggi_file(uploaded_file, header_option, fogli, colonne, cache, chiave_lettura)
+            if df is None:
+                return
+            
+            # Fasi della pipeline dalla cache (ricalcolate qui solo quelle uscite dalla cache)
+            with st.spinner('Elaborazione dei dati...'):
+                risultato, fasi = esegui_pipeline_in_cache(
+                    df, mappatura, compatto, data_riferimento, comuni_db_data, risolutore, definizione_sedi, chiave, chiave_segmenti,
+                    lambda *argomenti: ottieni_misurato(cache, *argomenti)
+                )
+            
+            mostra_formattazione(fasi['formattazione'][0], risultato.statistiche.formati_data_nascita)
             
-            with st.spinner('Calcolo dell\'Età e del gruppo di appartenenza...'):
-                df_mappato = aggiungi_eta_e_gruppo(df_mappato)
-                st.header("Dataframe con Età e Gruppo di Età")
-                st.dataframe(df_mappato.head())
+            st.subheader("Calcolo dell'età e gruppo di appartenenza")
+            st.header("Dataframe con Età e Gruppo di Età")
+            st.dataframe(fasi['eta'].head())
             
-            with st.spinner('Validazione dei dati...'):
-                lavorabili_data = validazione_dati(df_mappato)
+            st.subheader("Validazione dei dati")
+            mostra_validazione(fasi['validazione'], risultato.quasi_duplicati, cache, chiave)
             
             # --- Inizio Arricchimento Dati ---
             st.header("Arricchimento dei dati con informazioni dei comuni")
+            mostra_citta_non_risolte(risultato.statistiche.citta_non_trovate, risultato.statistiche.citta_ambigue)
+            st.success("Arricchimento dati completato!")
+            st.header("Dataframe arricchito")
+            st.dataframe(fasi['comuni'][0].head())
             
-            # Carica il database dei comuni
-            comuni_db_file_path = 'service/gi_comuni_cap.csv'  # Aggiorna il percorso se necessario
-            comuni_db_data = carica_comuni_db(comuni_db_file_path)
+            if definizione_sedi is not None:
+                mostra_distanze(risultato.statistiche)
             
-            if not comuni_db_data.empty:
-                with st.spinner('Arricchimento dei dati con provincia e regione...'):
-                    lavorabili_data = map_comune_info(lavorabili_data, comuni_db_data)
-                    st.success("Arricchimento dati completato!")
-                    st.header("Dataframe arricchito")
-                    st.dataframe(lavorabili_data.head())
-                
-                # Creazione dei grafici di distribuzione
-                with st.spinner('Creazione dei grafici di distribuzione...'):
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        crea_grafico_distribuzione_province(lavorabili_data)
-                    with col2:
-                        crea_grafico_distribuzione_residente(lavorabili_data)
-                
-                # --- Inizio Creazione dei Bottoni di Download ---
-                with st.spinner('Preparazione dei bottoni di download...'):
-                    crea_bottoni_download(lavorabili_data)
-            else:
-                st.error("Il database dei comuni non è stato caricato correttamente.")
+            lavorabili_data, segmentazione = risultato.lavorabili, risultato.segmentazione
+            
+            # Creazione dei grafici di distribuzione
+            with st.spinner('Creazione dei grafici di distribuzione...'):
+                col1, col2 = st.columns(2)
+                with col1:
+                    crea_grafico_distribuzione_province(segmentazione)
+                with col2:
+                    crea_grafico_distribuzione_residente(segmentazione)
+            
+            # --- Inizio Creazione dei Bottoni di Download ---
+            with st.spinner('Preparazione dei bottoni di download...'):
+                crea_bottoni_download(lavorabili_data, segmentazione, cache, chiave_segmenti)
+            
+            if diagnostica:
+                mostra_diagnostica(strumentazione)
         
         else:
             st.error("Impossibile caricare il file. Per favore verifica il formato e riprova.")
@@ -0,0 +1 @@
+# Suite di benchmark della pipeline su esportazioni sintetiche: `python -m benchmark --help`
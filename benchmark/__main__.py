@@ -0,0 +1,237 @@
+# Benchmark riproducibile delle fasi della pipeline, fuori da Streamlit: tempi e picchi di memoria per fase
+# scritti in JSON, con confronto rispetto a un'esecuzione di riferimento per individuare le regressioni
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from pipeline import (
+    COMUNI_DB_PATH, RisolutoreComuni, aggiungi_eta_e_gruppo, arricchisci_distanze, carica_comuni_db, cerca_quasi_duplicati, colonne_mappate, esportazione_segmenti,
+    formatta_dati, leggi_anteprima, leggi_file, map_comune_info, mappa_colonne, mappatura_predefinita,
+    memoria_residente_mb, normalizza_nome, segmenta, validazione_dati
+)
+
+from .generatore import RIGHE_MASSIME_XLSX, genera_export, scrivi_export
+
+CARTELLA_BENCHMARK = os.path.dirname(os.path.abspath(__file__))
+CARTELLA_DATI = os.path.join(CARTELLA_BENCHMARK, 'dati')
+CARTELLA_RISULTATI = os.path.join(CARTELLA_BENCHMARK, 'risultati')
+
+DIMENSIONI_PREDEFINITE = [10_000, 100_000, 1_000_000, 5_000_000]
+FORMATI = ('csv', 'xlsx')
+
+# Fasi misurate, nell'ordine di esecuzione
+FASI = ['leggi_file', 'formatta_dati', 'aggiungi_eta_e_gruppo', 'validazione_dati', 'cerca_quasi_duplicati', 'map_comune_info', 'risoluzione_citta',
+        'arricchisci_distanze',
+        'segmenta', 'esportazione_zip', 'esportazione_parquet', 'esportazione_xlsx']
+
+# Rapporto oltre il quale un tempo o un picco di memoria è considerato una regressione
+SOGLIA_REGRESSIONE = 1.2
+# Sotto questi valori le differenze sono rumore e non vengono segnalate
+SECONDI_MINIMI = 0.05
+MEMORIA_MINIMA_MB = 16
+
+# Intervallo di campionamento della memoria residente
+INTERVALLO_CAMPIONAMENTO = 0.005
+
+
+class MisuraFase:
+    """Misura tempo e picco di memoria residente di una fase.
+
+    Il picco è campionato da un thread in background durante la fase; dove /proc non è disponibile la memoria
+    letta è il picco dell'intero processo, che non scende tra una fase e l'altra.
+    """
+
+    def __init__(self):
+        self.secondi = 0.0
+        self.picco_mb = None
+        self._fine = threading.Event()
+
+    def _campiona(self):
+        while not self._fine.wait(INTERVALLO_CAMPIONAMENTO):
+            self.picco_mb = max(self.picco_mb, memoria_residente_mb())
+
+    def __enter__(self):
+        self.picco_mb = memoria_residente_mb()
+        self._thread = threading.Thread(target=self._campiona, daemon=True)
+        self._thread.start()
+        self._inizio = time.perf_counter()
+        return self
+
+    def __exit__(self, *eccezione):
+        self.secondi = time.perf_counter() - self._inizio
+        self._fine.set()
+        self._thread.join()
+        self.picco_mb = max(self.picco_mb, memoria_residente_mb())
+        return False
+
+
+# Funzione per preparare (o riusare) il file sintetico di una dimensione e un formato
+def prepara_file(righe, formato, seme, parametri):
+    os.makedirs(CARTELLA_DATI, exist_ok=True)
+    suffisso = '-'.join(f'{valore}' for valore in parametri.values())
+    percorso = os.path.join(CARTELLA_DATI, f'export_{righe}_{seme}_{suffisso}.{formato}')
+    if not os.path.exists(percorso):
+        inizio = time.perf_counter()
+        scrivi_export(genera_export(righe, seme, **parametri), percorso)
+        print(f'  generato {os.path.basename(percorso)} in {time.perf_counter() - inizio:.1f} s', flush=True)
+    return percorso
+
+
+# Funzione per eseguire le fasi della pipeline su un file, misurandole una per una
+def esegui_fasi(percorso, comuni_db_data, risolutore, data_riferimento):
+    misure = {}
+
+    def misura(fase, calcola):
+        with MisuraFase() as m:
+            risultato = calcola()
+        misure[fase] = m
+        return risultato
+
+    mappatura = mappatura_predefinita(leggi_anteprima(percorso, righe=0).columns)
+    grezzo = misura('leggi_file', lambda: leggi_file(percorso, 0, colonne_mappate(mappatura)))
+    righe = grezzo.shape[0]
+    formattato = misura('formatta_dati', lambda: formatta_dati(mappa_colonne(grezzo, mappatura), data_riferimento))
+    con_eta = misura('aggiungi_eta_e_gruppo', lambda: aggiungi_eta_e_gruppo(formattato, data_riferimento))
+    validazione = misura('validazione_dati', lambda: validazione_dati(con_eta))
+    misura('cerca_quasi_duplicati', lambda: cerca_quasi_duplicati(validazione.lavorabili))
+    lavorabili_data, _, _ = misura('map_comune_info', lambda: map_comune_info(validazione.lavorabili, comuni_db_data, risolutore))
+    # Risoluzione delle sole città distinte a memoria dei nomi normalizzati vuota, come alla prima esecuzione di un processo
+    normalizza_nome.cache_clear()
+    misura('risoluzione_citta', lambda: risolutore.risolvi_nomi(list(pd.unique(validazione.lavorabili['Città'].dropna()))))
+    # Distanze dalle sedi predefinite misurate a parte: i segmenti esportati restano quelli senza le colonne aggiunte
+    misura('arricchisci_distanze', lambda: arricchisci_distanze(lavorabili_data, comuni_db_data))
+    segmentazione = misura('segmenta', lambda: segmenta(lavorabili_data))
+    archivio = misura('esportazione_zip', lambda: esportazione_segmenti(lavorabili_data, segmentazione).zip(segmentazione.file_non_vuoti()))
+    misura('esportazione_parquet', lambda: esportazione_segmenti(lavorabili_data, segmentazione, formato='parquet').zip(segmentazione.file_non_vuoti()))
+    misura('esportazione_xlsx', lambda: esportazione_segmenti(lavorabili_data, segmentazione).xlsx())
+    return righe, len(archivio), misure
+
+
+# Funzione per raccogliere i metadati dell'esecuzione, per confrontare solo risultati confrontabili
+def metadati(argomenti, parametri):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=CARTELLA_BENCHMARK, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'data': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'piattaforma': platform.platform(),
+        'cpu': os.cpu_count(),
+        'seme': argomenti.seme,
+        'data_riferimento': argomenti.data_riferimento,
+        'parametri': parametri,
+    }
+
+
+# Funzione per confrontare due esecuzioni: restituisce le misure peggiorate oltre la soglia
+def confronta(risultati, riferimento, soglia=SOGLIA_REGRESSIONE):
+    precedenti = {(misura['righe'], misura['formato'], misura['fase']): misura for misura in riferimento['misure']}
+    regressioni = []
+    for misura in risultati['misure']:
+        precedente = precedenti.get((misura['righe'], misura['formato'], misura['fase']))
+        if precedente is None:
+            continue
+        for campo, minimo in (('secondi', SECONDI_MINIMI), ('picco_memoria_mb', MEMORIA_MINIMA_MB)):
+            attuale, prima = misura[campo], precedente[campo]
+            if attuale is None or prima is None or max(attuale, prima) < minimo:
+                continue
+            if attuale > max(prima, minimo) * soglia:
+                regressioni.append({**{k: misura[k] for k in ('righe', 'formato', 'fase')},
+                                    'campo': campo, 'prima': prima, 'attuale': attuale, 'rapporto': round(attuale / max(prima, minimo), 2)})
+    return regressioni
+
+
+def crea_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmark',
+        description='Misura tempi e picchi di memoria delle fasi della pipeline su esportazioni sintetiche.'
+    )
+    parser.add_argument('--righe', type=int, nargs='+', default=DIMENSIONI_PREDEFINITE,
+                        help='Dimensioni da misurare (predefinite: 10000 100000 1000000 5000000).')
+    parser.add_argument('--formati', nargs='+', choices=FORMATI, default=list(FORMATI),
+                        help=f'Formati dei file generati; i file XLSX oltre {RIGHE_MASSIME_XLSX} righe vengono saltati.')
+    parser.add_argument('--seme', type=int, default=0, help='Seme del generatore, per file riproducibili.')
+    parser.add_argument('--tasso-duplicati', type=float, default=0.05)
+    parser.add_argument('--tasso-email-non-valide', type=float, default=0.03)
+    parser.add_argument('--tasso-citta-sporche', type=float, default=0.2)
+    parser.add_argument('--data-riferimento', default='2025-01-01', help='Data di riferimento per l\'età (AAAA-MM-GG).')
+    parser.add_argument('-o', '--output', help='File JSON dei risultati (predefinito: benchmark/risultati/benchmark_<data>.json).')
+    parser.add_argument('--confronta', metavar='RIFERIMENTO', help='File JSON di un\'esecuzione precedente da confrontare.')
+    parser.add_argument('--soglia', type=float, default=SOGLIA_REGRESSIONE,
+                        help='Rapporto oltre il quale una misura è una regressione (predefinito: 1.2).')
+    return parser
+
+
+def main(argv=None):
+    argomenti = crea_parser().parse_args(argv)
+    parametri = {
+        'tasso_duplicati': argomenti.tasso_duplicati,
+        'tasso_email_non_valide': argomenti.tasso_email_non_valide,
+        'tasso_citta_sporche': argomenti.tasso_citta_sporche,
+    }
+    data_riferimento = pd.Timestamp(argomenti.data_riferimento)
+    risultati = {'metadati': metadati(argomenti, parametri), 'misure': []}
+
+    # Database dei comuni e risolutore vengono preparati una volta, come nell'app, e misurati a parte
+    with MisuraFase() as preparazione:
+        comuni_db_data = carica_comuni_db(COMUNI_DB_PATH)
+    with MisuraFase() as costruzione:
+        risolutore = RisolutoreComuni(comuni_db_data)
+    risultati['preparazione_comuni'] = {'secondi': round(preparazione.secondi, 4), 'picco_memoria_mb': round(preparazione.picco_mb, 1)}
+    risultati['costruzione_risolutore'] = {'secondi': round(costruzione.secondi, 4), 'picco_memoria_mb': round(costruzione.picco_mb, 1)}
+    print(f'Risolutore dei comuni costruito in {costruzione.secondi:.3f} s')
+
+    for righe in argomenti.righe:
+        for formato in argomenti.formati:
+            if formato == 'xlsx' and righe > RIGHE_MASSIME_XLSX:
+                print(f'{righe} righe {formato}: saltato (oltre il limite di un foglio Excel)')
+                continue
+            print(f'{righe} righe {formato}:', flush=True)
+            percorso = prepara_file(righe, formato, argomenti.seme, parametri)
+            righe_lette, dimensione_zip, misure = esegui_fasi(percorso, comuni_db_data, risolutore, data_riferimento)
+            for fase in FASI:
+                risultati['misure'].append({
+                    'righe': righe, 'formato': formato, 'fase': fase,
+                    'secondi': round(misure[fase].secondi, 4), 'picco_memoria_mb': round(misure[fase].picco_mb, 1),
+                })
+                print(f'  {fase:<24}{misure[fase].secondi:>9.3f} s{misure[fase].picco_mb:>10.0f} MB')
+                if fase == 'esportazione_zip':
+                    risultati['misure'][-1]['byte_zip'] = dimensione_zip
+            if righe_lette != righe:
+                print(f'  attenzione: lette {righe_lette} righe su {righe}')
+
+    percorso_output = argomenti.output or os.path.join(CARTELLA_RISULTATI, f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(percorso_output)), exist_ok=True)
+    with open(percorso_output, 'w', encoding='utf-8') as f:
+        json.dump(risultati, f, indent=2, ensure_ascii=False)
+    print(f'Risultati scritti in {percorso_output}')
+
+    if argomenti.confronta:
+        with open(argomenti.confronta, encoding='utf-8') as f:
+            regressioni = confronta(risultati, json.load(f), argomenti.soglia)
+        for regressione in regressioni:
+            print(f"Regressione: {regressione['fase']} ({regressione['righe']} righe {regressione['formato']}) "
+                  f"{regressione['campo']} {regressione['prima']} -> {regressione['attuale']} (x{regressione['rapporto']})")
+        if regressioni:
+            return 1
+        print('Nessuna regressione rispetto al riferimento.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
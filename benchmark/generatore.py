@@ -0,0 +1,121 @@
+# Generatore di esportazioni sintetiche di una sede, realistiche per distribuzione di errori e formati
+
+import os
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+from pipeline import COMUNI_DB_PATH, carica_comuni_db
+
+# Righe massime di un foglio Excel (esclusa l'intestazione)
+RIGHE_MASSIME_XLSX = 1_048_575
+
+# Nomi e cognomi di esempio, con particelle e apostrofi
+NOMI = ['Mario', 'Luca', 'Giulia', 'Anna', 'Francesca', 'Marco', 'Giuseppe', 'Chiara', 'Paolo', 'Sara',
+        'Alessandro', 'Martina', 'Andrea', 'Elena', 'Matteo', 'Valentina', 'Niccolò', 'Federica', 'Davide', 'Silvia']
+COGNOMI = ['Rossi', 'Bianchi', 'Romano', 'Colombo', 'Ricci', 'Marino', 'Greco', 'Bruno', 'Gallo', 'Conti',
+           "D'Angelo", "Dell'Acqua", 'De Luca', 'Di Stefano', 'Esposito', 'Ferrari', 'Lombardi', 'Moretti', 'Barbieri', 'Fontana']
+DOMINI_EMAIL = ['gmail.com', 'libero.it', 'hotmail.it', 'yahoo.it', 'outlook.com', 'alice.it', 'tiscali.it']
+
+# Quota dei record residenti in Liguria (la sede), il resto è distribuito su tutti i comuni
+QUOTA_LIGURIA = 0.6
+
+
+# Funzione per togliere gli accenti, come nelle esportazioni che perdono la codifica
+def _senza_accenti(testo):
+    return ''.join(c for c in unicodedata.normalize('NFKD', testo) if not unicodedata.combining(c))
+
+
+# Funzione per sporcare un nome di città come farebbe un operatore: maiuscole, accenti, refusi, abbreviazioni
+def _sporca_citta(nome, rng):
+    tipo = rng.integers(0, 6)
+    if tipo == 0:
+        return nome.upper()
+    if tipo == 1:
+        return f'  {nome.lower()} '
+    if tipo == 2:
+        return _senza_accenti(nome)
+    if tipo == 3 and len(nome) > 4:
+        # Refuso: un carattere cancellato
+        posizione = rng.integers(1, len(nome) - 1)
+        return nome[:posizione] + nome[posizione + 1:]
+    if tipo == 4 and nome.startswith('San '):
+        return 'S. ' + nome[4:]
+    return nome.replace(' ', '') if ' ' in nome else nome.lower()
+
+
+# Funzione per scrivere le date in formati misti: gg/mm/aaaa, aaaa-mm-gg hh:mm:ss, gg/mm/aa e seriali Excel
+def _date_miste(date, rng):
+    formato = rng.integers(0, 4, len(date))
+    seriali = (date - pd.Timestamp('1899-12-30')).days.astype(str)
+    return np.where(formato == 0, date.strftime('%d/%m/%Y'),
+           np.where(formato == 1, date.strftime('%Y-%m-%d %H:%M:%S'),
+           np.where(formato == 2, date.strftime('%d/%m/%y'), seriali)))
+
+
+# Funzione per generare un'esportazione sintetica. I tassi sono frazioni delle righe; le città sporche sono
+# ricavate dal database dei comuni; `colonne_extra` aggiunge colonne non mappate come nelle esportazioni reali.
+def genera_export(righe, seme=0, tasso_duplicati=0.05, tasso_email_non_valide=0.03, tasso_email_vuote=0.05,
+                  tasso_citta_sporche=0.2, tasso_date_non_valide=0.02, colonne_extra=10, comuni_db_path=COMUNI_DB_PATH):
+    rng = np.random.default_rng(seme)
+    comuni_db_data = carica_comuni_db(comuni_db_path)
+
+    # Comuni: una quota dalla Liguria, il resto da tutta Italia
+    liguria = np.flatnonzero((comuni_db_data['denominazione_regione'] == 'Liguria').to_numpy())
+    righe_comuni = np.where(
+        rng.random(righe) < QUOTA_LIGURIA,
+        rng.choice(liguria, righe),
+        rng.integers(0, len(comuni_db_data), righe)
+    )
+    citta = comuni_db_data['denominazione_ita'].to_numpy(dtype=object)[righe_comuni]
+    sporche = np.flatnonzero(rng.random(righe) < tasso_citta_sporche)
+    citta[sporche] = [_sporca_citta(nome, rng) for nome in citta[sporche]]
+
+    nomi = rng.choice(NOMI, righe)
+    cognomi = rng.choice(COGNOMI, righe)
+    date = pd.Timestamp('1940-01-01') + pd.to_timedelta(rng.integers(0, 30_000, righe), unit='D')
+    date_nascita = _date_miste(date, rng)
+    date_nascita[rng.random(righe) < tasso_date_non_valide] = 'non disponibile'
+
+    # Parte locale dal cognome senza apostrofi e spazi, così le sole email non valide sono quelle volute
+    locali = np.array([cognome.lower().replace("'", '').replace(' ', '') for cognome in COGNOMI])[rng.integers(0, len(COGNOMI), righe)]
+    email = np.char.add(np.char.add(locali, rng.integers(0, 10**7, righe).astype(str)), '@')
+    email = np.char.add(email, rng.choice(DOMINI_EMAIL, righe)).astype(object)
+    email[rng.random(righe) < tasso_email_non_valide] = 'email.non.valida'
+    # Duplicati: email copiate da altre righe
+    duplicati = np.flatnonzero(rng.random(righe) < tasso_duplicati)
+    email[duplicati] = email[rng.integers(0, righe, len(duplicati))]
+    email[rng.random(righe) < tasso_email_vuote] = None
+
+    df = pd.DataFrame({
+        'Nome': nomi,
+        'Cognome': cognomi,
+        'Sesso': rng.choice(['M', 'F'], righe),
+        'Data_Nascita': date_nascita,
+        'Città': citta,
+        'Email': email,
+        'Provincia': comuni_db_data['sigla_provincia'].to_numpy(dtype=object)[righe_comuni],
+    })
+    for i in range(1, colonne_extra + 1):
+        df[f'Campo_{i}'] = rng.integers(0, 10**6, righe)
+    return df
+
+
+# Funzione per scrivere l'esportazione in CSV o XLSX (in modalità write-only, molto più veloce per file grandi)
+def scrivi_export(df, percorso):
+    if percorso.endswith('.csv'):
+        df.to_csv(percorso, index=False)
+        return percorso
+    if len(df) > RIGHE_MASSIME_XLSX:
+        raise ValueError(f"Un foglio Excel contiene al massimo {RIGHE_MASSIME_XLSX} righe di dati.")
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    foglio = workbook.create_sheet()
+    foglio.append(list(df.columns))
+    for riga in df.itertuples(index=False):
+        foglio.append([None if isinstance(valore, float) and np.isnan(valore) else valore for valore in riga])
+    temporaneo = f'{percorso}.tmp'
+    workbook.save(temporaneo)
+    os.replace(temporaneo, percorso)
+    return percorso
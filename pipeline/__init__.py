@@ -0,0 +1,117 @@
+# Motore della pipeline di validazione, modellazione e arricchimento dati, indipendente da Streamlit
+
+from .blocchi import ContatoreChiavi, DuplicatiGlobali, conta_duplicati, elabora_a_blocchi
+from .cache import DIMENSIONE_CACHE_FASI, CacheFasi, impronta_contenuto
+from .comuni import (
+    COLONNE_ARRICCHIMENTO,
+    COLONNE_NUMERICHE,
+    COMUNI_DB_PATH,
+    VERSIONE_INDICE,
+    carica_comuni_db,
+    compila_comuni_db,
+    costruisci_comuni_db,
+    map_comune_info,
+)
+from .esportazione import (
+    FILE_ZIP_SEGMENTI,
+    CartellaCsv,
+    Esportazione,
+    EsportazioneCompressa,
+    EsportazioneCsv,
+    OpzioniEsportazione,
+    VoceZipIncrementale,
+    crea_zip_segmenti,
+    esportazione_segmenti,
+    scrivi_output,
+    scrivi_parquet_partizionato,
+    sorgenti_fasce,
+    sorgenti_segmenti,
+)
+from .date_nascita import FORMATI_DATA, CampioneDate, converti_date_nascita, formatta_date
+from .formati import (
+    CARTELLA_PARQUET_PARTIZIONATO,
+    COLONNE_PARTIZIONE,
+    FILE_PARQUET_PARTIZIONATO,
+    FILE_XLSX_SEGMENTI,
+    FORMATI,
+    Formato,
+    csv_bytes,
+    csv_gz_bytes,
+    formato_esportazione,
+    nome_nel_formato,
+    parquet_bytes,
+    parquet_partizionato,
+    registra_formato,
+    tabella_arrow,
+    xlsx_bytes,
+    zip_non_compresso,
+)
+from .formattazione import (
+    COLONNE_CATEGORICHE_COMPATTE,
+    ETICHETTA_ETA_SCONOSCIUTA,
+    ETICHETTE_FASCE_ETA,
+    LIMITI_FASCE_ETA,
+    aggiungi_data_nascita,
+    aggiungi_eta_e_gruppo,
+    calcola_eta,
+    calcola_fascia_eta,
+    compatta_tipi,
+    formatta_dati,
+    formatta_testi,
+    titolo_nome,
+    trasforma_valori_unici,
+)
+from .geo import (
+    COLONNE_DISTANZA,
+    FILE_ZIP_FASCE,
+    PREFISSO_FILE_FASCIA,
+    RAGGI_KM,
+    RAGGIO_TERRA_KM,
+    SEDI_LIGURIA,
+    DefinizioneSedi,
+    arricchisci_distanze,
+    conteggi_fasce,
+    conteggi_sedi,
+    coordinate_sedi,
+    file_fascia,
+    haversine_km,
+    leggi_definizione_sedi,
+    posizioni_fasce,
+)
+from .lavori import ANNULLATO, COMPLETATO, ERRORE, IN_CORSO, Lavoro, LavoroAnnullato
+from .lettura import (
+    CAMPI_OPZIONALI,
+    CAMPI_RICHIESTI,
+    RIGHE_PER_BLOCCO,
+    colonne_mappate,
+    e_csv,
+    elenca_fogli,
+    leggi_anteprima,
+    leggi_blocchi,
+    leggi_file,
+    mappa_colonne,
+    mappatura_predefinita,
+)
+from .motore import RisultatoPipeline, Statistiche, elabora_record, esecutore_misurato, esegui_pipeline, prepara_record
+from .quasi_duplicati import (
+    COLONNA_GRUPPO,
+    COLONNA_SOMIGLIANZA,
+    DIMENSIONE_MASSIMA_BLOCCO,
+    FILE_QUASI_DUPLICATI,
+    SOGLIA_SOMIGLIANZA,
+    cerca_quasi_duplicati,
+    normalizza_persona,
+)
+from .risoluzione import SOGLIA_CONFIDENZA, RisolutoreComuni, normalizza_nome, normalizza_testo
+from .segmentazione import SEGMENTI_LIGURIA, DefinizioneSegmenti, Segmentazione, segmenta
+from .strumentazione import Misura, Strumentazione, memoria_residente_mb, misura_fase
+from .unione import (
+    COLONNA_FILE_ORIGINE,
+    RisultatoUnione,
+    StatisticheFile,
+    elabora_e_unisci,
+    mese_per_primo_unione,
+    nomi_sorgenti,
+    prepara_file,
+)
+from .validazione import RisultatoValidazione, StatisticheValidazione, maschera_email_valide, maschere_duplicati, valida_email, validazione_dati
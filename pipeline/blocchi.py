@@ -0,0 +1,194 @@
+# Elaborazione a blocchi per file più grandi della memoria: il file viene letto due volte a blocchi di righe,
+# la prima per contare le chiavi dei duplicati sull'intero file, la seconda per elaborare e scrivere i segmenti
+
+from dataclasses import fields
+
+import numpy as np
+import pandas as pd
+
+from .date_nascita import CampioneDate
+from .formattazione import formatta_testi
+from .geo import posizioni_fasce
+from .lettura import RIGHE_PER_BLOCCO, colonne_mappate, leggi_anteprima, leggi_blocchi, mappatura_predefinita
+from .motore import Statistiche, esegui_pipeline
+from .segmentazione import SEGMENTI_LIGURIA
+from .strumentazione import misura_fase
+from .validazione import StatisticheValidazione
+
+# Campi che identificano i duplicati
+CAMPI_DUPLICATI = ['Email', 'Nome', 'Cognome']
+
+# Moltiplicatore dispari per combinare gli hash dei campi della terna (aritmetica modulo 2^64)
+_MOLTIPLICATORE_HASH = np.uint64(0x9E3779B97F4A7C15)
+
+# Chiavi in attesa oltre le quali il contatore le unisce alla tabella ordinata (almeno questa soglia)
+_UNIONE_MINIMA = 1 << 16
+
+
+class ContatoreChiavi:
+    """Conteggio compatto di chiavi hash a 64 bit, saturato a 2: basta per sapere se una chiave è ripetuta.
+
+    Le chiavi di ogni blocco vengono ridotte ai valori distinti e unite periodicamente a un array ordinato
+    (9 byte per chiave distinta); la ricerca usa la ricerca binaria. Con hash a 64 bit la probabilità di
+    collisione è trascurabile anche con centinaia di milioni di chiavi.
+    """
+
+    def __init__(self):
+        self._chiavi = np.empty(0, dtype=np.uint64)
+        self._conteggi = np.empty(0, dtype=np.uint8)
+        self._in_attesa = []
+        self._numero_in_attesa = 0
+
+    def __len__(self):
+        self._unisci()
+        return len(self._chiavi)
+
+    def aggiungi(self, chiavi):
+        uniche, conteggi = np.unique(chiavi, return_counts=True)
+        self._in_attesa.append((uniche, np.minimum(conteggi, 2).astype(np.uint8)))
+        self._numero_in_attesa += len(uniche)
+        # Unione quando le chiavi in attesa superano la tabella: costo complessivo quasi lineare
+        if self._numero_in_attesa > max(len(self._chiavi), _UNIONE_MINIMA):
+            self._unisci()
+
+    def _unisci(self):
+        if not self._in_attesa:
+            return
+        chiavi = np.concatenate([self._chiavi] + [uniche for uniche, _ in self._in_attesa])
+        conteggi = np.concatenate([self._conteggi] + [conteggi for _, conteggi in self._in_attesa])
+        self._chiavi, inverso = np.unique(chiavi, return_inverse=True)
+        self._conteggi = np.minimum(np.bincount(inverso, weights=conteggi), 2).astype(np.uint8)
+        self._in_attesa, self._numero_in_attesa = [], 0
+
+    # Funzione per sapere quali chiavi compaiono più di una volta nell'intero file
+    def ripetute(self, chiavi):
+        self._unisci()
+        if len(self._chiavi) == 0:
+            return np.zeros(len(chiavi), dtype=bool)
+        posizioni = np.minimum(np.searchsorted(self._chiavi, chiavi), len(self._chiavi) - 1)
+        return (self._chiavi[posizioni] == chiavi) & (self._conteggi[posizioni] >= 2)
+
+
+# Funzione per calcolare le chiavi hash di Email e della terna Email, Nome, Cognome, con le maschere delle righe
+# in cui i campi sono presenti (le righe con campi vuoti non sono mai duplicati). L'hash dell'Email (quasi sempre
+# distinta) è calcolato direttamente; Nome e Cognome, con pochi valori distinti, sui valori distinti
+def chiavi_duplicati(df):
+    email_presenti = df['Email'].notna().to_numpy()
+    terne_presenti = df[CAMPI_DUPLICATI].notna().all(axis=1).to_numpy()
+    chiavi_email = pd.util.hash_array(df['Email'].to_numpy(dtype=object), categorize=False)
+    chiavi_terne = chiavi_email
+    for campo in CAMPI_DUPLICATI[1:]:
+        chiavi_terne = chiavi_terne * _MOLTIPLICATORE_HASH + pd.util.hash_array(df[campo].to_numpy(dtype=object))
+    return email_presenti, chiavi_email, terne_presenti, chiavi_terne
+
+
+class DuplicatiGlobali:
+    """Duplicati calcolati sull'intero file: Email ripetute e terne Email, Nome, Cognome ripetute."""
+
+    def __init__(self):
+        self.email = ContatoreChiavi()
+        self.terne = ContatoreChiavi()
+
+    def aggiungi(self, df):
+        email_presenti, chiavi_email, terne_presenti, chiavi_terne = chiavi_duplicati(df)
+        self.email.aggiungi(chiavi_email[email_presenti])
+        self.terne.aggiungi(chiavi_terne[terne_presenti])
+
+    # Maschere dei duplicati di un blocco, nella forma attesa da validazione_dati
+    def maschere(self, df):
+        email_presenti, chiavi_email, terne_presenti, chiavi_terne = chiavi_duplicati(df)
+        return (
+            pd.Series(email_presenti & self.email.ripetute(chiavi_email), index=df.index),
+            pd.Series(terne_presenti & self.terne.ripetute(chiavi_terne), index=df.index)
+        )
+
+
+# Funzione per la prima lettura: solo Email, Nome e Cognome, formattati come nella pipeline, per contare le chiavi.
+# Con un `campione_date` (CampioneDate) viene letta anche la data di nascita, per decidere l'ordine delle date a barre
+# sull'intero file
+def conta_duplicati(sorgente, mappatura, header_option=0, fogli=0, righe_per_blocco=RIGHE_PER_BLOCCO, campione_date=None):
+    duplicati = DuplicatiGlobali()
+    campi = CAMPI_DUPLICATI + (['Data_Nascita'] if campione_date is not None else [])
+    colonne = list(dict.fromkeys(mappatura[campo] for campo in campi))
+    for blocco in leggi_blocchi(sorgente, header_option, colonne, fogli, righe_per_blocco):
+        duplicati.aggiungi(formatta_testi(pd.DataFrame({campo: blocco[mappatura[campo]] for campo in CAMPI_DUPLICATI})))
+        if campione_date is not None:
+            campione_date.aggiungi(blocco[mappatura['Data_Nascita']])
+    return duplicati
+
+
+# Funzione per sommare le statistiche di un blocco a quelle complessive
+def somma_statistiche(totale, blocco):
+    totale.righe_lette += blocco.righe_lette
+    for formato, numero in blocco.formati_data_nascita.items():
+        totale.formati_data_nascita[formato] = totale.formati_data_nascita.get(formato, 0) + numero
+    for campo in fields(StatisticheValidazione):
+        setattr(totale.validazione, campo.name, getattr(totale.validazione, campo.name) + getattr(blocco.validazione, campo.name))
+    totale.citta_non_trovate = list(dict.fromkeys(totale.citta_non_trovate + blocco.citta_non_trovate))
+    totale.citta_ambigue = list(dict.fromkeys(totale.citta_ambigue + blocco.citta_ambigue))
+    for file_name, numero in blocco.righe_per_segmento.items():
+        totale.righe_per_segmento[file_name] = totale.righe_per_segmento.get(file_name, 0) + numero
+    for fascia, numero in blocco.righe_per_fascia_distanza.items():
+        totale.righe_per_fascia_distanza[fascia] = totale.righe_per_fascia_distanza.get(fascia, 0) + numero
+    for sede, numero in blocco.righe_per_sede_vicina.items():
+        totale.righe_per_sede_vicina[sede] = totale.righe_per_sede_vicina.get(sede, 0) + numero
+    return totale
+
+
+# Funzione per elaborare un file a blocchi con memoria limitata: ogni blocco attraversa formattazione, età,
+# validazione (con i duplicati dell'intero file), comuni e segmentazione, e i suoi record vengono aggiunti ai file
+# di `esportazione` (CartellaCsv o EsportazioneCompressa). Restituisce le statistiche complessive e l'elenco dei
+# segmenti non vuoti da mettere nell'archivio ZIP. `progresso(righe_elaborate)` riceve l'avanzamento; con una
+# `definizione_sedi` i record di ogni blocco ricevono anche le distanze dalle sedi e vengono aggiunti ai file delle
+# fasce di distanza; con `compatto=True` ogni blocco
+# usa i tipi compatti. I quasi duplicati non vengono cercati: richiederebbero tutti i lavorabili insieme.
+def elabora_a_blocchi(sorgente, esportazione, comuni_db_data, header_option=0, mappatura=None, data_riferimento=None,
+                      risolutore=None, definizione_segmenti=SEGMENTI_LIGURIA, fogli=0, righe_per_blocco=RIGHE_PER_BLOCCO,
+                      strumentazione=None, progresso=None, definizione_sedi=None, compatto=False):
+    if data_riferimento is None:
+        data_riferimento = pd.Timestamp.today().normalize()
+    data_riferimento = pd.Timestamp(data_riferimento)
+    if mappatura is None:
+        mappatura = mappatura_predefinita(leggi_anteprima(sorgente, header_option, fogli[0] if isinstance(fogli, list) else fogli, righe=0).columns)
+    colonne = colonne_mappate(mappatura)
+
+    # Prima lettura: duplicati e ordine delle date a barre, decisi sull'intero file come nell'elaborazione normale
+    campione_date = CampioneDate()
+    with misura_fase(strumentazione, 'conteggio_duplicati') as misura:
+        duplicati = conta_duplicati(sorgente, mappatura, header_option, fogli, righe_per_blocco, campione_date)
+        misura.righe_out = len(duplicati.email)
+    mese_primo = campione_date.mese_per_primo()
+
+    statistiche = Statistiche(data_riferimento=data_riferimento.strftime('%Y-%m-%d'))
+    statistiche.righe_per_segmento = {file_name: 0 for file_name, _, _, _ in definizione_segmenti.combinazioni()}
+    intestazioni_scritte = set()
+
+    # I record di ogni blocco vengono aggiunti ai rispettivi file; l'intestazione solo alla prima scrittura
+    def scrivi(nome, df):
+        if df.shape[0] == 0:
+            return
+        esportazione.aggiungi(nome, df.to_csv(index=False, header=nome not in intestazioni_scritte).encode('utf-8'))
+        intestazioni_scritte.add(nome)
+
+    for numero, blocco in enumerate(leggi_blocchi(sorgente, header_option, colonne, fogli, righe_per_blocco), start=1):
+        with misura_fase(strumentazione, 'blocco', blocco.shape[0], dettaglio=str(numero)) as misura:
+            risultato = esegui_pipeline(blocco, comuni_db_data, mappatura, data_riferimento, risolutore, definizione_segmenti, compatto,
+                                        duplicati=duplicati.maschere, cerca_simili=False, definizione_sedi=definizione_sedi,
+                                        mese_primo=mese_primo)
+            segmentazione = risultato.segmentazione
+            scrivi('data_manuale_email.csv', risultato.scaricabili_email)
+            scrivi('data_manuale_no_email.csv', risultato.scaricabili_no_email)
+            scrivi(definizione_segmenti.file_fuori_province, segmentazione.segmento(risultato.lavorabili, definizione_segmenti.file_fuori_province))
+            for file_name in segmentazione.file_non_vuoti():
+                scrivi(file_name, segmentazione.segmento(risultato.lavorabili, file_name))
+            if definizione_sedi is not None:
+                for file_name, posizioni in posizioni_fasce(risultato.lavorabili).items():
+                    scrivi(file_name, risultato.lavorabili.iloc[posizioni])
+            somma_statistiche(statistiche, risultato.statistiche)
+            misura.righe_out = risultato.lavorabili.shape[0]
+        del blocco, risultato, segmentazione
+        if progresso is not None:
+            progresso(statistiche.righe_lette)
+
+    file_zip = [file_name for file_name, numero in statistiche.righe_per_segmento.items() if numero > 0]
+    return statistiche, file_zip
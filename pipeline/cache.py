@@ -0,0 +1,59 @@
+# Cache dei risultati delle fasi della pipeline, con dimensione limitata ed espulsione LRU
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Numero massimo di risultati conservati per cache (una cache per sessione dell'app)
+DIMENSIONE_CACHE_FASI = 16
+
+
+# Funzione per calcolare l'impronta del contenuto di un file caricato: un hash veloce dei bytes,
+# molto più economico dell'hashing di un DataFrame
+def impronta_contenuto(contenuto):
+    return f'{len(contenuto)}-{hashlib.blake2b(contenuto, digest_size=16).hexdigest()}'
+
+
+class CacheFasi:
+    """Cache esplicita dei risultati delle fasi.
+
+    La chiave di una fase è composta dalla chiave della fase precedente più i propri parametri, così cambiare
+    una scelta ricalcola solo le fasi a valle. I risultati sono condivisi: le fasi non devono modificarli.
+    Può essere usata insieme dallo script e da un lavoro in background: il calcolo avviene fuori dal lock.
+    """
+
+    def __init__(self, dimensione_massima=DIMENSIONE_CACHE_FASI):
+        self.dimensione_massima = dimensione_massima
+        self.riusati = 0
+        self.calcolati = 0
+        self._risultati = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._risultati)
+
+    # Funzione per ottenere il risultato di una fase, calcolandolo solo se non è in cache
+    def ottieni(self, fase, chiave, calcola):
+        return self.ottieni_con_esito(fase, chiave, calcola)[0]
+
+    # Funzione per ottenere il risultato di una fase e se è stato riusato dalla cache (True) o calcolato (False):
+    # l'esito è quello di questa lettura, anche se un lavoro in background usa la cache nello stesso momento
+    def ottieni_con_esito(self, fase, chiave, calcola):
+        chiave = (fase, chiave)
+        with self._lock:
+            if chiave in self._risultati:
+                self._risultati.move_to_end(chiave)
+                self.riusati += 1
+                return self._risultati[chiave], True
+        risultato = calcola()
+        with self._lock:
+            self.calcolati += 1
+            self._risultati[chiave] = risultato
+            # Espulsione dei risultati usati meno di recente
+            while len(self._risultati) > self.dimensione_massima:
+                self._risultati.popitem(last=False)
+        return risultato, False
+
+    def svuota(self):
+        with self._lock:
+            self._risultati.clear()
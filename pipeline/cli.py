@@ -0,0 +1,315 @@
+# Interfaccia a riga di comando per l'elaborazione batch di uno o più file
+
+import argparse
+import json
+import logging
+import os
+import sys
+from dataclasses import asdict
+
+import pandas as pd
+
+from .blocchi import elabora_a_blocchi
+from .comuni import COMUNI_DB_PATH, carica_comuni_db, compila_comuni_db
+from .esportazione import (
+    FILE_ZIP_SEGMENTI,
+    CartellaCsv,
+    Esportazione,
+    EsportazioneCsv,
+    OpzioniEsportazione,
+    scrivi_output,
+    scrivi_parquet_partizionato,
+    sorgenti_fasce,
+    sorgenti_segmenti,
+)
+from .formati import CARTELLA_PARQUET_PARTIZIONATO, FILE_XLSX_SEGMENTI, FORMATI
+from .geo import RAGGI_KM, coordinate_sedi, leggi_definizione_sedi
+from .lettura import CAMPI_OPZIONALI, CAMPI_RICHIESTI, RIGHE_PER_BLOCCO, colonne_mappate, leggi_anteprima, leggi_file, mappatura_predefinita
+from .motore import esegui_pipeline
+from .quasi_duplicati import FILE_QUASI_DUPLICATI
+from .risoluzione import RisolutoreComuni
+from .segmentazione import SEGMENTI_LIGURIA, DefinizioneSegmenti
+from .strumentazione import Strumentazione, logger as logger_strumentazione, misura_fase
+from .unione import elabora_e_unisci
+
+ESTENSIONI_SUPPORTATE = ('.csv', '.xls', '.xlsx', '.xlsm')
+
+
+# Funzione per elencare i file da elaborare (singolo file o cartella)
+def elenca_file(percorso):
+    if os.path.isdir(percorso):
+        return sorted(
+            os.path.join(percorso, nome) for nome in os.listdir(percorso)
+            if nome.lower().endswith(ESTENSIONI_SUPPORTATE)
+        )
+    return [percorso]
+
+
+# Funzione per interpretare le opzioni --colonna CAMPO=COLONNA
+def leggi_mappatura(opzioni):
+    if not opzioni:
+        return None
+    mappatura = {}
+    for opzione in opzioni:
+        campo, sep, colonna = opzione.partition('=')
+        if not sep or (campo not in CAMPI_RICHIESTI and campo not in CAMPI_OPZIONALI):
+            campi = CAMPI_RICHIESTI + list(CAMPI_OPZIONALI)
+            raise ValueError(f"Mappatura non valida: '{opzione}'. Usa CAMPO=COLONNA con CAMPO tra {', '.join(campi)}.")
+        mappatura[campo] = colonna
+    return mappatura
+
+
+# Funzione per interpretare l'opzione --province "Genova:ge,Savona:sv"
+def leggi_definizione_segmenti(province, file_fuori_province):
+    if not province:
+        return DefinizioneSegmenti(file_fuori_province=file_fuori_province or SEGMENTI_LIGURIA.file_fuori_province)
+    definizione = {}
+    for voce in province.split(','):
+        provincia, sep, sigla = voce.partition(':')
+        if not sep or not provincia.strip() or not sigla.strip():
+            raise ValueError(f"Provincia non valida: '{voce}'. Usa NOME:SIGLA, es. Genova:ge.")
+        definizione[provincia.strip()] = sigla.strip().lower()
+    return DefinizioneSegmenti(definizione, file_fuori_province or 'data_fuori_province.csv')
+
+
+# Funzione per interpretare le opzioni --foglio (nome o indice del foglio Excel)
+def leggi_fogli(opzioni):
+    if not opzioni:
+        return 0
+    fogli = [int(foglio) if foglio.isdigit() else foglio for foglio in opzioni]
+    return fogli[0] if len(fogli) == 1 else fogli
+
+
+# Funzione per scrivere gli output di un risultato della pipeline: file CSV per la gestione manuale, segmenti nel
+# formato scelto, archivio ZIP e, se richiesti, cartella Excel e dataset Parquet partizionato
+def scrivi_risultato(cartella_output, risultato, strumentazione=None, opzioni_esportazione=None):
+    opzioni = opzioni_esportazione or OpzioniEsportazione()
+    segmentazione = risultato.segmentazione
+    manuali = {}
+    if not risultato.scaricabili_email.empty:
+        manuali['data_manuale_email.csv'] = risultato.scaricabili_email
+    if not risultato.scaricabili_no_email.empty:
+        manuali['data_manuale_no_email.csv'] = risultato.scaricabili_no_email
+    if risultato.quasi_duplicati is not None and not risultato.quasi_duplicati.empty:
+        manuali[FILE_QUASI_DUPLICATI] = risultato.quasi_duplicati
+    scrivi_output(cartella_output, EsportazioneCsv(manuali, strumentazione))
+
+    # L'archivio contiene i soli segmenti per provincia e residente_citta, con i file già serializzati;
+    # la cartella Excel ha un foglio per ogni segmento, compreso quello fuori dalle province di interesse
+    segmenti = Esportazione(sorgenti_segmenti(risultato.lavorabili, segmentazione), strumentazione, opzioni.formato)
+    scrivi_output(cartella_output, segmenti, segmentazione.file_non_vuoti(), segmenti.nomi() if opzioni.xlsx else None)
+    # Con le distanze dalle sedi, anche un file per ogni fascia di distanza non vuota
+    if 'fascia_distanza' in risultato.lavorabili:
+        scrivi_output(cartella_output, Esportazione(sorgenti_fasce(risultato.lavorabili), strumentazione, opzioni.formato))
+    if opzioni.partiziona:
+        scrivi_parquet_partizionato(cartella_output, risultato.lavorabili, strumentazione)
+
+
+# Funzione per elaborare un singolo file e scriverne gli output
+def elabora_file(percorso, cartella_output, comuni_db_data, header_option=0, mappatura=None, data_riferimento=None, risolutore=None,
+                 definizione_segmenti=SEGMENTI_LIGURIA, fogli=0, compatto=False, strumentazione=None, righe_per_blocco=None,
+                 opzioni_esportazione=None, definizione_sedi=None):
+    # Prima l'intestazione, poi la lettura delle sole colonne mappate
+    intestazione = leggi_anteprima(percorso, header_option, fogli[0] if isinstance(fogli, list) else fogli, righe=0).columns
+    # Le colonne non indicate restano sulla mappatura predefinita
+    mappatura = {**mappatura_predefinita(intestazione), **(mappatura or {})}
+    if righe_per_blocco:
+        return elabora_file_a_blocchi(percorso, cartella_output, comuni_db_data, header_option, mappatura, data_riferimento, risolutore,
+                                      definizione_segmenti, fogli, strumentazione, righe_per_blocco, definizione_sedi, compatto)
+    with misura_fase(strumentazione, 'lettura') as misura:
+        df = leggi_file(percorso, header_option, colonne_mappate(mappatura), fogli)
+        misura.righe_out = df.shape[0]
+    risultato = esegui_pipeline(df, comuni_db_data, mappatura, data_riferimento, risolutore, definizione_segmenti, compatto, strumentazione,
+                                definizione_sedi=definizione_sedi)
+    scrivi_risultato(cartella_output, risultato, strumentazione, opzioni_esportazione)
+    with open(os.path.join(cartella_output, 'statistiche.json'), 'w', encoding='utf-8') as f:
+        json.dump(asdict(risultato.statistiche), f, ensure_ascii=False, indent=2)
+    return risultato.statistiche
+
+
+# Funzione per elaborare un file a blocchi, con memoria limitata: i CSV vengono scritti blocco per blocco
+# (senza il file dei quasi duplicati)
+def elabora_file_a_blocchi(percorso, cartella_output, comuni_db_data, header_option, mappatura, data_riferimento, risolutore,
+                           definizione_segmenti, fogli, strumentazione, righe_per_blocco, definizione_sedi=None, compatto=False):
+    cartella = CartellaCsv(cartella_output)
+    statistiche, file_zip = elabora_a_blocchi(percorso, cartella, comuni_db_data, header_option, mappatura, data_riferimento, risolutore,
+                                              definizione_segmenti, fogli, righe_per_blocco, strumentazione,
+                                              definizione_sedi=definizione_sedi, compatto=compatto)
+    if file_zip:
+        with open(os.path.join(cartella_output, FILE_ZIP_SEGMENTI), 'wb') as f:
+            cartella.scrivi_zip(f, file_zip)
+    with open(os.path.join(cartella_output, 'statistiche.json'), 'w', encoding='utf-8') as f:
+        json.dump(asdict(statistiche), f, ensure_ascii=False, indent=2)
+    return statistiche
+
+
+# Funzione per elaborare più file in parallelo e scrivere un solo insieme di output; le statistiche riportano
+# anche i conteggi di ogni file
+def elabora_file_uniti(percorsi, cartella_output, comuni_db_path=COMUNI_DB_PATH, header_option=0, mappatura=None, data_riferimento=None,
+                       definizione_segmenti=SEGMENTI_LIGURIA, fogli=0, processi=None, strumentazione=None, opzioni_esportazione=None,
+                       definizione_sedi=None, compatto=False, risolutore=None):
+    unione = elabora_e_unisci(percorsi, comuni_db_path, header_option, mappatura, data_riferimento, definizione_segmenti, fogli,
+                              processi, strumentazione, definizione_sedi=definizione_sedi, compatto=compatto, risolutore=risolutore)
+    scrivi_risultato(cartella_output, unione.risultato, strumentazione, opzioni_esportazione)
+    with open(os.path.join(cartella_output, 'statistiche.json'), 'w', encoding='utf-8') as f:
+        json.dump({**asdict(unione.risultato.statistiche), 'file': [asdict(statistiche) for statistiche in unione.file]},
+                  f, ensure_ascii=False, indent=2)
+    return unione
+
+
+def crea_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m pipeline',
+        description="Validazione, modellazione e arricchimento di liste utente senza interfaccia Streamlit."
+    )
+    parser.add_argument('input', nargs='*', help="File CSV/Excel o cartelle di file da elaborare")
+    parser.add_argument('-o', '--output', default='output', help="Cartella di destinazione (default: output)")
+    parser.add_argument('--senza-intestazione', action='store_true', help="Il file non ha una riga di intestazione")
+    parser.add_argument('--colonna', action='append', metavar='CAMPO=COLONNA',
+                        help="Mappatura esplicita di un campo (ripetibile), es. --colonna Città=Comune")
+    parser.add_argument('--foglio', action='append', metavar='FOGLIO',
+                        help="Foglio Excel da elaborare, per nome o indice (ripetibile: i fogli sono letti in parallelo e concatenati)")
+    parser.add_argument('--data-riferimento', type=pd.Timestamp, default=None,
+                        help="Data (AAAA-MM-GG) rispetto a cui calcolare l'età (default: oggi)")
+    parser.add_argument('--province', metavar='NOME:SIGLA,...',
+                        help="Province di interesse per i segmenti (default: Genova:ge,Savona:sv,La Spezia:sp,Imperia:im)")
+    parser.add_argument('--file-fuori-province', metavar='NOME_FILE',
+                        help="Nome del file con i record fuori dalle province di interesse")
+    parser.add_argument('--compatto', action='store_true',
+                        help="Modalità a basso consumo di memoria: tipi compatti e nessuna copia dei sottoinsiemi")
+    parser.add_argument('--blocchi', type=int, nargs='?', const=RIGHE_PER_BLOCCO, metavar='RIGHE',
+                        help=f"Elabora il file a blocchi di RIGHE righe (default: {RIGHE_PER_BLOCCO}) con memoria limitata, "
+                             "per file più grandi della RAM; i duplicati sono comunque calcolati sull'intero file, mentre i "
+                             f"quasi duplicati non vengono cercati (nessun {FILE_QUASI_DUPLICATI})")
+    parser.add_argument('--unisci', action='store_true',
+                        help="Elabora i file in parallelo e li unisce in un solo insieme di segmenti, con i duplicati "
+                             "calcolati su tutti i file e la colonna file_origine")
+    parser.add_argument('--processi', type=int, metavar='N',
+                        help="Processi usati con --unisci (default: numero di CPU)")
+    parser.add_argument('--formato', choices=list(FORMATI), default='csv',
+                        help="Formato dei file dei segmenti e del loro archivio ZIP (default: csv); i file per la gestione "
+                             "manuale restano in CSV")
+    parser.add_argument('--xlsx', action='store_true',
+                        help=f"Scrive anche la cartella Excel {FILE_XLSX_SEGMENTI} con un foglio per segmento")
+    parser.add_argument('--partiziona', action='store_true',
+                        help=f"Scrive anche il dataset Parquet dei record lavorabili partizionato per provincia e "
+                             f"residente_citta nella sottocartella {CARTELLA_PARQUET_PARTIZIONATO}/")
+    parser.add_argument('--sedi', nargs='?', const='', metavar='SEDE,...',
+                        help="Aggiunge ai record la distanza dalla sede più vicina e la fascia di distanza. Ogni sede è un comune "
+                             "del database oppure NOME:LAT:LON (senza valore: Genova, Savona, La Spezia, Imperia)")
+    parser.add_argument('--raggi', metavar='KM,...',
+                        help=f"Limiti delle fasce di distanza in km, usati con --sedi (default: {','.join(map(str, RAGGI_KM))})")
+    parser.add_argument('--log-strutturati', action='store_true',
+                        help="Scrive su stderr una riga JSON per fase con tempi e conteggi (mai dati dei record)")
+    parser.add_argument('--metriche', metavar='FILE',
+                        help="Scrive le misure delle fasi in formato Prometheus, per un collector locale")
+    parser.add_argument('--comuni-db', default=COMUNI_DB_PATH, help="Percorso del database dei comuni")
+    parser.add_argument('--compila-comuni', action='store_true',
+                        help="Compila il database dei comuni nell'indice binario .arrow ed esci")
+    return parser
+
+
+def main(argv=None):
+    parser = crea_parser()
+    args = parser.parse_args(argv)
+
+    if args.compila_comuni:
+        try:
+            print(f"Indice dei comuni compilato in {compila_comuni_db(args.comuni_db)}")
+        except Exception as e:
+            print(f"Errore: {e}", file=sys.stderr)
+            return 2
+        return 0
+    if not args.input:
+        parser.error("specificare un file o una cartella da elaborare")
+    if args.unisci and args.blocchi:
+        parser.error("--unisci non può essere usato con --blocchi")
+    if args.raggi and args.sedi is None:
+        parser.error("--raggi va usato con --sedi")
+    if args.blocchi and (args.formato != 'csv' or args.xlsx or args.partiziona):
+        parser.error("con --blocchi i segmenti sono scritti solo in CSV: --formato, --xlsx e --partiziona non sono disponibili")
+    opzioni_esportazione = OpzioniEsportazione(args.formato, args.xlsx, args.partiziona)
+
+    header_option = None if args.senza_intestazione else 0
+    # Una sola data di riferimento per tutti i file del batch
+    data_riferimento = args.data_riferimento or pd.Timestamp.today().normalize()
+
+    try:
+        mappatura = leggi_mappatura(args.colonna)
+        fogli = leggi_fogli(args.foglio)
+        definizione_segmenti = leggi_definizione_segmenti(args.province, args.file_fuori_province)
+        definizione_sedi = leggi_definizione_sedi(args.sedi, args.raggi)
+        comuni_db_data = carica_comuni_db(args.comuni_db)
+        if definizione_sedi is not None:
+            # Sedi controllate subito: un comune sconosciuto è un errore di configurazione, non di un singolo file
+            coordinate_sedi(definizione_sedi, comuni_db_data)
+        # Indice dei nomi costruito una volta per tutto il batch
+        risolutore = RisolutoreComuni(comuni_db_data)
+    except Exception as e:
+        print(f"Errore: {e}", file=sys.stderr)
+        return 2
+
+    file_input = [percorso for sorgente in args.input for percorso in elenca_file(sorgente)]
+    if not file_input:
+        print(f"Nessun file CSV o Excel trovato in {', '.join(args.input)}", file=sys.stderr)
+        return 2
+
+    if args.log_strutturati:
+        gestore = logging.StreamHandler(sys.stderr)
+        gestore.setFormatter(logging.Formatter('%(message)s'))
+        logger_strumentazione.addHandler(gestore)
+        logger_strumentazione.setLevel(logging.INFO)
+    strumentazione = Strumentazione() if args.log_strutturati or args.metriche else None
+
+    if args.unisci:
+        return unisci_file(args, file_input, header_option, mappatura, data_riferimento, definizione_segmenti, fogli, strumentazione,
+                           opzioni_esportazione, definizione_sedi, risolutore)
+
+    errori = 0
+    for percorso in file_input:
+        # Con più file ogni output va in una sottocartella dedicata
+        cartella = args.output
+        if len(file_input) > 1 or any(os.path.isdir(sorgente) for sorgente in args.input):
+            cartella = os.path.join(args.output, os.path.splitext(os.path.basename(percorso))[0])
+        if strumentazione is not None:
+            strumentazione.nuova_esecuzione()
+        try:
+            statistiche = elabora_file(percorso, cartella, comuni_db_data, header_option, mappatura, data_riferimento, risolutore,
+                                       definizione_segmenti, fogli, args.compatto, strumentazione, args.blocchi, opzioni_esportazione,
+                                       definizione_sedi)
+        except Exception as e:
+            print(f"{percorso}: errore nell'elaborazione: {e}", file=sys.stderr)
+            errori += 1
+            continue
+        print(f"{percorso}: {statistiche.righe_lette} righe lette, "
+              f"{statistiche.validazione.numero_lavorabili} lavorabili -> {cartella}")
+    if args.metriche:
+        with open(args.metriche, 'w', encoding='utf-8') as f:
+            f.write(strumentazione.metriche_prometheus())
+    return 1 if errori else 0
+
+
+# Funzione per l'opzione --unisci: tutti i file in un solo insieme di output nella cartella di destinazione
+def unisci_file(args, file_input, header_option, mappatura, data_riferimento, definizione_segmenti, fogli, strumentazione,
+                opzioni_esportazione=None, definizione_sedi=None, risolutore=None):
+    if strumentazione is not None:
+        strumentazione.nuova_esecuzione()
+    try:
+        unione = elabora_file_uniti(file_input, args.output, args.comuni_db, header_option, mappatura, data_riferimento,
+                                    definizione_segmenti, fogli, args.processi, strumentazione, opzioni_esportazione,
+                                    definizione_sedi, args.compatto, risolutore)
+    except Exception as e:
+        print(f"Errore nell'elaborazione: {e}", file=sys.stderr)
+        return 1
+    for statistiche_file in unione.file:
+        if statistiche_file.errore:
+            print(f"{statistiche_file.file}: errore nell'elaborazione: {statistiche_file.errore}", file=sys.stderr)
+        else:
+            print(f"{statistiche_file.file}: {statistiche_file.righe_lette} righe lette, "
+                  f"{statistiche_file.validazione.numero_lavorabili} lavorabili ({statistiche_file.lavorabili_unione} dopo l'unione)")
+    statistiche = unione.risultato.statistiche
+    print(f"Totale: {statistiche.righe_lette} righe lette, {statistiche.validazione.numero_lavorabili} lavorabili -> {args.output}")
+    if args.metriche:
+        with open(args.metriche, 'w', encoding='utf-8') as f:
+            f.write(strumentazione.metriche_prometheus())
+    return 1 if any(statistiche_file.errore for statistiche_file in unione.file) else 0
@@ -0,0 +1,228 @@
+# Database dei comuni italiani e arricchimento con provincia, regione e CAP
+
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from .risoluzione import RisolutoreComuni, normalizza_nome
+
+try:
+    import pyarrow as pa
+    from pyarrow import ipc
+except ImportError:  # pragma: no cover - senza pyarrow si usa sempre il CSV
+    pa = ipc = None
+
+# Percorso predefinito del database dei comuni
+COMUNI_DB_PATH = 'service/gi_comuni_cap.csv'
+
+# Versione dello schema dell'artefatto: va incrementata a ogni modifica delle colonne salvate
+VERSIONE_INDICE = '4'
+
+# Colonne del CSV conservate nell'indice; le denominazioni ripetute diventano categoriche
+COLONNE_INDICE = ['codice_istat', 'denominazione_ita', 'denominazione_altra', 'sigla_provincia', 'denominazione_provincia', 'denominazione_regione', 'cap',
+                  'lat', 'lon', 'superficie_kmq']
+COLONNE_CATEGORICHE = ['sigla_provincia', 'denominazione_provincia', 'denominazione_regione']
+
+# Colonne numeriche del CSV, scritte con la virgola decimale (es. 45,3634669)
+COLONNE_NUMERICHE = ['lat', 'lon', 'superficie_kmq']
+
+# Colonne aggiunte ai record da map_comune_info
+COLONNE_ARRICCHIMENTO = ['comune', 'provincia', 'regione', 'cap', 'codice_istat', 'confidenza_comune', 'comune_ambiguo', 'residente_citta']
+
+
+# Funzione per ricavare il percorso dell'artefatto binario (Arrow IPC, mappabile in memoria) accanto al CSV
+def percorso_indice(file_path=COMUNI_DB_PATH):
+    return os.path.splitext(file_path)[0] + '.arrow'
+
+
+# Funzione per calcolare l'impronta del CSV sorgente, salvata nei metadati dell'artefatto
+def impronta_file(file_path):
+    with open(file_path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+# Funzione per costruire la tabella compatta dal CSV: una riga per comune (codice ISTAT) con le sole colonne utili,
+# tipi compatti, il CAP principale e l'elenco di tutti i CAP del comune (CAP e codice ISTAT restano stringhe
+# per non perdere gli zeri iniziali). Coordinate e superficie vengono convertite in numeri una volta sola, qui:
+# le superfici non positive del file sono trattate come mancanti
+def costruisci_comuni_db(file_path=COMUNI_DB_PATH):
+    # Solo le celle vuote sono mancanti: esiste un comune che si chiama "None"
+    comuni_csv = pd.read_csv(file_path, sep=";", usecols=COLONNE_INDICE, dtype=str, keep_default_na=False, na_values=[''])
+    cap_elenco = comuni_csv.groupby('codice_istat', sort=False)['cap'].agg(' '.join)
+    comuni_db_data = comuni_csv.drop_duplicates(subset=['codice_istat']).set_index('codice_istat')
+    comuni_db_data['cap_elenco'] = cap_elenco
+    for colonna in COLONNE_NUMERICHE:
+        comuni_db_data[colonna] = pd.to_numeric(comuni_db_data[colonna].str.replace(',', '.', regex=False), errors='coerce')
+    comuni_db_data['superficie_kmq'] = comuni_db_data['superficie_kmq'].where(comuni_db_data['superficie_kmq'] > 0)
+    comuni_db_data = comuni_db_data.sort_values('denominazione_ita', key=lambda nomi: nomi.str.lower())
+    for colonna in COLONNE_CATEGORICHE:
+        comuni_db_data[colonna] = comuni_db_data[colonna].astype('category')
+    return comuni_db_data
+
+
+# Funzione per compilare il CSV nell'artefatto Arrow versionato
+def compila_comuni_db(file_path=COMUNI_DB_PATH, indice_path=None):
+    if indice_path is None:
+        indice_path = percorso_indice(file_path)
+    if pa is None:
+        raise RuntimeError("pyarrow non è installato: impossibile compilare l'indice dei comuni.")
+    comuni_db_data = costruisci_comuni_db(file_path)
+    tabella = pa.Table.from_pandas(comuni_db_data, preserve_index=True)
+    tabella = tabella.replace_schema_metadata({
+        **(tabella.schema.metadata or {}),
+        b'versione_indice': VERSIONE_INDICE.encode(),
+        b'impronta_sorgente': impronta_file(file_path).encode()
+    })
+    # Scrittura su un file temporaneo con nome univoco e rinomina: i processi in lettura non vedono mai un file
+    # parziale e due ricostruzioni contemporanee (processi dell'unione, sessioni dell'app) non si sovrascrivono
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(indice_path)), prefix=os.path.basename(indice_path) + '.',
+                                     suffix='.tmp', delete=False) as temporaneo:
+        try:
+            with ipc.new_file(temporaneo, tabella.schema) as writer:
+                writer.write_table(tabella)
+        except BaseException:
+            temporaneo.close()
+            os.remove(temporaneo.name)
+            raise
+    os.replace(temporaneo.name, indice_path)
+    return indice_path
+
+
+# Funzione per leggere l'artefatto se esiste ed è aggiornato rispetto al CSV; altrimenti None. Un artefatto troncato
+# o illeggibile è trattato come non aggiornato e viene ricostruito
+def leggi_indice_comuni(indice_path, file_path=COMUNI_DB_PATH):
+    if pa is None or not os.path.exists(indice_path):
+        return None
+    try:
+        with pa.memory_map(indice_path, 'r') as sorgente:
+            tabella = ipc.open_file(sorgente).read_all()
+    except (OSError, pa.ArrowInvalid):
+        return None
+    metadati = tabella.schema.metadata or {}
+    if metadati.get(b'versione_indice') != VERSIONE_INDICE.encode():
+        return None
+    if os.path.exists(file_path) and metadati.get(b'impronta_sorgente') != impronta_file(file_path).encode():
+        return None
+    return tabella.to_pandas()
+
+
+# Funzione per caricare il database dei comuni: usa l'artefatto compilato se valido,
+# altrimenti costruisce la tabella dal CSV e prova a salvare l'artefatto per i processi successivi
+def carica_comuni_db(file_path=COMUNI_DB_PATH, indice_path=None):
+    if indice_path is None:
+        indice_path = percorso_indice(file_path)
+    comuni_db_data = leggi_indice_comuni(indice_path, file_path)
+    if comuni_db_data is not None:
+        return comuni_db_data
+    if pa is not None:
+        try:
+            compila_comuni_db(file_path, indice_path)
+        except OSError:
+            # Cartella in sola lettura: si continua con la tabella in memoria
+            pass
+    return costruisci_comuni_db(file_path)
+
+
+# Funzione per ricavare il codice della provincia indicata nel file (nome o sigla), -1 se assente o sconosciuta
+def codici_provincia_indicata(provincia_indicata, comuni_db_data):
+    # Nome normalizzato o sigla -> codice categorico della provincia in denominazione_provincia
+    categorie = comuni_db_data['denominazione_provincia'].cat.categories
+    codici_provincia = {}
+    province = comuni_db_data[['denominazione_provincia', 'sigla_provincia']].drop_duplicates()
+    for provincia, sigla in province.itertuples(index=False):
+        for variante in [*str(provincia).split('/'), str(sigla)]:
+            codici_provincia.setdefault(normalizza_nome(variante), categorie.get_loc(provincia))
+    codici, uniche = pd.factorize(provincia_indicata)
+    codici_unici = np.array([codici_provincia.get(normalizza_nome(valore), -1) for valore in uniche], dtype=np.int64)
+    return np.where(codici >= 0, codici_unici[codici], -1)
+
+
+# Funzione per ricavare il CAP indicato nel file come intero (-1 se assente o non valido); accetta anche i CAP
+# numerici letti da Excel senza zeri iniziali
+def cap_indicati(cap_indicato):
+    codici, uniche = pd.factorize(cap_indicato)
+    cap_unici = []
+    for valore in uniche:
+        testo = str(valore).strip().removesuffix('.0')
+        cap_unici.append(int(testo) if testo.isdigit() and len(testo) <= 5 else -1)
+    cap_unici = np.array(cap_unici, dtype=np.int64)
+    return np.where(codici >= 0, cap_unici[codici], -1)
+
+
+# Funzione per mappare le informazioni dei comuni; restituisce anche le città non trovate e quelle ambigue.
+# Un nome può corrispondere a più comuni (omonimi in province diverse): la provincia e il CAP indicati nel file,
+# se mappati, restringono i candidati; i record che restano con più comuni possibili vengono segnalati come ambigui
+# invece di ricevere un comune a caso. Il risolutore va costruito una volta per database e riusato.
+def map_comune_info(lavorabili_data, comuni_db_data, risolutore=None):
+    if risolutore is None:
+        risolutore = RisolutoreComuni(comuni_db_data)
+    # Copia superficiale: vengono solo aggiunte colonne, i dati in ingresso restano intatti
+    lavorabili_data = lavorabili_data.copy(deep=False)
+    numero_record = lavorabili_data.shape[0]
+
+    # Nome riconosciuto per ogni città, confidenza e coppie (record, comune candidato)
+    id_nomi, confidenza = risolutore.risolvi(lavorabili_data['Città'])
+    record, righe = risolutore.righe_candidate(id_nomi)
+
+    # CAP di ogni comune come chiavi riga * 100000 + CAP, per il confronto vettoriale con il CAP indicato
+    cap_per_comune = comuni_db_data['cap_elenco'].str.split(' ')
+    chiavi_cap = np.sort(
+        np.repeat(np.arange(len(comuni_db_data)), cap_per_comune.str.len()) * 100000
+        + np.array([int(cap) for elenco in cap_per_comune for cap in elenco], dtype=np.int64)
+    )
+
+    # Candidati compatibili con provincia e CAP indicati (i segnali assenti non escludono nulla)
+    compatibili = np.ones(len(record), dtype=bool)
+    cap_record = None
+    if 'Provincia_Indicata' in lavorabili_data.columns:
+        provincia_record = codici_provincia_indicata(lavorabili_data['Provincia_Indicata'], comuni_db_data)[record]
+        codici_provincia = comuni_db_data['denominazione_provincia'].cat.codes.to_numpy()
+        compatibili &= (provincia_record < 0) | (provincia_record == codici_provincia[righe])
+    if 'CAP_Indicato' in lavorabili_data.columns:
+        cap_record = cap_indicati(lavorabili_data['CAP_Indicato'])
+        chiavi = righe * 100000 + cap_record[record]
+        compatibili &= (cap_record[record] < 0) | np.isin(chiavi, chiavi_cap)
+
+    # Se i segnali escludono tutti i candidati di un record vengono ignorati per quel record
+    candidati_compatibili = np.bincount(record[compatibili], minlength=numero_record)
+    usati = compatibili | (candidati_compatibili[record] == 0)
+    candidati_usati = np.bincount(record[usati], minlength=numero_record)
+    univoci = usati & (candidati_usati[record] == 1)
+    posizioni = np.full(numero_record, -1, dtype=np.int64)
+    posizioni[record[univoci]] = righe[univoci]
+    ambigui = candidati_usati > 1
+
+    # Aggiunta delle nuove colonne prendendo i valori per posizione
+    colonne_db = [('comune', 'denominazione_ita'), ('provincia', 'denominazione_provincia'), ('regione', 'denominazione_regione'), ('cap', 'cap')]
+    for colonna, colonna_db in colonne_db:
+        lavorabili_data[colonna] = pd.Series(
+            comuni_db_data[colonna_db].array.take(posizioni, allow_fill=True),
+            index=lavorabili_data.index
+        )
+    lavorabili_data['codice_istat'] = pd.Series(comuni_db_data.index.array.take(posizioni, allow_fill=True), index=lavorabili_data.index)
+    confidenza[posizioni < 0] = np.nan
+    lavorabili_data['confidenza_comune'] = confidenza.round(3)
+    lavorabili_data['comune_ambiguo'] = ambigui
+
+    # Per le città con più CAP si usa il CAP indicato quando appartiene al comune riconosciuto
+    if cap_record is not None:
+        cap_del_comune = (posizioni >= 0) & (cap_record >= 0) & np.isin(posizioni * 100000 + cap_record, chiavi_cap)
+        lavorabili_data.loc[cap_del_comune, 'cap'] = [f'{cap:05d}' for cap in cap_record[cap_del_comune]]
+
+    # Aggiungi la colonna 'residente_citta': il comune riconosciuto è il capoluogo della provincia,
+    # confrontando i nomi una volta per comune del database invece che per ogni record
+    capoluoghi = (
+        comuni_db_data['denominazione_ita'].astype(str).str.lower()
+        == comuni_db_data['denominazione_provincia'].astype(str).str.lower()
+    ).to_numpy()
+    residente = np.zeros(numero_record, dtype=bool)
+    residente[posizioni >= 0] = capoluoghi[posizioni[posizioni >= 0]]
+    lavorabili_data['residente_citta'] = pd.Series(residente, index=lavorabili_data.index)
+
+    # Identifica le città non trovate e quelle ambigue
+    citta_non_trovate = np.asarray(lavorabili_data.loc[id_nomi < 0, 'Città'].unique(), dtype=object)
+    citta_ambigue = np.asarray(lavorabili_data.loc[ambigui, 'Città'].unique(), dtype=object)
+    return lavorabili_data, citta_non_trovate, citta_ambigue
@@ -0,0 +1,158 @@
+# Conversione delle date di nascita da esportazioni miste: gg/mm/aaaa, anni a due cifre, ISO, seriali Excel
+
+import datetime
+
+import numpy as np
+import pandas as pd
+
+# Formati riconosciuti sui valori di testo (nome, espressione regolare), nell'ordine in cui vengono provati
+FORMATI_DATA = [
+    ('gg/mm/aaaa', r'\d{1,2}[/.-]\d{1,2}[/.-]\d{4}'),
+    ('gg/mm/aa', r'\d{1,2}[/.-]\d{1,2}[/.-]\d{2}'),
+    ('aaaa-mm-gg', r'\d{4}-\d{1,2}-\d{1,2}(?:[ T]\d{1,2}:\d{2}(?::\d{2}(?:\.\d+)?)?)?'),
+    ('seriale Excel', r'\d{5}(?:\.\d+)?'),
+]
+FORMATO_DATA_EXCEL = 'data Excel'
+FORMATO_VUOTO = 'vuota'
+FORMATO_NON_VALIDO = 'non valida'
+
+# Ordine dei formati nei conteggi
+ORDINE_FORMATI = [formato for formato, _ in FORMATI_DATA] + [FORMATO_DATA_EXCEL, FORMATO_NON_VALIDO, FORMATO_VUOTO]
+
+# Origine e intervallo ammesso dei numeri seriali delle date di Excel (sistema 1900); si accettano solo seriali
+# di cinque cifre (dal 1927), così un anno isolato come "1980" non diventa una data
+ORIGINE_SERIALI_EXCEL = '1899-12-30'
+MASSIMO_SERIALE_EXCEL = 100_000
+
+# Valori distinti esaminati per capire se le date gg/mm/aaaa sono in realtà mm/gg/aaaa
+DIMENSIONE_CAMPIONE_DATE = 10_000
+
+# Valori a barre (gg/mm/aaaa e gg/mm/aa): gli unici in cui giorno e mese possono essere scambiati
+ESPRESSIONE_BARRE = r'\d{1,2}[/.-]\d{1,2}[/.-](?:\d{4}|\d{2})'
+
+
+# Funzione per capire dal campione se i valori a barre hanno il mese per primo: conta i valori in cui solo il
+# primo o solo il secondo numero può essere un giorno (> 12); in caso di parità vale il formato italiano
+def mese_per_primo(valori):
+    valori = pd.Series(valori, dtype=object).astype(str)
+    campione = valori.iloc[:DIMENSIONE_CAMPIONE_DATE].str.extract(r'^(\d{1,2})\D(\d{1,2})\D').astype(float)
+    giorno_primo = (campione[0] > 12).sum()
+    mese_primo = (campione[1] > 12).sum()
+    return mese_primo > giorno_primo
+
+
+# Funzioni di conversione vettoriale di un gruppo di valori dello stesso formato
+def _converti_barre(valori, data_riferimento, mese_primo):
+    formato = '%m/%d/%Y' if mese_primo else '%d/%m/%Y'
+    return pd.to_datetime(valori.str.replace(r'[.-]', '/', regex=True), format=formato, errors='coerce')
+
+
+def _converti_anno_breve(valori, data_riferimento, mese_primo):
+    parti = valori.str.extract(r'^(\d{1,2})\D(\d{1,2})\D(\d{2})$').astype(int)
+    if mese_primo:
+        parti[[0, 1]] = parti[[1, 0]].to_numpy()
+    # Anno a due cifre: il secolo più recente che non porta la nascita dopo la data di riferimento
+    anno = parti[2] + np.where(parti[2] <= data_riferimento.year % 100, data_riferimento.year // 100 * 100, (data_riferimento.year // 100 - 1) * 100)
+    return pd.to_datetime(pd.DataFrame({'year': anno, 'month': parti[1], 'day': parti[0]}), errors='coerce')
+
+
+def _converti_iso(valori, data_riferimento, mese_primo):
+    return pd.to_datetime(valori, format='ISO8601', errors='coerce').dt.normalize()
+
+
+def _converti_seriali(valori, data_riferimento, mese_primo):
+    seriali = pd.to_numeric(valori, errors='coerce')
+    seriali = seriali.where((seriali >= 1) & (seriali < MASSIMO_SERIALE_EXCEL))
+    return pd.to_datetime(np.floor(seriali), unit='D', origin=ORIGINE_SERIALI_EXCEL)
+
+
+_CONVERTITORI = {
+    'gg/mm/aaaa': _converti_barre,
+    'gg/mm/aa': _converti_anno_breve,
+    'aaaa-mm-gg': _converti_iso,
+    'seriale Excel': _converti_seriali,
+}
+
+
+class CampioneDate:
+    """Campione dei valori a barre distinti di una colonna letta in più parti (blocchi o file), nell'ordine di arrivo.
+
+    Serve a decidere una sola volta, per tutto l'input, se le date a barre hanno il mese per primo: con il campione
+    dei primi DIMENSIONE_CAMPIONE_DATE valori la decisione è la stessa della conversione della colonna intera.
+    """
+
+    def __init__(self):
+        self._valori = {}
+
+    def aggiungi(self, serie):
+        if len(self._valori) >= DIMENSIONE_CAMPIONE_DATE:
+            return
+        nuovi = pd.Series([valore for valore in pd.unique(serie) if isinstance(valore, str) and valore not in self._valori], dtype=object)
+        testo = nuovi.str.strip()
+        barre = testo.str.fullmatch(ESPRESSIONE_BARRE).to_numpy(dtype=bool)
+        for valore, pulito in zip(nuovi[barre], testo[barre]):
+            if len(self._valori) >= DIMENSIONE_CAMPIONE_DATE:
+                break
+            self._valori[valore] = pulito
+
+    def mese_per_primo(self):
+        return mese_per_primo(list(self._valori.values()))
+
+
+# Funzione per convertire le date di nascita. Ogni valore distinto viene esaminato una sola volta: i valori vengono
+# raggruppati per formato e ogni gruppo è convertito con un formato esplicito; i risultati tornano sulle righe
+# tramite i codici. Restituisce le date e il numero di righe gestite da ogni formato (incluse vuote e non valide).
+# `mese_primo` indica se le date a barre hanno il mese per primo; se non indicato viene dedotto dai valori della
+# serie (per un input letto in più parti va deciso una volta sull'intero input, con CampioneDate).
+def converti_date_nascita(serie, data_riferimento=None, mese_primo=None):
+    if data_riferimento is None:
+        data_riferimento = pd.Timestamp.today().normalize()
+    data_riferimento = pd.Timestamp(data_riferimento)
+
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        date = serie.dt.tz_localize(None) if getattr(serie.dt, 'tz', None) is not None else serie
+        conteggi = {FORMATO_DATA_EXCEL: int(date.notna().sum()), FORMATO_VUOTO: int(date.isna().sum())}
+        return date, {formato: numero for formato, numero in conteggi.items() if numero}
+
+    codici, uniche = pd.factorize(serie)
+    uniche = pd.Series(np.asarray(uniche, dtype=object))
+    date_uniche = pd.Series(pd.NaT, index=uniche.index, dtype='datetime64[us]')
+    formati_unici = np.full(len(uniche), FORMATO_NON_VALIDO, dtype=object)
+
+    # Date già convertite dal lettore Excel e numeri seriali letti come numeri
+    native = uniche.map(lambda valore: isinstance(valore, (datetime.date, np.datetime64))).to_numpy(dtype=bool)
+    if native.any():
+        date_uniche[native] = pd.to_datetime(uniche[native], errors='coerce').dt.normalize().to_numpy()
+        formati_unici[native] = FORMATO_DATA_EXCEL
+    numeri = uniche.map(lambda valore: isinstance(valore, (int, float, np.number)) and not isinstance(valore, bool)).to_numpy(dtype=bool)
+    testo = uniche.where(~native & ~numeri).astype('string').str.strip()
+    testo[numeri] = uniche[numeri].astype(str)
+
+    if mese_primo is None:
+        barre = ~native & testo.str.fullmatch(ESPRESSIONE_BARRE).fillna(False).to_numpy(dtype=bool)
+        mese_primo = mese_per_primo(testo[barre])
+
+    # Gruppi di valori di testo per formato, ciascuno convertito in modo vettoriale
+    da_convertire = ~native
+    for formato, espressione in FORMATI_DATA:
+        gruppo = da_convertire & testo.str.fullmatch(espressione).fillna(False).to_numpy(dtype=bool)
+        if gruppo.any():
+            date_uniche[gruppo] = _CONVERTITORI[formato](testo[gruppo].astype(str), data_riferimento, mese_primo).to_numpy()
+            formati_unici[gruppo] = formato
+            da_convertire &= ~gruppo
+
+    # I valori riconosciuti ma non convertibili (es. 31/02/1990) sono date non valide
+    formati_unici[date_uniche.isna().to_numpy()] = FORMATO_NON_VALIDO
+
+    date = pd.Series(date_uniche.array.take(codici, allow_fill=True), index=serie.index, name=serie.name)
+    # Conteggio per riga tramite i codici: l'ultimo indice (codice -1) corrisponde ai valori vuoti
+    indici_formati = np.array([ORDINE_FORMATI.index(formato) for formato in formati_unici] + [ORDINE_FORMATI.index(FORMATO_VUOTO)], dtype=np.int64)
+    conteggi = np.bincount(indici_formati[codici], minlength=len(ORDINE_FORMATI))
+    return date, {formato: int(numero) for formato, numero in zip(ORDINE_FORMATI, conteggi) if numero}
+
+
+# Funzione per formattare le date come gg/mm/aaaa, una volta per data distinta
+def formatta_date(date):
+    codici, uniche = pd.factorize(date)
+    testi = pd.DatetimeIndex(uniche).strftime('%d/%m/%Y').array
+    return pd.Series(testi.take(codici, allow_fill=True), index=date.index, name=date.name)
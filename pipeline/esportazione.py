@@ -0,0 +1,319 @@
+# Serializzazione pigra dei segmenti (CSV, CSV compresso o Parquet), archivio ZIP e cartella Excel
+
+import io
+import os
+import threading
+import time
+import zipfile
+import zlib
+from dataclasses import dataclass
+
+from .formati import (
+    CARTELLA_PARQUET_PARTIZIONATO,
+    FILE_XLSX_SEGMENTI,
+    FORMATI,
+    formato_esportazione,
+    nome_nel_formato,
+    parquet_partizionato,
+    xlsx_bytes,
+)
+from .geo import posizioni_fasce
+from .strumentazione import misura_fase
+
+# Nome dell'archivio con tutti i segmenti
+FILE_ZIP_SEGMENTI = 'segmenti_dati.zip'
+
+# Dimensione dei pezzi scritti nell'archivio
+DIMENSIONE_PEZZO_ZIP = 1 << 20
+
+
+# Opzioni di esportazione del batch: formato dei segmenti, cartella Excel con un foglio per segmento e dataset
+# Parquet partizionato per provincia e residente_citta
+@dataclass(frozen=True)
+class OpzioniEsportazione:
+    formato: str = 'csv'
+    xlsx: bool = False
+    partiziona: bool = False
+
+
+# Funzione per scrivere una voce nell'archivio a pezzi, senza copiarne il contenuto; `pezzi` sono i bytes del
+# contenuto, `dimensione` la loro lunghezza totale (oltre i limiti ZIP32 zipfile usa le estensioni ZIP64)
+def _scrivi_voce(zipf, nome, pezzi, dimensione):
+    voce = zipfile.ZipInfo(nome, time.localtime()[:6])
+    voce.compress_type = zipf.compression
+    voce.external_attr = 0o644 << 16
+    voce.file_size = dimensione
+    with zipf.open(voce, 'w') as destinazione:
+        for pezzo in pezzi:
+            destinazione.write(pezzo)
+
+
+# Funzione per dividere un contenuto in pezzi senza copiarlo
+def _pezzi(contenuto):
+    vista = memoryview(contenuto)
+    return (vista[i:i + DIMENSIONE_PEZZO_ZIP] for i in range(0, len(vista), DIMENSIONE_PEZZO_ZIP))
+
+
+class Esportazione:
+    """Esportazione pigra di più file in un formato (CSV, CSV compresso o Parquet), del loro archivio ZIP e della
+    cartella Excel con un foglio per file.
+
+    Ogni sorgente è un DataFrame o una funzione senza argomenti che lo restituisce; un file viene serializzato
+    solo alla prima richiesta di download e i bytes sono riusati dai download successivi. L'archivio ZIP viene
+    scritto voce per voce sulla destinazione: i file non ancora serializzati lo sono uno alla volta e i loro bytes
+    vengono rilasciati appena scritti. Le sorgenti mantengono i nomi dei CSV (es. data_ge_citta.csv): `nome_file`
+    restituisce il nome nel formato scelto.
+    Con una `strumentazione` vengono misurate la serializzazione di ogni file e la costruzione degli archivi.
+    """
+
+    def __init__(self, sorgenti, strumentazione=None, formato='csv'):
+        self._sorgenti = dict(sorgenti)
+        self.strumentazione = strumentazione
+        self.formato = formato_esportazione(formato)
+        self._file = {}
+        self._xlsx = {}
+        self._lock = threading.RLock()
+
+    def nomi(self):
+        return list(self._sorgenti)
+
+    def nome_file(self, nome):
+        return nome_nel_formato(nome, self.formato)
+
+    def dataframe(self, nome):
+        sorgente = self._sorgenti[nome]
+        return sorgente() if callable(sorgente) else sorgente
+
+    # Funzione per serializzare un file nel formato dell'esportazione, senza conservarne i bytes
+    def contenuto(self, nome):
+        with self._lock:
+            if nome in self._file:
+                return self._file[nome]
+        df = self.dataframe(nome)
+        with misura_fase(self.strumentazione, self.formato.fase, df.shape[0], dettaglio=nome):
+            return self.formato.serializza(df)
+
+    # Funzione per ottenere il contenuto di un file nel formato dell'esportazione, serializzato una sola volta
+    def file(self, nome):
+        with self._lock:
+            if nome not in self._file:
+                self._file[nome] = self.contenuto(nome)
+            return self._file[nome]
+
+    # Funzione per scrivere l'archivio ZIP su un file aperto in scrittura binaria (anche non posizionabile, come
+    # una risposta HTTP): una voce alla volta, ciascuna scritta a pezzi
+    def scrivi_zip(self, destinazione, nomi=None):
+        nomi = self.nomi() if nomi is None else list(nomi)
+        compressione = zipfile.ZIP_DEFLATED if self.formato.comprimibile else zipfile.ZIP_STORED
+        with misura_fase(self.strumentazione, 'archivio_zip', dettaglio=f'{len(nomi)} file'):
+            with zipfile.ZipFile(destinazione, 'w', compressione, allowZip64=True) as zipf:
+                for nome in nomi:
+                    contenuto = self.contenuto(nome)
+                    _scrivi_voce(zipf, self.nome_file(nome), _pezzi(contenuto), len(contenuto))
+                    del contenuto
+
+    # Funzione per ottenere l'archivio ZIP in memoria, per i download che richiedono i bytes
+    def zip(self, nomi=None):
+        buffer = io.BytesIO()
+        self.scrivi_zip(buffer, nomi)
+        return buffer.getvalue()
+
+    # Funzione per ottenere la cartella Excel con un foglio per file, costruita una sola volta per elenco di file
+    def xlsx(self, nomi=None):
+        chiave = tuple(self.nomi() if nomi is None else nomi)
+        with self._lock:
+            if chiave not in self._xlsx:
+                righe = sum(self.dataframe(nome).shape[0] for nome in chiave)
+                with misura_fase(self.strumentazione, 'cartella_xlsx', righe, dettaglio=f'{len(chiave)} fogli'):
+                    self._xlsx[chiave] = xlsx_bytes({nome: self.dataframe(nome) for nome in chiave})
+            return self._xlsx[chiave]
+
+
+class EsportazioneCsv(Esportazione):
+    """Esportazione pigra di più file CSV e del loro archivio ZIP."""
+
+    def __init__(self, sorgenti, strumentazione=None):
+        super().__init__(sorgenti, strumentazione, 'csv')
+
+    # Funzione per ottenere il CSV di un file, serializzato una sola volta
+    def csv(self, nome):
+        return self.file(nome)
+
+
+class VoceZipIncrementale:
+    """Voce di un archivio ZIP compressa man mano che arrivano i pezzi di contenuto (deflate grezzo incrementale)."""
+
+    def __init__(self):
+        self.dimensione = 0
+        self._compressore = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        self._compresso = io.BytesIO()
+        self._chiusa = None
+
+    def aggiungi(self, contenuto):
+        self.dimensione += len(contenuto)
+        self._compresso.write(self._compressore.compress(contenuto))
+
+    # Funzione per chiudere la voce e ottenere il contenuto compresso (idempotente)
+    def compresso(self):
+        if self._chiusa is None:
+            self._compresso.write(self._compressore.flush())
+            self._chiusa = self._compresso.getvalue()
+            self._compresso = None
+        return self._chiusa
+
+
+class EsportazioneCompressa:
+    """Esportazione scritta a pezzi in memoria, già compressa: ogni file è una voce ZIP che cresce blocco per blocco.
+
+    Offre la stessa interfaccia di EsportazioneCsv (nomi, file, csv, zip, scrivi_zip); la memoria occupata è quella
+    dei dati compressi. I CSV singoli vengono decompressi solo quando richiesti.
+    """
+
+    formato = FORMATI['csv']
+
+    def __init__(self):
+        self._voci = {}
+        self._lock = threading.RLock()
+
+    def aggiungi(self, nome, contenuto):
+        with self._lock:
+            self._voci.setdefault(nome, VoceZipIncrementale()).aggiungi(contenuto)
+
+    def nomi(self):
+        return list(self._voci)
+
+    def nome_file(self, nome):
+        return nome
+
+    def csv(self, nome):
+        return zlib.decompress(self._voci[nome].compresso(), -15)
+
+    file = csv
+
+    # Funzione per scrivere l'archivio ZIP: ogni voce viene decompressa a pezzi mentre è scritta
+    def scrivi_zip(self, destinazione, nomi=None):
+        nomi = self.nomi() if nomi is None else list(nomi)
+        with zipfile.ZipFile(destinazione, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as zipf:
+            for nome in nomi:
+                voce = self._voci[nome]
+                decompressore = zlib.decompressobj(-15)
+                pezzi = (decompressore.decompress(pezzo) for pezzo in _pezzi(voce.compresso()))
+                _scrivi_voce(zipf, nome, pezzi, voce.dimensione)
+
+    def zip(self, nomi=None):
+        buffer = io.BytesIO()
+        self.scrivi_zip(buffer, nomi)
+        return buffer.getvalue()
+
+
+class CartellaCsv:
+    """Esportazione scritta a pezzi su file CSV in una cartella, per l'elaborazione batch a blocchi."""
+
+    formato = FORMATI['csv']
+
+    def __init__(self, cartella):
+        self.cartella = cartella
+        self._nomi = []
+        os.makedirs(cartella, exist_ok=True)
+
+    def aggiungi(self, nome, contenuto):
+        percorso = os.path.join(self.cartella, nome)
+        if nome not in self._nomi:
+            self._nomi.append(nome)
+            modo = 'wb'
+        else:
+            modo = 'ab'
+        with open(percorso, modo) as f:
+            f.write(contenuto)
+
+    def nomi(self):
+        return list(self._nomi)
+
+    def nome_file(self, nome):
+        return nome
+
+    def csv(self, nome):
+        with open(os.path.join(self.cartella, nome), 'rb') as f:
+            return f.read()
+
+    file = csv
+
+    # Funzione per scrivere l'archivio ZIP leggendo i file dal disco a pezzi: la memoria resta limitata
+    def scrivi_zip(self, destinazione, nomi=None):
+        nomi = self.nomi() if nomi is None else list(nomi)
+        with zipfile.ZipFile(destinazione, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as zipf:
+            for nome in nomi:
+                zipf.write(os.path.join(self.cartella, nome), nome)
+
+
+# Funzione per preparare le sorgenti pigre dei segmenti: il segmento fuori dalle province di interesse
+# (se non vuoto) e i segmenti per provincia e residente_citta non vuoti
+def sorgenti_segmenti(lavorabili_data, segmentazione):
+    sorgenti = {}
+    file_fuori_province = segmentazione.definizione.file_fuori_province
+    if len(segmentazione.posizioni_fuori_province) > 0:
+        sorgenti[file_fuori_province] = lambda: segmentazione.segmento(lavorabili_data, file_fuori_province)
+    for file_name in segmentazione.file_non_vuoti():
+        sorgenti[file_name] = lambda file_name=file_name: segmentazione.segmento(lavorabili_data, file_name)
+    return sorgenti
+
+
+# Funzione per preparare le sorgenti pigre dei record per fascia di distanza (le sole fasce non vuote)
+def sorgenti_fasce(lavorabili_data):
+    return {
+        file_name: lambda posizioni=posizioni: lavorabili_data.iloc[posizioni]
+        for file_name, posizioni in posizioni_fasce(lavorabili_data).items()
+    }
+
+
+# Funzione per preparare l'esportazione pigra dei segmenti nel formato indicato
+def esportazione_segmenti(lavorabili_data, segmentazione, strumentazione=None, formato='csv'):
+    return Esportazione(sorgenti_segmenti(lavorabili_data, segmentazione), strumentazione, formato)
+
+
+# Funzione per creare l'archivio ZIP dei segmenti in memoria
+def crea_zip_segmenti(segmenti):
+    buffer = io.BytesIO()
+    EsportazioneCsv(segmenti).scrivi_zip(buffer)
+    buffer.seek(0)
+    return buffer
+
+
+# Funzione per scrivere i file di un'esportazione e, se indicati, l'archivio ZIP e la cartella Excel di alcuni file.
+# Ogni file viene serializzato e scritto uno alla volta; l'archivio è costruito rileggendo a pezzi i file scritti
+def scrivi_output(cartella, esportazione, nomi_zip=None, nomi_xlsx=None):
+    os.makedirs(cartella, exist_ok=True)
+    scritti = []
+    for nome in esportazione.nomi():
+        percorso = os.path.join(cartella, esportazione.nome_file(nome))
+        with open(percorso, 'wb') as f:
+            f.write(esportazione.contenuto(nome))
+        scritti.append(percorso)
+    if nomi_zip:
+        percorso = os.path.join(cartella, FILE_ZIP_SEGMENTI)
+        compressione = zipfile.ZIP_DEFLATED if esportazione.formato.comprimibile else zipfile.ZIP_STORED
+        with misura_fase(esportazione.strumentazione, 'archivio_zip', dettaglio=f'{len(nomi_zip)} file'):
+            with zipfile.ZipFile(percorso, 'w', compressione, allowZip64=True) as zipf:
+                for nome in nomi_zip:
+                    zipf.write(os.path.join(cartella, esportazione.nome_file(nome)), esportazione.nome_file(nome))
+        scritti.append(percorso)
+    if nomi_xlsx:
+        percorso = os.path.join(cartella, FILE_XLSX_SEGMENTI)
+        with open(percorso, 'wb') as f:
+            f.write(esportazione.xlsx(nomi_xlsx))
+        scritti.append(percorso)
+    return scritti
+
+
+# Funzione per scrivere il dataset Parquet partizionato dei record lavorabili in una sottocartella
+def scrivi_parquet_partizionato(cartella, lavorabili_data, strumentazione=None):
+    radice = os.path.join(cartella, CARTELLA_PARQUET_PARTIZIONATO)
+    with misura_fase(strumentazione, 'parquet_partizionato', lavorabili_data.shape[0]) as misura:
+        file = parquet_partizionato(lavorabili_data)
+        for percorso, contenuto in file.items():
+            percorso = os.path.join(radice, *percorso.split('/'))
+            os.makedirs(os.path.dirname(percorso), exist_ok=True)
+            with open(percorso, 'wb') as f:
+                f.write(contenuto)
+        misura.righe_out = len(file)
+    return radice
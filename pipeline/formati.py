@@ -0,0 +1,212 @@
+# Formati di esportazione: CSV, CSV compresso e Parquet per i singoli file, cartella Excel con un foglio per file
+# e dataset Parquet partizionato per provincia e residente_citta. Nei formati tipizzati (Parquet ed Excel) CAP e
+# codici ISTAT restano testo, con gli zeri iniziali, e la data di nascita resta una data
+
+import gzip
+import io
+import re
+import zipfile
+from dataclasses import dataclass
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - senza pyarrow i formati Parquet non sono disponibili
+    pa = None
+
+# Righe serializzate per blocco: limita la stringa CSV intermedia (e le righe Excel in memoria) a un blocco alla volta
+RIGHE_PER_BLOCCO_CSV = 100_000
+
+# Colonne che restano testo anche se contengono solo cifre, e colonne esportate come data
+COLONNE_TESTO = ('cap', 'codice_istat')
+COLONNE_DATA = ('Data_Nascita',)
+
+# Nome della cartella Excel con un foglio per segmento
+FILE_XLSX_SEGMENTI = 'segmenti_dati.xlsx'
+
+# Dataset Parquet partizionato: colonne di partizione, nome della cartella (batch) e dell'archivio (app)
+COLONNE_PARTIZIONE = ('provincia', 'residente_citta')
+CARTELLA_PARQUET_PARTIZIONATO = 'segmenti_parquet'
+FILE_PARQUET_PARTIZIONATO = 'segmenti_parquet.zip'
+
+# Valore di partizione dei record senza provincia, come negli altri strumenti con partizioni in stile Hive
+VALORE_PARTIZIONE_MANCANTE = '__HIVE_DEFAULT_PARTITION__'
+
+# Righe di dati per foglio Excel (oltre l'intestazione); i segmenti più lunghi continuano in altri fogli
+RIGHE_MASSIME_FOGLIO = 1_048_575
+
+# Caratteri non ammessi nei nomi dei fogli Excel e caratteri di controllo non ammessi nelle celle
+_CARATTERI_NOME_FOGLIO = re.compile(r'[\[\]:*?/\\]')
+_CARATTERI_CONTROLLO = r'[\x00-\x08\x0b\x0c\x0e-\x1f]'
+
+
+# Formato di esportazione di un singolo file: `serializza` trasforma un DataFrame in bytes. Le voci dei formati già
+# compressi (`comprimibile` falso) vengono archiviate nello ZIP senza una seconda compressione
+@dataclass(frozen=True)
+class Formato:
+    nome: str
+    descrizione: str
+    estensione: str
+    mime: str
+    serializza: object
+    comprimibile: bool = True
+
+    # Nome della misura della serializzazione nella strumentazione (es. serializzazione_csv_gz)
+    @property
+    def fase(self):
+        return 'serializzazione_' + self.nome.replace('.', '_')
+
+
+# Funzione per serializzare un DataFrame in CSV (bytes UTF-8), un blocco di righe alla volta
+def csv_bytes(df):
+    if df.shape[0] <= RIGHE_PER_BLOCCO_CSV:
+        return df.to_csv(index=False).encode('utf-8')
+    buffer = io.BytesIO()
+    for inizio in range(0, df.shape[0], RIGHE_PER_BLOCCO_CSV):
+        blocco = df.iloc[inizio:inizio + RIGHE_PER_BLOCCO_CSV]
+        buffer.write(blocco.to_csv(index=False, header=inizio == 0).encode('utf-8'))
+    return buffer.getvalue()
+
+
+# Funzione per serializzare un DataFrame in CSV compresso con gzip (senza data nell'intestazione: stesso contenuto, stessi bytes)
+def csv_gz_bytes(df):
+    return gzip.compress(csv_bytes(df), compresslevel=6, mtime=0)
+
+
+# Funzione per convertire un DataFrame in tabella Arrow con i tipi dell'esportazione: date di nascita come date,
+# CAP e codici come testo (anche quando sono tutti vuoti), colonne categoriche come dizionari
+def tabella_arrow(df):
+    if pa is None:
+        raise RuntimeError("pyarrow non è installato: impossibile esportare in formato Parquet.")
+    tabella = pa.Table.from_pandas(df, preserve_index=False)
+    for colonna in tabella.column_names:
+        tipo = tabella.schema.field(colonna).type
+        if colonna in COLONNE_DATA and pa.types.is_timestamp(tipo):
+            tipo_esportazione = pa.date32()
+        elif colonna in COLONNE_TESTO and not (pa.types.is_string(tipo) or pa.types.is_large_string(tipo)):
+            tipo_esportazione = pa.string()
+        else:
+            continue
+        posizione = tabella.schema.get_field_index(colonna)
+        tabella = tabella.set_column(posizione, colonna, tabella.column(posizione).cast(tipo_esportazione))
+    return tabella
+
+
+# Funzione per serializzare un DataFrame in Parquet (compressione snappy, leggibile da qualsiasi strumento)
+def parquet_bytes(df):
+    tabella = tabella_arrow(df)
+    buffer = pa.BufferOutputStream()
+    pq.write_table(tabella, buffer)
+    return buffer.getvalue().to_pybytes()
+
+
+# Formati disponibili per i singoli file, per nome
+FORMATI = {
+    'csv': Formato('csv', 'CSV', '.csv', 'text/csv', csv_bytes),
+    'csv.gz': Formato('csv.gz', 'CSV compresso (gzip)', '.csv.gz', 'application/gzip', csv_gz_bytes, comprimibile=False),
+    'parquet': Formato('parquet', 'Parquet', '.parquet', 'application/vnd.apache.parquet', parquet_bytes, comprimibile=False),
+}
+
+
+# Funzione per registrare un nuovo formato (o sostituirne uno esistente)
+def registra_formato(formato):
+    FORMATI[formato.nome] = formato
+    return formato
+
+
+# Funzione per ottenere un formato dal nome (o restituire il formato passato)
+def formato_esportazione(formato):
+    if isinstance(formato, Formato):
+        return formato
+    if formato not in FORMATI:
+        raise ValueError(f"Formato non supportato: '{formato}'. Formati disponibili: {', '.join(FORMATI)}.")
+    return FORMATI[formato]
+
+
+# Funzione per ricavare il nome di un file nel formato indicato: "data_ge_citta.csv" -> "data_ge_citta.parquet"
+def nome_nel_formato(nome, formato):
+    base = nome[:-len('.csv')] if nome.endswith('.csv') else nome
+    return base + formato_esportazione(formato).estensione
+
+
+# Funzione per ricavare i nomi dei fogli Excel: senza estensione e caratteri non ammessi, al massimo 31 caratteri,
+# con un numero progressivo per le continuazioni dei segmenti più lunghi di un foglio
+def _nome_foglio(nome, parte=1):
+    base = _CARATTERI_NOME_FOGLIO.sub('_', nome[:-len('.csv')] if nome.endswith('.csv') else nome)
+    if parte == 1:
+        return base[:31]
+    suffisso = f' ({parte})'
+    return base[:31 - len(suffisso)] + suffisso
+
+
+# Funzione per preparare un blocco di righe per openpyxl: valori Python per colonna, None per i mancanti,
+# date di nascita come date (celle data di Excel) e testo senza caratteri di controllo
+def _colonne_foglio(df):
+    colonne = []
+    for nome, serie in df.items():
+        mancanti = serie.isna().to_numpy()
+        if nome in COLONNE_DATA and pd.api.types.is_datetime64_any_dtype(serie):
+            valori = serie.dt.date.astype(object)
+        elif pd.api.types.is_numeric_dtype(serie) or pd.api.types.is_bool_dtype(serie):
+            valori = serie.astype(object)
+        else:
+            valori = serie.astype('str').str.replace(_CARATTERI_CONTROLLO, '', regex=True).astype(object)
+        valori = valori.to_numpy(dtype=object, copy=True)
+        valori[mancanti] = None
+        colonne.append(valori.tolist())
+    return colonne
+
+
+# Funzione per scrivere una cartella Excel con un foglio per DataFrame in un solo passaggio, con un workbook in
+# modalità write-only (le righe vengono scritte man mano e non restano in memoria). `fogli` associa il nome del
+# file a un DataFrame o a una funzione che lo restituisce.
+def xlsx_bytes(fogli):
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    for nome, sorgente in fogli.items():
+        df = sorgente() if callable(sorgente) else sorgente
+        for parte, inizio_foglio in enumerate(range(0, max(df.shape[0], 1), RIGHE_MASSIME_FOGLIO), start=1):
+            foglio = workbook.create_sheet(_nome_foglio(nome, parte))
+            foglio.append([str(colonna) for colonna in df.columns])
+            fine_foglio = min(inizio_foglio + RIGHE_MASSIME_FOGLIO, df.shape[0])
+            for inizio in range(inizio_foglio, fine_foglio, RIGHE_PER_BLOCCO_CSV):
+                blocco = df.iloc[inizio:min(inizio + RIGHE_PER_BLOCCO_CSV, fine_foglio)]
+                for riga in zip(*_colonne_foglio(blocco)):
+                    foglio.append(riga)
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+# Funzione per il valore di una partizione nel percorso: testo codificato come negli URL, booleani in minuscolo
+def _valore_partizione(valore):
+    if valore is None or pd.isna(valore):
+        return VALORE_PARTIZIONE_MANCANTE
+    if isinstance(valore, (bool, np.bool_)):
+        return str(bool(valore)).lower()
+    return quote(str(valore), safe='')
+
+
+# Funzione per preparare un dataset Parquet partizionato in stile Hive (es. provincia=Genova/residente_citta=true/
+# part-0.parquet): restituisce percorso relativo -> contenuto. Le colonne di partizione sono nel percorso, non nei file.
+def parquet_partizionato(df, colonne=COLONNE_PARTIZIONE):
+    colonne = list(colonne)
+    file = {}
+    for valori, gruppo in df.groupby(colonne, dropna=False, observed=True, sort=True):
+        percorso = '/'.join(f'{colonna}={_valore_partizione(valore)}' for colonna, valore in zip(colonne, valori))
+        file[f'{percorso}/part-0.parquet'] = parquet_bytes(gruppo.drop(columns=colonne))
+    return file
+
+
+# Funzione per archiviare in un file ZIP contenuti già compressi (Parquet, gzip), senza comprimerli di nuovo
+def zip_non_compresso(file):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED, allowZip64=True) as zipf:
+        for percorso, contenuto in file.items():
+            zipf.writestr(percorso, contenuto)
+    return buffer.getvalue()
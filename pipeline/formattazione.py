@@ -0,0 +1,163 @@
+# Formattazione dei campi e arricchimento con età e gruppo d'età
+
+import functools
+import re
+
+import numpy as np
+import pandas as pd
+
+from .date_nascita import converti_date_nascita, formatta_date
+
+try:
+    import pyarrow as pa
+except ImportError:  # pragma: no cover - senza pyarrow le stringhe restano object
+    pa = None
+
+
+# Particelle scritte in minuscolo all'interno dei nomi di città ("Cassano d'Adda", "Reggio nell'Emilia",
+# "Castiglione della Pescaia"); nei nomi di persona restano maiuscole ("De Rossi", "Dell'Acqua", "D'Angelo")
+PARTICELLE = {
+    'a', 'ai', 'al', 'alla', 'allo', 'con', 'da', 'dei', 'degli', 'del', 'della', 'delle', 'dello', 'di', 'e', 'ed',
+    'in', 'nei', 'nel', 'nelle', 'per', 'presso', 'su', 'sul', 'sulla', 'sullo'
+}
+PARTICELLE_ELISE = {"d'", "de'", "dell'", "all'", "dall'", "nell'", "ne'", "sull'"}
+
+# Parole (con l'eventuale apostrofo di elisione), parole che iniziano con cifre e singoli separatori
+_PARTI_NOME = re.compile(r"[^\W\d_]+['’]?|[^\W\d_]*\d\w*|\W|_")
+
+
+# Funzione per scrivere un nome con le iniziali maiuscole, anche dopo l'apostrofo di elisione ("D'Angelo").
+# Con `particelle_minuscole` le particelle dopo la prima parola restano minuscole, come nei nomi dei comuni.
+@functools.lru_cache(maxsize=1 << 16)
+def titolo_nome(testo, particelle_minuscole=False):
+    risultato, prima = [], True
+    for parte in _PARTI_NOME.findall(testo.lower()):
+        if parte[:1].isalpha():
+            particella = parte.replace('’', "'")
+            if particelle_minuscole and not prima and (particella in PARTICELLE or particella in PARTICELLE_ELISE):
+                risultato.append(parte)
+            else:
+                risultato.append(parte[:1].upper() + parte[1:])
+            prima = False
+        else:
+            risultato.append(parte)
+    return ''.join(risultato)
+
+
+# Funzione per applicare una trasformazione di stringhe ai soli valori distinti di una colonna e riportare
+# i risultati sulle righe tramite i codici; i valori non stringa diventano mancanti, come con l'accessor .str.
+# Con `categorica=True` restituisce una colonna categorica, i cui codici vengono riusati da chi la fattorizza.
+def trasforma_valori_unici(serie, funzione, categorica=False):
+    codici, uniche = pd.factorize(serie)
+    trasformate = [funzione(valore) if isinstance(valore, str) else np.nan for valore in uniche]
+    # Valori distinti che coincidono dopo la trasformazione ("roma", "ROMA ") condividono la categoria
+    codici_trasformate, categorie = pd.factorize(pd.Series(trasformate, dtype=object))
+    codici = np.where(codici >= 0, codici_trasformate[np.maximum(codici, 0)], -1) if len(codici_trasformate) else codici
+    if categorica:
+        return pd.Series(pd.Categorical.from_codes(codici, categories=categorie), index=serie.index, name=serie.name)
+    valori = pd.array(np.asarray(categorie, dtype=object), dtype=serie.dtype).take(codici, allow_fill=True)
+    return pd.Series(valori, index=serie.index, name=serie.name)
+
+
+# Funzioni di formattazione dei singoli valori di Nome, Cognome e Città
+def formatta_nome(valore):
+    return titolo_nome(valore.strip())
+
+
+def formatta_citta(valore):
+    return titolo_nome(valore.strip(), particelle_minuscole=True)
+
+
+# Funzione per formattare i campi di testo dopo la mappatura. Nome, Cognome e Città (pochi valori distinti,
+# regole in Python) vengono formattati sui soli valori distinti; 'Città' diventa categorica, così la risoluzione
+# dei comuni riusa la stessa fattorizzazione. Strip e lowercase delle altre colonne restano operazioni vettoriali.
+def formatta_testi(df):
+    # Identifica le colonne di tipo stringa
+    str_cols = df.select_dtypes(include=['object', 'string']).columns
+
+    # Rimuovi spazi superflui nelle colonne di tipo stringa, formatta Nome e Cognome in Titlecase
+    # e Città in Titlecase con le particelle minuscole
+    for col in str_cols:
+        if col in ('Nome', 'Cognome'):
+            df[col] = trasforma_valori_unici(df[col], formatta_nome)
+        elif col == 'Città':
+            df[col] = trasforma_valori_unici(df[col], formatta_citta, categorica=True)
+        elif col != 'Data_Nascita':
+            df[col] = df[col].str.strip()
+
+    # Formatta Email in lowercase
+    if 'Email' in str_cols:
+        df['Email'] = df['Email'].str.lower()
+    return df
+
+
+# Funzione per convertire la Data di Nascita e aggiungerne la versione gg/mm/aaaa; restituisce il numero
+# di righe gestite da ogni formato di data. `mese_primo` è l'ordine delle date a barre, se già deciso
+def aggiungi_data_nascita(df, data_riferimento=None, mese_primo=None):
+    df['Data_Nascita'], formati = converti_date_nascita(df['Data_Nascita'], data_riferimento, mese_primo)
+    df['Data_Nascita_Formatta'] = formatta_date(df['Data_Nascita'])
+    return formati
+
+
+# Funzione per formattare i dati dopo la mappatura
+def formatta_dati(df, data_riferimento=None):
+    df = formatta_testi(df)
+    aggiungi_data_nascita(df, data_riferimento)
+    return df
+
+
+# Colonne con pochi valori distinti, convertite in categoriche nella modalità compatta
+COLONNE_CATEGORICHE_COMPATTE = ['Sesso', 'Data_Nascita_Formatta', 'gruppo_eta', 'comune', 'provincia', 'regione', 'cap']
+
+
+# Funzione per la modalità compatta: stringhe Arrow, categoriche per le colonne ripetitive ed età come intero
+# piccolo nullable. Converte solo le colonne presenti e non ancora compattate, quindi si può chiamare dopo ogni fase.
+def compatta_tipi(df):
+    for colonna in df.columns:
+        if colonna in COLONNE_CATEGORICHE_COMPATTE:
+            if not isinstance(df[colonna].dtype, pd.CategoricalDtype):
+                df[colonna] = df[colonna].astype('category')
+        elif colonna == 'eta':
+            if df[colonna].dtype != 'Int16':
+                df[colonna] = df[colonna].astype('Int16')
+        elif df[colonna].dtype == object and pa is not None:
+            df[colonna] = df[colonna].astype('string[pyarrow]')
+    return df
+
+
+# Fasce d'età: limiti superiori (esclusi) e etichette, una in più dei limiti per l'ultima fascia aperta
+LIMITI_FASCE_ETA = [18, 25, 40, 60]
+ETICHETTE_FASCE_ETA = ['Minorenni', 'Ragazzi', 'Giovani adulti', 'Adulti', 'Senior']
+ETICHETTA_ETA_SCONOSCIUTA = 'Sconosciuto'
+
+
+# Funzione per calcolare l'età in anni compiuti alla data di riferimento (NaN per date mancanti)
+def calcola_eta(data_nascita, data_riferimento):
+    data_riferimento = pd.Timestamp(data_riferimento)
+    compleanno_non_passato = (
+        data_nascita.dt.month * 100 + data_nascita.dt.day
+        > data_riferimento.month * 100 + data_riferimento.day
+    )
+    eta = data_riferimento.year - data_nascita.dt.year - compleanno_non_passato.astype('int64')
+    return eta.astype('float64')
+
+
+# Funzione per calcolare la fascia d'età come colonna categorica
+def calcola_fascia_eta(eta, limiti=LIMITI_FASCE_ETA, etichette=ETICHETTE_FASCE_ETA):
+    limiti = list(limiti)
+    if len(etichette) != len(limiti) + 1:
+        raise ValueError("Le etichette delle fasce d'età devono essere una in più dei limiti.")
+    if any(a >= b for a, b in zip(limiti, limiti[1:])):
+        raise ValueError("I limiti delle fasce d'età devono essere strettamente crescenti.")
+
+    fasce = pd.cut(eta, bins=[-np.inf, *limiti, np.inf], labels=list(etichette), right=False)
+    return fasce.cat.add_categories([ETICHETTA_ETA_SCONOSCIUTA]).fillna(ETICHETTA_ETA_SCONOSCIUTA)
+
+
+# Funzione per aggiungere età e gruppo d'età; la data di riferimento è fissata una volta per esecuzione
+def aggiungi_eta_e_gruppo(df, data_riferimento=None, limiti=LIMITI_FASCE_ETA, etichette=ETICHETTE_FASCE_ETA):
+    if data_riferimento is None:
+        data_riferimento = pd.Timestamp.today().normalize()
+    df['eta'] = calcola_eta(df['Data_Nascita'], data_riferimento)
+    df['gruppo_eta'] = calcola_fascia_eta(df['eta'], limiti, etichette)
+    return df
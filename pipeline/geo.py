@@ -0,0 +1,172 @@
+# Arricchimento geografico: distanza di ogni record dalla sede più vicina e fascia di distanza, con le coordinate
+# dei comuni del database. Le distanze vengono calcolate una volta per comune distinto e poi riportate sui record
+
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+from .risoluzione import normalizza_nome
+
+# Raggio medio della Terra usato nella formula dell'emisenoverso
+RAGGIO_TERRA_KM = 6371.0088
+
+# Limiti delle fasce di distanza predefinite, in km
+RAGGI_KM = (10, 25, 50)
+
+# Colonne aggiunte ai record da arricchisci_distanze
+COLONNE_DISTANZA = ['distanza_sede_km', 'sede_vicina', 'fascia_distanza']
+
+# Prefisso dei file con i record di una fascia di distanza (es. data_fascia_0-10_km.csv)
+PREFISSO_FILE_FASCIA = 'data_fascia_'
+
+# Nome dell'archivio con i file delle fasce di distanza
+FILE_ZIP_FASCE = 'fasce_distanza.zip'
+
+
+# Definizione delle sedi: nome della sede -> comune del database in cui si trova (la posizione è quella del comune)
+# oppure coppia (lat, lon); `raggi_km` sono i limiti crescenti delle fasce di distanza
+@dataclass(frozen=True)
+class DefinizioneSedi:
+    sedi: dict = field(default_factory=lambda: {'Genova': 'Genova', 'Savona': 'Savona', 'La Spezia': 'La Spezia', 'Imperia': 'Imperia'})
+    raggi_km: tuple = RAGGI_KM
+
+    # Etichette delle fasce, dalla più vicina: "0-10 km", "10-25 km", "25-50 km", "oltre 50 km"
+    def etichette_fasce(self):
+        limiti = (0, *self.raggi_km)
+        etichette = [f'{inizio:g}-{fine:g} km' for inizio, fine in zip(limiti, limiti[1:])]
+        return etichette + [f'oltre {limiti[-1]:g} km']
+
+
+# Sedi predefinite: i quattro capoluoghi liguri
+SEDI_LIGURIA = DefinizioneSedi()
+
+
+# Funzione per interpretare un elenco di sedi "Genova,Chiavari:44.3168:9.3221" (comune del database oppure
+# NOME:LAT:LON) e di raggi "10,25,50"; senza sedi (None) le distanze non vengono calcolate, con un elenco vuoto
+# si usano le sedi predefinite
+def leggi_definizione_sedi(sedi, raggi=None):
+    if sedi is None:
+        return None
+    raggi_km = RAGGI_KM
+    if raggi:
+        try:
+            raggi_km = tuple(float(raggio) for raggio in raggi.split(','))
+        except ValueError:
+            raise ValueError(f"Raggi non validi: '{raggi}'. Usa distanze in km separate da virgole, es. 10,25,50.") from None
+    if not sedi.strip():
+        return DefinizioneSedi(SEDI_LIGURIA.sedi, raggi_km)
+    definizione = {}
+    for voce in sedi.split(','):
+        nome, sep, coordinate = voce.partition(':')
+        nome = nome.strip()
+        if not nome:
+            raise ValueError(f"Sede non valida: '{voce}'. Usa il nome di un comune oppure NOME:LAT:LON.")
+        if not sep:
+            definizione[nome] = nome
+            continue
+        try:
+            lat, lon = (float(valore) for valore in coordinate.split(':'))
+        except ValueError:
+            raise ValueError(f"Sede non valida: '{voce}'. Usa NOME:LAT:LON, es. Chiavari:44.3168:9.3221.") from None
+        definizione[nome] = (lat, lon)
+    return DefinizioneSedi(definizione, raggi_km)
+
+
+# Funzione per calcolare la distanza in km tra punti (lat, lon) in gradi con la formula dell'emisenoverso;
+# gli argomenti sono array (o scalari) combinati con il broadcasting di numpy
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(valore, dtype=np.float64)) for valore in (lat1, lon1, lat2, lon2))
+    seno_lat = np.sin((lat2 - lat1) / 2)
+    seno_lon = np.sin((lon2 - lon1) / 2)
+    a = seno_lat ** 2 + np.cos(lat1) * np.cos(lat2) * seno_lon ** 2
+    return 2 * RAGGIO_TERRA_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+# Funzione per ricavare nomi e coordinate delle sedi; un comune indicato per nome deve esistere ed essere univoco
+# (per gli omonimi in province diverse vanno indicate le coordinate)
+def coordinate_sedi(definizione, comuni_db_data):
+    if not definizione.sedi:
+        raise ValueError("Nessuna sede indicata per il calcolo delle distanze.")
+    if list(definizione.raggi_km) != sorted(set(definizione.raggi_km)) or min(definizione.raggi_km, default=1) <= 0:
+        raise ValueError(f"Raggi non validi: {definizione.raggi_km}. Indica distanze positive e crescenti.")
+    nomi_db = comuni_db_data['denominazione_ita'].map(normalizza_nome).to_numpy(dtype=object)
+    nomi, lat, lon = [], [], []
+    for nome, posizione in definizione.sedi.items():
+        if isinstance(posizione, str):
+            righe = np.flatnonzero(nomi_db == normalizza_nome(posizione))
+            if len(righe) == 0:
+                raise ValueError(f"Comune della sede '{nome}' non trovato: '{posizione}'.")
+            if len(righe) > 1:
+                raise ValueError(f"Comune della sede '{nome}' ambiguo: '{posizione}'. Indica le coordinate (lat, lon).")
+            posizione = (comuni_db_data['lat'].iat[righe[0]], comuni_db_data['lon'].iat[righe[0]])
+        nomi.append(nome)
+        lat.append(float(posizione[0]))
+        lon.append(float(posizione[1]))
+    return nomi, np.array(lat), np.array(lon)
+
+
+# Funzione per aggiungere ai record la distanza dalla sede più vicina (km, una cifra decimale), la sede più vicina e
+# la fascia di distanza. Le distanze sono calcolate per i soli comuni distinti dei record, con una matrice
+# comuni x sedi; i record senza comune riconosciuto (o senza coordinate) restano senza valori.
+def arricchisci_distanze(lavorabili_data, comuni_db_data, definizione=SEDI_LIGURIA):
+    nomi_sedi, lat_sedi, lon_sedi = coordinate_sedi(definizione, comuni_db_data)
+    # Copia superficiale: vengono solo aggiunte colonne, i dati in ingresso restano intatti
+    lavorabili_data = lavorabili_data.copy(deep=False)
+
+    # Comune distinto di ogni record e sua riga nel database (-1 se non riconosciuto)
+    codici, comuni_distinti = pd.factorize(lavorabili_data['codice_istat'])
+    righe_db = comuni_db_data.index.get_indexer(comuni_distinti)
+    lat_comuni = np.where(righe_db >= 0, comuni_db_data['lat'].to_numpy(dtype=np.float64)[righe_db], np.nan)
+    lon_comuni = np.where(righe_db >= 0, comuni_db_data['lon'].to_numpy(dtype=np.float64)[righe_db], np.nan)
+
+    # Matrice delle distanze comuni distinti x sedi, poi sede più vicina e fascia per comune
+    distanze = haversine_km(lat_comuni[:, None], lon_comuni[:, None], lat_sedi[None, :], lon_sedi[None, :])
+    validi = np.isfinite(lat_comuni) & np.isfinite(lon_comuni)
+    sede_comune = np.full(len(comuni_distinti), -1, dtype=np.int64)
+    distanza_comune = np.full(len(comuni_distinti), np.nan)
+    if validi.any():
+        sede_comune[validi] = np.argmin(distanze[validi], axis=1)
+        distanza_comune[validi] = distanze[validi, sede_comune[validi]]
+    fascia_comune = np.where(validi, np.searchsorted(np.asarray(definizione.raggi_km, dtype=np.float64), distanza_comune, side='left'), -1)
+
+    # Valori dei comuni riportati sui record per codice (i record senza comune hanno codice -1)
+    riconosciuti = codici >= 0
+    sede_record = np.full(len(codici), -1, dtype=np.int64)
+    fascia_record = np.full(len(codici), -1, dtype=np.int64)
+    distanza_record = np.full(len(codici), np.nan)
+    sede_record[riconosciuti] = sede_comune[codici[riconosciuti]]
+    fascia_record[riconosciuti] = fascia_comune[codici[riconosciuti]]
+    distanza_record[riconosciuti] = distanza_comune[codici[riconosciuti]]
+
+    lavorabili_data['distanza_sede_km'] = pd.Series(distanza_record.round(1), index=lavorabili_data.index)
+    lavorabili_data['sede_vicina'] = pd.Series(pd.Categorical.from_codes(sede_record, categories=nomi_sedi), index=lavorabili_data.index)
+    lavorabili_data['fascia_distanza'] = pd.Series(
+        pd.Categorical.from_codes(fascia_record, categories=definizione.etichette_fasce(), ordered=True), index=lavorabili_data.index
+    )
+    return lavorabili_data
+
+
+# Funzione per ottenere il nome del file dei record di una fascia di distanza
+def file_fascia(etichetta):
+    return f"{PREFISSO_FILE_FASCIA}{etichetta.replace(' ', '_')}.csv"
+
+
+# Funzione per dividere i record per fascia di distanza: nome del file -> posizioni dei record, per le sole fasce non
+# vuote, dalla più vicina; i record senza distanza (comune non riconosciuto) non appartengono a nessuna fascia
+def posizioni_fasce(lavorabili_data):
+    fasce = lavorabili_data['fascia_distanza']
+    codici = fasce.cat.codes.to_numpy()
+    conteggi = np.bincount(codici[codici >= 0], minlength=len(fasce.cat.categories))
+    gruppi = np.split(np.argsort(np.where(codici >= 0, codici, len(conteggi)), kind='stable'), np.cumsum(conteggi))
+    return {file_fascia(etichetta): gruppi[codice] for codice, etichetta in enumerate(fasce.cat.categories) if conteggi[codice] > 0}
+
+
+# Funzione per contare i record per fascia di distanza (etichetta -> conteggio, comprese le fasce vuote)
+def conteggi_fasce(lavorabili_data):
+    return {str(fascia): int(numero) for fascia, numero in lavorabili_data['fascia_distanza'].value_counts(sort=False).items()}
+
+
+# Funzione per contare i record per sede più vicina (nome -> conteggio, comprese le sedi senza record)
+def conteggi_sedi(lavorabili_data):
+    return {str(sede): int(numero) for sede, numero in lavorabili_data['sede_vicina'].value_counts(sort=False).items()}
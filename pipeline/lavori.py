@@ -0,0 +1,78 @@
+# Lavori in background: una funzione eseguita in un thread, con avanzamento leggibile da fuori e annullamento
+# cooperativo (il lavoro si interrompe al primo aggiornamento dopo la richiesta)
+
+import threading
+
+# Stati di un lavoro
+IN_CORSO = 'in_corso'
+COMPLETATO = 'completato'
+ANNULLATO = 'annullato'
+ERRORE = 'errore'
+
+
+class LavoroAnnullato(Exception):
+    """Sollevata dentro il lavoro, al primo aggiornamento, quando ne è stato chiesto l'annullamento."""
+
+
+class Lavoro:
+    """Esecuzione di `esegui(lavoro)` in un thread separato.
+
+    La funzione riporta l'avanzamento con `lavoro.aggiorna(frazione, messaggio)`, che è anche il punto in cui
+    un annullamento interrompe il lavoro. `chiave` identifica i parametri del lavoro; un lavoro `precedente`
+    viene annullato e atteso prima di iniziare, così i due non calcolano le stesse fasi in parallelo.
+    """
+
+    def __init__(self, esegui, chiave=None, precedente=None):
+        self.esegui = esegui
+        self.chiave = chiave
+        self.precedente = precedente
+        self.stato = IN_CORSO
+        self.avanzamento = 0.0
+        self.messaggio = ''
+        self.risultato = None
+        self.errore = None
+        self._annullamento = threading.Event()
+        self._thread = threading.Thread(target=self._esegui, name='lavoro-pipeline', daemon=True)
+
+    # Funzione per avviare il lavoro
+    def avvia(self):
+        self._thread.start()
+        return self
+
+    # Funzione per chiedere l'annullamento del lavoro
+    def annulla(self):
+        self._annullamento.set()
+
+    # Funzione per attendere la fine del lavoro; restituisce lo stato
+    def attendi(self, timeout=None):
+        self._thread.join(timeout)
+        return self.stato
+
+    @property
+    def in_corso(self):
+        return self.stato == IN_CORSO
+
+    # Funzione per aggiornare l'avanzamento (frazione tra 0 e 1) e il messaggio; interrompe il lavoro se annullato
+    def aggiorna(self, avanzamento=None, messaggio=None):
+        if self._annullamento.is_set():
+            raise LavoroAnnullato()
+        if avanzamento is not None:
+            self.avanzamento = min(max(float(avanzamento), 0.0), 1.0)
+        if messaggio is not None:
+            self.messaggio = messaggio
+
+    def _esegui(self):
+        if self.precedente is not None:
+            self.precedente.annulla()
+            self.precedente.attendi()
+            self.precedente = None
+        try:
+            self.aggiorna()
+            self.risultato = self.esegui(self)
+            self.avanzamento = 1.0
+            self.stato = COMPLETATO
+        except LavoroAnnullato:
+            self.stato = ANNULLATO
+        except Exception as e:
+            self.errore = e
+            self.stato = ERRORE
@@ -0,0 +1,307 @@
+# Lettura del file caricato e mappatura delle colonne richieste
+
+import codecs
+import csv
+import importlib.util
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:  # pragma: no cover - senza pyarrow si usa il lettore CSV di pandas
+    pa = None
+
+# Campi richiesti dalla pipeline, nell'ordine usato dalla mappatura
+CAMPI_RICHIESTI = ['Nome', 'Cognome', 'Sesso', 'Data_Nascita', 'Città', 'Email']
+
+# Campi facoltativi che aiutano a distinguere i comuni omonimi, con i nomi di colonna riconosciuti in automatico
+CAMPI_OPZIONALI = {
+    'Provincia_Indicata': ['Provincia_Indicata', 'Provincia', 'Prov'],
+    'CAP_Indicato': ['CAP_Indicato', 'CAP', 'Cap']
+}
+
+# Byte letti all'inizio di un CSV per riconoscerne codifica e separatore
+DIMENSIONE_CAMPIONE = 64 * 1024
+
+# Separatori CSV riconosciuti
+SEPARATORI_CSV = ',;\t|'
+
+# Righe per blocco della lettura a blocchi (elaborazione di file più grandi della memoria)
+RIGHE_PER_BLOCCO = 200_000
+
+# Byte letti dal file per ogni lettura che aggiorna l'avanzamento
+DIMENSIONE_LETTURA = 1024 * 1024
+
+# Valori letti come mancanti nei CSV, gli stessi predefiniti di pd.read_csv
+VALORI_MANCANTI_CSV = [
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'
+]
+
+
+# Funzione per scegliere il motore di lettura Excel: calamine (molto più veloce) se installato, altrimenti openpyxl
+def motore_excel():
+    return 'calamine' if importlib.util.find_spec('python_calamine') is not None else None
+
+
+# Funzione per riconoscere se la sorgente è un file CSV
+def e_csv(sorgente):
+    nome_file = sorgente if isinstance(sorgente, (str, os.PathLike)) else sorgente.name
+    return str(nome_file).lower().endswith('.csv')
+
+
+# Funzione per leggere un campione iniziale della sorgente senza consumarla (percorso o file-like)
+def leggi_campione(sorgente, dimensione=DIMENSIONE_CAMPIONE):
+    if isinstance(sorgente, (str, os.PathLike)):
+        with open(sorgente, 'rb') as f:
+            return f.read(dimensione)
+    posizione = sorgente.tell()
+    campione = sorgente.read(dimensione)
+    sorgente.seek(posizione)
+    return campione
+
+
+# Funzione per riconoscere codifica e separatore di un CSV da un campione iniziale
+def riconosci_formato_csv(campione):
+    codifica = 'utf-8-sig' if campione.startswith(codecs.BOM_UTF8) else 'utf-8'
+    try:
+        # Decodifica incrementale: un carattere multibyte troncato alla fine del campione non è un errore
+        testo = codecs.getincrementaldecoder(codifica)().decode(campione)
+    except UnicodeDecodeError:
+        codifica = 'cp1252'
+        testo = campione.decode(codifica, errors='replace')
+    try:
+        separatore = csv.Sniffer().sniff(testo, delimiters=SEPARATORI_CSV).delimiter
+    except csv.Error:
+        separatore = ','
+    return codifica, separatore
+
+
+# Funzione per leggere le prime righe di un CSV o di un foglio Excel: basta per l'anteprima e per conoscere le colonne
+def leggi_anteprima(sorgente, header_option=0, foglio=0, righe=5):
+    if e_csv(sorgente):
+        codifica, separatore = riconosci_formato_csv(leggi_campione(sorgente))
+        df = pd.read_csv(sorgente, header=header_option, sep=separatore, encoding=codifica, dtype=str, nrows=righe)
+    else:
+        df = pd.read_excel(sorgente, header=header_option, sheet_name=foglio, nrows=righe, engine=motore_excel())
+    if hasattr(sorgente, 'seek'):
+        sorgente.seek(0)
+    return _nomina_colonne(df, header_option)
+
+
+# Funzione per elencare i fogli di un file Excel
+def elenca_fogli(sorgente):
+    with pd.ExcelFile(sorgente, engine=motore_excel()) as excel:
+        fogli = list(excel.sheet_names)
+    if hasattr(sorgente, 'seek'):
+        sorgente.seek(0)
+    return fogli
+
+
+# Funzione per dare nomi stringa alle colonne (Colonna_1, Colonna_2, ... per i file senza intestazione)
+def _nomina_colonne(df, header_option, posizioni=None):
+    if header_option is None:
+        posizioni = range(len(df.columns)) if posizioni is None else posizioni
+        df.columns = [f'Colonna_{i + 1}' for i in posizioni]
+    else:
+        df.columns = df.columns.map(str)
+    return df
+
+
+# Funzione per trovare intestazione e posizioni (ordinate) delle colonne da leggere; None per leggerle tutte
+def posizioni_colonne(sorgente, header_option, colonne, fogli):
+    if colonne is None:
+        return None, None
+    intestazione = list(leggi_anteprima(sorgente, header_option, fogli[0] if isinstance(fogli, list) else fogli, righe=0).columns)
+    mancanti = [colonna for colonna in colonne if colonna not in intestazione]
+    if mancanti:
+        raise ValueError(f"Colonne inesistenti nel file: {', '.join(map(str, mancanti))}")
+    return intestazione, sorted({intestazione.index(colonna) for colonna in colonne})
+
+
+# File binario che riporta a `progresso` la frazione del file letta (posizione più avanzata raggiunta), tra
+# `inizio` e `fine`; l'avanzamento viene comunicato a passi di almeno l'1%
+class _FileConAvanzamento(io.RawIOBase):
+    def __init__(self, file, progresso, messaggio, inizio=0.1, fine=1.0):
+        self._file = file
+        self._progresso = progresso
+        self._messaggio = messaggio
+        self._inizio, self._fine = inizio, fine
+        posizione = file.tell()
+        self._dimensione = max(1, file.seek(0, io.SEEK_END))
+        file.seek(posizione)
+        self._comunicata = 0.0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._file.tell()
+
+    def seek(self, posizione, origine=io.SEEK_SET):
+        return self._file.seek(posizione, origine)
+
+    def readinto(self, buffer):
+        letti = self._file.readinto(buffer)
+        frazione = min(1.0, self._file.tell() / self._dimensione)
+        if frazione >= self._comunicata + 0.01:
+            self._comunicata = frazione
+            self._progresso(self._inizio + (self._fine - self._inizio) * frazione, self._messaggio)
+        return letti
+
+
+# Funzione per leggere un file (percorso o file-like) passando al lettore `leggi` un file che ne riporta l'avanzamento
+def _leggi_con_avanzamento(sorgente, leggi, progresso, messaggio):
+    if isinstance(sorgente, (str, os.PathLike)):
+        with open(sorgente, 'rb') as file:
+            return leggi(io.BufferedReader(_FileConAvanzamento(file, progresso, messaggio), DIMENSIONE_LETTURA))
+    return leggi(io.BufferedReader(_FileConAvanzamento(sorgente, progresso, messaggio), DIMENSIONE_LETTURA))
+
+
+# Funzione per leggere un file CSV o Excel (percorso o file-like con attributo `name`).
+# Con `colonne` vengono lette solo le colonne indicate (tipicamente quelle mappate); con più fogli Excel
+# i fogli vengono letti in parallelo e concatenati; `progresso(frazione, messaggio)` riceve l'avanzamento
+# (per un solo CSV o foglio, in base ai byte letti).
+def leggi_file(sorgente, header_option=0, colonne=None, fogli=0, progresso=None):
+    if progresso is None:
+        progresso = lambda frazione, messaggio: None
+
+    # Intestazione e posizioni delle colonne da leggere
+    intestazione, posizioni = posizioni_colonne(sorgente, header_option, colonne, fogli)
+    progresso(0.1, 'Intestazione letta')
+
+    if e_csv(sorgente):
+        codifica, separatore = riconosci_formato_csv(leggi_campione(sorgente))
+        # Il lettore pyarrow (multithread) vuole i nomi delle colonne: si usa solo con la riga di intestazione
+        usa_pyarrow = pa is not None and header_option is not None
+        usecols = [intestazione[posizione] for posizione in posizioni] if usa_pyarrow and posizioni is not None else posizioni
+        df = _leggi_con_avanzamento(sorgente, lambda file: pd.read_csv(
+            file, header=header_option, sep=separatore, encoding=codifica, usecols=usecols,
+            dtype=str, engine='pyarrow' if usa_pyarrow else None
+        ), progresso, 'Lettura del file...')
+        progresso(1.0, 'File letto')
+        return _nomina_colonne(df, header_option, posizioni)
+
+    if not isinstance(fogli, list):
+        df = _leggi_con_avanzamento(sorgente, lambda file: pd.read_excel(
+            file, header=header_option, sheet_name=fogli, usecols=posizioni, engine=motore_excel()
+        ), progresso, 'Lettura del foglio...')
+        progresso(1.0, 'Foglio letto')
+        return _nomina_colonne(df, header_option, posizioni)
+
+    # Più fogli: ogni lettura usa una propria copia in memoria del file
+    contenuto = sorgente.getvalue() if hasattr(sorgente, 'getvalue') else None
+
+    def leggi_foglio(foglio):
+        origine = io.BytesIO(contenuto) if contenuto is not None else sorgente
+        df = pd.read_excel(origine, header=header_option, sheet_name=foglio, usecols=posizioni, engine=motore_excel())
+        return _nomina_colonne(df, header_option, posizioni)
+
+    letti = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(len(fogli), os.cpu_count() or 1))) as esecutore:
+        futuri = {esecutore.submit(leggi_foglio, foglio): foglio for foglio in fogli}
+        for completati, futuro in enumerate(as_completed(futuri), start=1):
+            letti[futuri[futuro]] = futuro.result()
+            progresso(0.1 + 0.9 * completati / len(fogli), f'Foglio {futuri[futuro]} letto')
+    return pd.concat([letti[foglio] for foglio in fogli], ignore_index=True)
+
+
+# Funzione per leggere un CSV in streaming con pyarrow, riunendo i batch in blocchi di `righe_per_blocco` righe.
+# Valori mancanti e tipi (tutto testo) sono gli stessi di pd.read_csv(dtype=str, engine='pyarrow').
+def _blocchi_csv_pyarrow(sorgente, header_option, posizioni, codifica, separatore, righe_per_blocco):
+    nomi = list(leggi_anteprima(sorgente, header_option, righe=0).columns)
+    posizioni = range(len(nomi)) if posizioni is None else posizioni
+    colonne = [nomi[posizione] if header_option is not None else f'f{posizione}' for posizione in posizioni]
+    lettore = pa_csv.open_csv(
+        sorgente,
+        read_options=pa_csv.ReadOptions(encoding=codifica, autogenerate_column_names=header_option is None),
+        parse_options=pa_csv.ParseOptions(delimiter=separatore),
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=colonne, column_types={colonna: pa.string() for colonna in colonne},
+            null_values=VALORI_MANCANTI_CSV, strings_can_be_null=True
+        )
+    )
+    in_attesa, righe_in_attesa = [], 0
+    for batch in lettore:
+        in_attesa.append(batch)
+        righe_in_attesa += batch.num_rows
+        while righe_in_attesa >= righe_per_blocco:
+            tabella = pa.Table.from_batches(in_attesa)
+            yield _nomina_colonne(tabella.slice(0, righe_per_blocco).to_pandas(), header_option, posizioni)
+            in_attesa = tabella.slice(righe_per_blocco).to_batches()
+            righe_in_attesa -= righe_per_blocco
+    if righe_in_attesa:
+        yield _nomina_colonne(pa.Table.from_batches(in_attesa).to_pandas(), header_option, posizioni)
+
+
+# Funzione per leggere un file a blocchi di al massimo `righe_per_blocco` righe, solo nelle colonne indicate.
+# I CSV sono letti in streaming; i fogli Excel (compressi, al massimo ~1 milione di righe) uno alla volta e poi divisi.
+def leggi_blocchi(sorgente, header_option=0, colonne=None, fogli=0, righe_per_blocco=RIGHE_PER_BLOCCO):
+    if hasattr(sorgente, 'seek'):
+        sorgente.seek(0)
+    posizioni = posizioni_colonne(sorgente, header_option, colonne, fogli)[1]
+
+    if e_csv(sorgente):
+        codifica, separatore = riconosci_formato_csv(leggi_campione(sorgente))
+        if pa is not None:
+            yield from _blocchi_csv_pyarrow(sorgente, header_option, posizioni, codifica, separatore, righe_per_blocco)
+            return
+        with pd.read_csv(sorgente, header=header_option, sep=separatore, encoding=codifica, usecols=posizioni,
+                         dtype=str, chunksize=righe_per_blocco) as lettore:
+            for blocco in lettore:
+                yield _nomina_colonne(blocco.reset_index(drop=True), header_option, posizioni)
+        return
+
+    for foglio in (fogli if isinstance(fogli, list) else [fogli]):
+        if hasattr(sorgente, 'seek'):
+            sorgente.seek(0)
+        df = _nomina_colonne(pd.read_excel(sorgente, header=header_option, sheet_name=foglio, usecols=posizioni, engine=motore_excel()),
+                             header_option, posizioni)
+        for inizio in range(0, df.shape[0], righe_per_blocco):
+            yield df.iloc[inizio:inizio + righe_per_blocco].reset_index(drop=True)
+        del df
+
+
+# Funzione per elencare le colonne del file usate da una mappatura, senza ripetizioni
+def colonne_mappate(mappatura):
+    return list(dict.fromkeys(colonna for colonna in mappatura.values() if colonna is not None))
+
+
+# Funzione per proporre la mappatura predefinita: stesso nome o posizione del campo
+def mappatura_predefinita(colonne):
+    colonne = list(colonne)
+    mappatura = {}
+    for posizione, campo in enumerate(CAMPI_RICHIESTI):
+        if campo in colonne:
+            mappatura[campo] = campo
+        elif posizione < len(colonne):
+            mappatura[campo] = colonne[posizione]
+        else:
+            raise ValueError(f"Nessuna colonna disponibile per il campo '{campo}'.")
+    for campo, alias in CAMPI_OPZIONALI.items():
+        trovate = [nome for nome in alias if nome in colonne]
+        if trovate:
+            mappatura[campo] = trovate[0]
+    return mappatura
+
+
+# Funzione per mappare le colonne sui campi richiesti e sui campi facoltativi indicati
+def mappa_colonne(df, mappatura=None):
+    if mappatura is None:
+        mappatura = mappatura_predefinita(df.columns)
+    mancanti = [campo for campo in CAMPI_RICHIESTI if mappatura.get(campo) not in df.columns]
+    mancanti += [campo for campo in CAMPI_OPZIONALI if mappatura.get(campo) is not None and mappatura[campo] not in df.columns]
+    if mancanti:
+        raise ValueError(f"Colonne non mappate o inesistenti per i campi: {', '.join(mancanti)}")
+
+    campi = CAMPI_RICHIESTI + [campo for campo in CAMPI_OPZIONALI if mappatura.get(campo) is not None]
+    df_mappato = df[[mappatura[campo] for campo in campi]].copy()
+    df_mappato.columns = campi
+    return df_mappato
@@ -0,0 +1,149 @@
+# Esecuzione headless dell'intera pipeline, senza dipendenze da Streamlit
+
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+from .comuni import map_comune_info
+from .formattazione import aggiungi_data_nascita, aggiungi_eta_e_gruppo, compatta_tipi, formatta_testi
+from .geo import arricchisci_distanze, conteggi_fasce, conteggi_sedi
+from .lettura import mappa_colonne
+from .quasi_duplicati import COLONNA_GRUPPO, cerca_quasi_duplicati
+from .segmentazione import SEGMENTI_LIGURIA, Segmentazione, segmenta
+from .strumentazione import misura_fase
+from .validazione import StatisticheValidazione, validazione_dati
+
+
+# Statistiche di un'esecuzione: solo conteggi, mai dati dei record
+@dataclass
+class Statistiche:
+    righe_lette: int = 0
+    data_riferimento: str = ''
+    formati_data_nascita: dict = field(default_factory=dict)
+    validazione: StatisticheValidazione = field(default_factory=StatisticheValidazione)
+    citta_non_trovate: list = field(default_factory=list)
+    citta_ambigue: list = field(default_factory=list)
+    righe_per_segmento: dict = field(default_factory=dict)
+    righe_per_fascia_distanza: dict = field(default_factory=dict)
+    righe_per_sede_vicina: dict = field(default_factory=dict)
+    gruppi_quasi_duplicati: int = 0
+    record_quasi_duplicati: int = 0
+
+
+# Risultato completo della pipeline
+@dataclass
+class RisultatoPipeline:
+    lavorabili: pd.DataFrame
+    scaricabili_email: pd.DataFrame
+    scaricabili_no_email: pd.DataFrame
+    segmentazione: Segmentazione
+    statistiche: Statistiche
+    quasi_duplicati: pd.DataFrame = None
+
+
+# Funzione per ottenere l'esecutore predefinito delle fasi: calcola la fase misurandola con la `strumentazione`
+def esecutore_misurato(strumentazione=None):
+    def esegui_fase(nome, calcola, righe_in, righe_out):
+        with misura_fase(strumentazione, nome, righe_in) as misura:
+            risultato = calcola()
+            misura.righe_out = righe_out(risultato)
+        return risultato
+    return esegui_fase
+
+
+# Funzione per eseguire tutte le fasi su un DataFrame già letto. Con `compatto=True` i tipi vengono compattati
+# dopo ogni fase e i sottoinsiemi della validazione non vengono copiati, per ridurre la memoria occupata.
+# Con una `strumentazione` ogni fase viene misurata (tempo, righe, memoria); `duplicati`, se indicata, è una funzione
+# che dal DataFrame formattato calcola le maschere dei duplicati (usata dall'elaborazione a blocchi); con
+# `cerca_simili=False` non vengono cercati i quasi duplicati tra i lavorabili; con una `definizione_sedi` i record
+# ricevono la distanza dalla sede più vicina e la fascia di distanza.
+# `esegui_fase(nome, calcola, righe_in, righe_out)`, se indicata, sostituisce l'esecuzione misurata di ogni fase: deve
+# restituire il risultato di `calcola()` (ad esempio prendendolo da una cache). I risultati delle fasi non vengono
+# modificati dalle fasi successive, quindi possono essere conservati e riusati.
+# `mese_primo` è l'ordine delle date a barre deciso sull'intero input (per i blocchi e i file di un'unione); se non
+# indicato viene dedotto dalle date di `df`.
+def esegui_pipeline(df, comuni_db_data, mappatura=None, data_riferimento=None, risolutore=None, definizione_segmenti=SEGMENTI_LIGURIA,
+                    compatto=False, strumentazione=None, duplicati=None, cerca_simili=True, definizione_sedi=None, esegui_fase=None,
+                    mese_primo=None):
+    if data_riferimento is None:
+        data_riferimento = pd.Timestamp.today().normalize()
+    data_riferimento = pd.Timestamp(data_riferimento)
+    if esegui_fase is None:
+        esegui_fase = esecutore_misurato(strumentazione)
+    statistiche = Statistiche(righe_lette=df.shape[0], data_riferimento=data_riferimento.strftime('%Y-%m-%d'))
+    df_mappato, statistiche.formati_data_nascita = prepara_record(df, mappatura, data_riferimento, compatto, esegui_fase, mese_primo)
+    return elabora_record(df_mappato, comuni_db_data, statistiche, risolutore, definizione_segmenti, compatto, duplicati, cerca_simili,
+                          definizione_sedi, esegui_fase)
+
+
+# Funzione per le fasi sul singolo record: mappatura e formattazione dei campi, data di nascita, età e fascia d'età.
+# Restituisce i record preparati e i conteggi dei formati della data di nascita.
+def prepara_record(df, mappatura, data_riferimento, compatto=False, esegui_fase=None, mese_primo=None):
+    if esegui_fase is None:
+        esegui_fase = esecutore_misurato()
+
+    def formatta():
+        df_mappato = formatta_testi(mappa_colonne(df, mappatura))
+        return df_mappato, aggiungi_data_nascita(df_mappato, data_riferimento, mese_primo)
+
+    def eta():
+        # Su una copia superficiale: il risultato della formattazione resta intatto
+        df_eta = aggiungi_eta_e_gruppo(df_mappato.copy(deep=False), data_riferimento)
+        return compatta_tipi(df_eta) if compatto else df_eta
+
+    df_mappato, formati = esegui_fase('formattazione', formatta, df.shape[0], lambda risultato: risultato[0].shape[0])
+    return esegui_fase('eta', eta, df_mappato.shape[0], len), formati
+
+
+# Funzione per le fasi sull'insieme dei record preparati: validazione, quasi duplicati, comuni, distanze e segmentazione.
+# Le statistiche vengono completate e restituite nel risultato.
+def elabora_record(df_mappato, comuni_db_data, statistiche, risolutore=None, definizione_segmenti=SEGMENTI_LIGURIA, compatto=False,
+                   duplicati=None, cerca_simili=True, definizione_sedi=None, esegui_fase=None):
+    if esegui_fase is None:
+        esegui_fase = esecutore_misurato()
+
+    def comuni():
+        arricchiti, citta_non_trovate, citta_ambigue = map_comune_info(validazione.lavorabili, comuni_db_data, risolutore)
+        return (compatta_tipi(arricchiti) if compatto else arricchiti), citta_non_trovate, citta_ambigue
+
+    validazione = esegui_fase(
+        'validazione', lambda: validazione_dati(df_mappato, copia=not compatto, duplicati=duplicati(df_mappato) if duplicati else None),
+        df_mappato.shape[0], lambda risultato: risultato.lavorabili.shape[0]
+    )
+    statistiche.validazione = validazione.statistiche
+
+    quasi_duplicati = None
+    if cerca_simili:
+        quasi_duplicati = esegui_fase('quasi_duplicati', lambda: cerca_quasi_duplicati(validazione.lavorabili),
+                                      validazione.lavorabili.shape[0], len)
+        conta_quasi_duplicati(statistiche, quasi_duplicati)
+
+    lavorabili_data, citta_non_trovate, citta_ambigue = esegui_fase('comuni', comuni, validazione.lavorabili.shape[0],
+                                                                    lambda risultato: risultato[0].shape[0])
+    statistiche.citta_non_trovate = [str(citta) for citta in citta_non_trovate if pd.notna(citta)]
+    statistiche.citta_ambigue = [str(citta) for citta in citta_ambigue if pd.notna(citta)]
+
+    if definizione_sedi is not None:
+        lavorabili_data = esegui_fase('distanze', lambda: arricchisci_distanze(lavorabili_data, comuni_db_data, definizione_sedi),
+                                      lavorabili_data.shape[0], len)
+        statistiche.righe_per_fascia_distanza = conteggi_fasce(lavorabili_data)
+        statistiche.righe_per_sede_vicina = conteggi_sedi(lavorabili_data)
+
+    segmentazione = esegui_fase('segmentazione', lambda: segmenta(lavorabili_data, definizione_segmenti),
+                                lavorabili_data.shape[0], lambda segmentazione: lavorabili_data.shape[0])
+    statistiche.righe_per_segmento = segmentazione.conteggi()
+
+    return RisultatoPipeline(
+        lavorabili=lavorabili_data,
+        scaricabili_email=validazione.scaricabili_email,
+        scaricabili_no_email=validazione.scaricabili_no_email,
+        segmentazione=segmentazione,
+        statistiche=statistiche,
+        quasi_duplicati=quasi_duplicati
+    )
+
+
+# Funzione per riportare nelle statistiche gruppi e record dei quasi duplicati
+def conta_quasi_duplicati(statistiche, quasi_duplicati):
+    statistiche.gruppi_quasi_duplicati = int(quasi_duplicati[COLONNA_GRUPPO].nunique())
+    statistiche.record_quasi_duplicati = quasi_duplicati.shape[0]
@@ -0,0 +1,149 @@
+# Ricerca dei quasi duplicati: la stessa persona con un refuso nel nome, un'altra email o Nome e Cognome invertiti.
+# Le coppie da confrontare sono generate solo dentro blocchi piccoli (stesso prefisso di Nome o Cognome e stessa
+# data di nascita, oppure stessa parte locale dell'email), così il costo cresce linearmente con il numero di record
+
+import numpy as np
+import pandas as pd
+
+from .risoluzione import ngrammi, normalizza_testo
+
+# Nome del file con i quasi duplicati da rivedere, accanto ai file per la gestione manuale
+FILE_QUASI_DUPLICATI = 'data_quasi_duplicati.csv'
+
+# Colonne aggiunte al file di revisione
+COLONNA_GRUPPO = 'gruppo_quasi_duplicati'
+COLONNA_SOMIGLIANZA = 'somiglianza'
+
+# Lettere del nome normalizzato usate nella chiave di blocco
+LUNGHEZZA_PREFISSO = 3
+
+# Blocchi più grandi vengono ignorati (chiavi poco selettive come "info@"): limitano le coppie per record
+DIMENSIONE_MASSIMA_BLOCCO = 50
+
+# Somiglianza minima (coefficiente di Dice sugli n-grammi di Nome e Cognome) per considerare due record la stessa persona
+SOGLIA_SOMIGLIANZA = 0.8
+
+
+# Funzione per normalizzare un nome di persona: senza accenti, punteggiatura e spazi ("D'Angelo" -> "dangelo")
+def normalizza_persona(valore):
+    return normalizza_testo(valore).replace(' ', '')
+
+
+# Funzione per ricavare la parte locale delle email, senza etichette "+..." e punti. Le email sono quasi tutte
+# distinte: la trasformazione è vettoriale invece che sui valori distinti
+def parti_locali_email(email):
+    email = email.astype('str')
+    locali = email.str.replace(r'[+@].*$', '', regex=True).str.replace('.', '', regex=False)
+    return locali.mask((locali == '') | ~email.str.contains('@', regex=False))
+
+
+# Funzione per applicare una trasformazione ai soli valori distinti; restituisce codici e valori trasformati
+def _trasforma_distinti(serie, funzione):
+    codici, uniche = pd.factorize(serie)
+    return codici, np.array([funzione(valore) for valore in uniche], dtype=object)
+
+
+# Funzione per generare le coppie di righe (i < j) che condividono una chiave, nei blocchi da 2 a `massimo` righe.
+# Con le righe ordinate per chiave, le coppie a distanza d nell'ordinamento si trovano con un confronto vettoriale
+def _coppie_nei_blocchi(chiavi, righe, massimo):
+    valide = chiavi >= 0
+    chiavi, righe = chiavi[valide], righe[valide]
+    ordine = np.lexsort((righe, chiavi))
+    chiavi, righe = chiavi[ordine], righe[ordine]
+    inizi = np.flatnonzero(np.r_[True, chiavi[1:] != chiavi[:-1]])
+    dimensioni = np.diff(np.r_[inizi, len(chiavi)])
+    dimensione_riga = np.repeat(dimensioni, dimensioni)
+    tenute = (dimensione_riga >= 2) & (dimensione_riga <= massimo)
+    chiavi, righe = chiavi[tenute], righe[tenute]
+    prime, seconde = [], []
+    for distanza in range(1, massimo):
+        stesso_blocco = chiavi[distanza:] == chiavi[:-distanza]
+        if not stesso_blocco.any():
+            break
+        prime.append(righe[:-distanza][stesso_blocco])
+        seconde.append(righe[distanza:][stesso_blocco])
+    if not prime:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(prime), np.concatenate(seconde)
+
+
+# Funzione per raggruppare i record collegati da coppie (componenti connesse): ogni record riceve la riga minima
+# del suo gruppo, propagata lungo le coppie con salti di puntatore fino a convergenza
+def _componenti(prime, seconde, numero_righe):
+    etichette = np.arange(numero_righe)
+    while True:
+        minimo = np.minimum(etichette[prime], etichette[seconde])
+        nuove = etichette.copy()
+        np.minimum.at(nuove, prime, minimo)
+        np.minimum.at(nuove, seconde, minimo)
+        nuove = nuove[nuove]
+        if np.array_equal(nuove, etichette):
+            return etichette
+        etichette = nuove
+
+
+# Funzione per cercare i quasi duplicati tra i record (tipicamente i lavorabili, già senza email ripetute).
+# Restituisce il file di revisione: i record dei gruppi trovati con il numero del gruppo e la somiglianza massima
+# con un altro record del gruppo, ordinati per gruppo. I record non vengono rimossi: la revisione è manuale.
+def cerca_quasi_duplicati(df, soglia=SOGLIA_SOMIGLIANZA, massimo_blocco=DIMENSIONE_MASSIMA_BLOCCO):
+    numero_righe = df.shape[0]
+    righe = np.arange(numero_righe, dtype=np.int64)
+
+    # Nome e Cognome normalizzati sui valori distinti; i prefissi condividono lo stesso vocabolario,
+    # così Nome e Cognome invertiti producono le stesse chiavi
+    codici_nome, nomi = _trasforma_distinti(df['Nome'], normalizza_persona)
+    codici_cognome, cognomi = _trasforma_distinti(df['Cognome'], normalizza_persona)
+    prefissi, _ = pd.factorize(pd.Series([nome[:LUNGHEZZA_PREFISSO] for nome in [*nomi, *cognomi]], dtype=object).replace('', None))
+    prefisso_nome = np.append(prefissi[:len(nomi)], -1)[codici_nome]
+    prefisso_cognome = np.append(prefissi[len(nomi):], -1)[codici_cognome]
+
+    # Chiavi prefisso + data di nascita, per Nome e per Cognome: con un refuso in un campo resta il blocco dell'altro
+    data = pd.to_datetime(df['Data_Nascita'], errors='coerce')
+    con_data = data.notna().to_numpy()
+    giorni = data.to_numpy(dtype='datetime64[D]').astype(np.int64)
+    giorni = giorni - giorni[con_data].min() if con_data.any() else giorni
+    chiavi_data = [np.where(con_data & (prefisso >= 0), prefisso * (1 << 32) + giorni, -1) for prefisso in (prefisso_nome, prefisso_cognome)]
+    prime, seconde = _coppie_nei_blocchi(np.concatenate(chiavi_data), np.concatenate([righe, righe]), massimo_blocco)
+
+    # Chiavi della parte locale dell'email (stessa persona con un altro dominio)
+    chiavi_locale, _ = pd.factorize(parti_locali_email(df['Email']))
+    prime_locale, seconde_locale = _coppie_nei_blocchi(chiavi_locale, righe, massimo_blocco)
+
+    # Coppie distinte (i < j) da tutte le chiavi; una riga può fare coppia con sé stessa se Nome e Cognome hanno lo stesso prefisso
+    prime = np.concatenate([prime, prime_locale])
+    seconde = np.concatenate([seconde, seconde_locale])
+    coppie = np.sort(np.minimum(prime, seconde) * numero_righe + np.maximum(prime, seconde))
+    coppie = coppie[np.r_[True, coppie[1:] != coppie[:-1]]] if len(coppie) else coppie
+    prime, seconde = coppie // numero_righe, coppie % numero_righe
+    prime, seconde = prime[prime != seconde], seconde[prime != seconde]
+
+    # Somiglianza calcolata una volta per coppia distinta di persone (Nome e Cognome normalizzati); gli n-grammi
+    # dei due campi sono uniti, quindi l'ordine di Nome e Cognome non conta
+    codici_persona, persone = pd.factorize((codici_nome.astype(np.int64) + 1) * (len(cognomi) + 1) + codici_cognome + 1)
+    # Il codice -1 (valore mancante) prende l'ultimo elemento, la stringa vuota
+    nomi, cognomi = np.append(nomi, ''), np.append(cognomi, '')
+    grammi = [ngrammi(nomi[persona // (len(cognomi)) - 1]) | ngrammi(cognomi[persona % len(cognomi) - 1]) for persona in persone.tolist()]
+    inverse, coppie_persone = pd.factorize(codici_persona[prime] * len(grammi) + codici_persona[seconde])
+    somiglianze_distinte = np.zeros(len(coppie_persone))
+    for indice, coppia in enumerate(coppie_persone.tolist()):
+        a, b = grammi[coppia // len(grammi)], grammi[coppia % len(grammi)]
+        if a and b:
+            somiglianze_distinte[indice] = 2 * len(a & b) / (len(a) + len(b))
+    somiglianze = somiglianze_distinte[inverse]
+
+    simili = somiglianze >= soglia
+    prime, seconde, somiglianze = prime[simili], seconde[simili], somiglianze[simili]
+
+    # Gruppi (componenti connesse) sui soli record coinvolti, numerati nell'ordine del primo record
+    coinvolti = np.unique(np.concatenate([prime, seconde]))
+    prime_locali, seconde_locali = np.searchsorted(coinvolti, prime), np.searchsorted(coinvolti, seconde)
+    etichette = _componenti(prime_locali, seconde_locali, len(coinvolti))
+    gruppi = pd.factorize(etichette)[0] + 1
+    somiglianza = np.zeros(len(coinvolti))
+    np.maximum.at(somiglianza, prime_locali, somiglianze)
+    np.maximum.at(somiglianza, seconde_locali, somiglianze)
+
+    revisione = df.iloc[coinvolti].copy()
+    revisione.insert(0, COLONNA_GRUPPO, gruppi)
+    revisione.insert(1, COLONNA_SOMIGLIANZA, somiglianza.round(3))
+    return revisione.sort_values(COLONNA_GRUPPO, kind='stable')
@@ -0,0 +1,326 @@
+# Risoluzione tollerante dei nomi di città: normalizzazione (accenti, apostrofi, "S."/"San")
+# e ricerca fuzzy su un indice di n-grammi costruito una sola volta dal database dei comuni
+
+import functools
+import math
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+# Lunghezza degli n-grammi della ricerca fuzzy: i trigrammi (con i bordi) sono abbastanza selettivi da limitare
+# i candidati; i refusi sui nomi brevi sono coperti dalla ricerca a un errore, che viene prima
+LUNGHEZZA_NGRAMMI = 3
+
+# Punteggio minimo (coefficiente di Dice sugli n-grammi) per accettare una corrispondenza fuzzy
+SOGLIA_CONFIDENZA = 0.75
+
+# Confidenza delle corrispondenze esatte a meno degli spazi ("Laspezia" -> "La Spezia")
+CONFIDENZA_SENZA_SPAZI = 0.95
+
+# Numero di città distinte confrontate per blocco, per limitare la memoria delle coppie candidate
+DIMENSIONE_BLOCCO = 4096
+
+# Varianti di "San" ridotte alla stessa forma ("S. Remo", "Sant'Anna", "St. Christina")
+_ABBREVIAZIONI_SANTO = {'san', 'sant', 'santa', 'santo', 'st', 's'}
+_SEPARATORI = "'’`´-./,()"
+
+
+# Tabella di traduzione precalcolata: lettere accentate latine -> lettera base, separatori -> spazio
+def _tabella_normalizzazione():
+    tabella = {ord(c): ' ' for c in _SEPARATORI}
+    for codice in range(0xC0, 0x250):
+        base = ''.join(c for c in unicodedata.normalize('NFKD', chr(codice)) if not unicodedata.combining(c))
+        if base != chr(codice):
+            tabella[codice] = base
+    return tabella
+
+
+_TABELLA_NORMALIZZAZIONE = _tabella_normalizzazione()
+
+
+# Funzione per normalizzare un nome di città: senza accenti, minuscolo, punteggiatura come spazi.
+# Memorizzata: gli stessi nomi ricorrono tra fasi, blocchi e file di uno stesso processo
+@functools.lru_cache(maxsize=1 << 17)
+def normalizza_nome(nome):
+    if not isinstance(nome, str):
+        return ''
+    parole = nome.lower().translate(_TABELLA_NORMALIZZAZIONE).split()
+    return ' '.join([('s' if parola in _ABBREVIAZIONI_SANTO else parola) for parola in parole])
+
+
+# Funzione per normalizzare un testo qualsiasi (ad esempio nomi di persona) senza le regole dei comuni:
+# senza accenti, minuscolo, punteggiatura come spazi
+def normalizza_testo(testo):
+    if not isinstance(testo, str):
+        return ''
+    return ' '.join(testo.lower().translate(_TABELLA_NORMALIZZAZIONE).split())
+
+
+# Funzione per estrarre gli n-grammi (con bordi) di un nome normalizzato
+def ngrammi(nome, n=LUNGHEZZA_NGRAMMI):
+    nome = f' {nome} '
+    return {nome[i:i + n] for i in range(len(nome) - n + 1)}
+
+
+# Funzione per generare le varianti di un nome con un carattere in meno
+def cancellazioni(nome):
+    return {nome[:i] + nome[i + 1:] for i in range(len(nome))}
+
+
+# Funzione per verificare che due nomi diversi siano a un solo errore: un carattere sostituito, aggiunto
+# o mancante, oppure due lettere adiacenti invertite ("Mialno" -> "Milano")
+def a_un_errore(a, b):
+    if a == b or abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    inizio = 0
+    while inizio < len(a) and a[inizio] == b[inizio]:
+        inizio += 1
+    if len(a) < len(b):
+        return a[inizio:] == b[inizio + 1:]
+    fine = inizio + 2
+    return a[inizio + 1:] == b[inizio + 1:] or (a[inizio:fine] == b[inizio:fine][::-1] and a[fine:] == b[fine:])
+
+
+class RisolutoreComuni:
+    """Indice dei nomi dei comuni (denominazione italiana e alternativa) per la risoluzione fuzzy.
+
+    Ogni nome normalizzato è una voce dell'indice che rimanda a uno o più comuni (gli omonimi in
+    province diverse). Va costruito una volta per database e può essere condiviso in sola lettura
+    tra sessioni e thread.
+    """
+
+    def __init__(self, comuni_db_data, soglia=SOGLIA_CONFIDENZA):
+        self.soglia = soglia
+
+        # Nome normalizzato -> righe del database con quel nome; forma senza spazi del nome non abbreviato
+        # ("santamargheritaligure") -> nome normalizzato
+        righe_per_nome = {}
+        estesi_senza_spazi = {}
+        colonne = ['denominazione_ita'] + [c for c in ['denominazione_altra'] if c in comuni_db_data.columns]
+        for colonna in colonne:
+            for riga, nome in enumerate(comuni_db_data[colonna].tolist()):
+                for variante in (nome.split('/') if isinstance(nome, str) else []):
+                    normalizzato = normalizza_nome(variante)
+                    righe = righe_per_nome.setdefault(normalizzato, [])
+                    if riga not in righe:
+                        righe.append(riga)
+                    estesi_senza_spazi.setdefault(normalizza_testo(variante).replace(' ', ''), normalizzato)
+        righe_per_nome.pop('', None)
+
+        # Voci dell'indice: id del nome e righe corrispondenti in forma compatta (inizio, righe)
+        self._nomi = list(righe_per_nome)
+        self.id_nomi = {nome: id_nome for id_nome, nome in enumerate(self._nomi)}
+        numero_righe = [len(righe_per_nome[nome]) for nome in self._nomi]
+        self._inizio_righe = np.r_[0, np.cumsum(numero_righe)].astype(np.int64)
+        self._righe = np.array([riga for nome in self._nomi for riga in righe_per_nome[nome]], dtype=np.int64)
+        self._riga_principale = self._righe[self._inizio_righe[:-1]]
+
+        # Stessi nomi senza spazi, per gli errori di spaziatura: sia nella forma normalizzata ("smargheritaligure")
+        # sia con San/Santa/Santo per esteso ("santamargheritaligure", "torresantasusanna")
+        self.id_senza_spazi = {}
+        for nome, id_nome in self.id_nomi.items():
+            self.id_senza_spazi.setdefault(nome.replace(' ', ''), id_nome)
+        for chiave, nome in estesi_senza_spazi.items():
+            if nome in self.id_nomi:
+                self.id_senza_spazi.setdefault(chiave, self.id_nomi[nome])
+
+        # Indice invertito n-gramma -> nomi, in forma di array ordinati per n-gramma
+        self._vocabolario = {}
+        coppie_ngramma, coppie_nome, lunghezze = [], [], []
+        for id_nome, nome in enumerate(self._nomi):
+            grammi = ngrammi(nome)
+            lunghezze.append(len(grammi))
+            for grammo in grammi:
+                coppie_ngramma.append(self._vocabolario.setdefault(grammo, len(self._vocabolario)))
+                coppie_nome.append(id_nome)
+        coppie_ngramma = np.array(coppie_ngramma, dtype=np.int64)
+        coppie_nome = np.array(coppie_nome, dtype=np.int64)
+        ordine = np.argsort(coppie_ngramma, kind='stable')
+        self._liste_nomi = coppie_nome[ordine]
+        self._inizio_liste = np.searchsorted(coppie_ngramma[ordine], np.arange(len(self._vocabolario) + 1))
+        self._frequenza = np.diff(self._inizio_liste)
+        self._lunghezza_nome = np.array(lunghezze, dtype=np.int64)
+
+        # Insieme degli n-grammi di ogni nome come bitset, per contare le intersezioni in modo vettoriale
+        self._parole_bitset = (len(self._vocabolario) + 63) // 64
+        self._bitset_nomi = self._bitset(coppie_nome, coppie_ngramma, len(self._nomi))
+
+        # Nomi con un carattere cancellato (indice "symmetric delete"): una cancellazione per parte trova
+        # sostituzioni, inserimenti, omissioni e inversioni di lettere adiacenti (e alcune coppie a due errori,
+        # scartate nello spareggio). Variante -> id dei nomi da cui si ottiene
+        self._nomi_variante = {}
+        for id_nome, nome in enumerate(self._nomi):
+            for variante in {nome, *cancellazioni(nome)}:
+                self._nomi_variante.setdefault(variante, []).append(id_nome)
+
+    # Funzione per costruire i bitset degli n-grammi da coppie (riga, id n-gramma)
+    def _bitset(self, righe, id_ngrammi, numero_righe):
+        bitset = np.zeros((numero_righe, self._parole_bitset), dtype=np.uint64)
+        np.bitwise_or.at(
+            bitset,
+            (righe, id_ngrammi // 64),
+            np.left_shift(np.uint64(1), (id_ngrammi % 64).astype(np.uint64))
+        )
+        return bitset
+
+    # Funzione per trovare, per ogni nome normalizzato, il nome indicizzato più simile e il suo punteggio.
+    # I candidati vengono generati solo dagli n-grammi più rari della query (prefix filtering): con soglia t
+    # un nome con Dice >= t deve condividere almeno uno dei primi a - ceil(t*a/(2-t)) + 1 n-grammi più rari.
+    def _cerca_fuzzy(self, nomi):
+        migliore = np.full(len(nomi), -1, dtype=np.int64)
+        punteggio = np.zeros(len(nomi), dtype=np.float64)
+        for inizio in range(0, len(nomi), DIMENSIONE_BLOCCO):
+            blocco = nomi[inizio:inizio + DIMENSIONE_BLOCCO]
+            id_query, id_ngramma, prefisso_query, prefisso_ngramma, lunghezza_query = [], [], [], [], []
+            for i, nome in enumerate(blocco):
+                grammi = ngrammi(nome)
+                lunghezza_query.append(len(grammi))
+                noti = [self._vocabolario[g] for g in grammi if g in self._vocabolario]
+                id_query.extend([i] * len(noti))
+                id_ngramma.extend(noti)
+                # Gli n-grammi assenti dal vocabolario sono i più rari e occupano le prime posizioni del prefisso
+                prefisso = len(grammi) - math.ceil(self.soglia * len(grammi) / (2 - self.soglia)) + 1
+                prefisso -= len(grammi) - len(noti)
+                if prefisso > 0:
+                    noti.sort(key=self._frequenza.__getitem__)
+                    prefisso_query.extend([i] * min(prefisso, len(noti)))
+                    prefisso_ngramma.extend(noti[:prefisso])
+            if not prefisso_query:
+                continue
+            prefisso_query = np.array(prefisso_query, dtype=np.int64)
+            prefisso_ngramma = np.array(prefisso_ngramma, dtype=np.int64)
+            lunghezza_query = np.array(lunghezza_query, dtype=np.int64)
+
+            # Espansione delle liste degli n-grammi del prefisso in coppie (query, nome candidato) distinte
+            inizi = self._inizio_liste[prefisso_ngramma]
+            conteggi = self._frequenza[prefisso_ngramma]
+            totale = int(conteggi.sum())
+            scostamenti = np.arange(totale) - np.repeat(np.cumsum(conteggi) - conteggi, conteggi)
+            candidati = self._liste_nomi[np.repeat(inizi, conteggi) + scostamenti]
+            query = np.repeat(prefisso_query, conteggi)
+
+            # Filtro sulle lunghezze compatibili con la soglia, poi coppie distinte
+            a, b = lunghezza_query[query], self._lunghezza_nome[candidati]
+            compatibili = (self.soglia * np.maximum(a, b) <= (2 - self.soglia) * np.minimum(a, b))
+            coppie = np.sort(query[compatibili] * len(self._nomi) + candidati[compatibili])
+            coppie = coppie[np.r_[True, coppie[1:] != coppie[:-1]]] if len(coppie) else coppie
+            query, candidati = np.divmod(coppie, len(self._nomi))
+            if len(query) == 0:
+                continue
+
+            # N-grammi in comune per coppia (popcount dei bitset) e coefficiente di Dice
+            bitset_query = self._bitset(np.array(id_query, dtype=np.int64), np.array(id_ngramma, dtype=np.int64), len(blocco))
+            comuni = np.bitwise_count(bitset_query[query] & self._bitset_nomi[candidati]).sum(axis=1)
+            dice = 2 * comuni / (lunghezza_query[query] + self._lunghezza_nome[candidati])
+
+            # Miglior candidato per query: ordinamento per query e punteggio decrescente
+            ordine = np.lexsort((-dice, query))
+            query, candidati, dice = query[ordine], candidati[ordine], dice[ordine]
+            primi = np.flatnonzero(np.r_[True, query[1:] != query[:-1]])
+            migliore[inizio + query[primi]] = candidati[primi]
+            punteggio[inizio + query[primi]] = dice[primi]
+
+            # A pari punteggio tra nomi di comuni diversi la corrispondenza è ambigua e viene scartata
+            secondi = primi + 1
+            validi = secondi < len(query)
+            secondi, primi_validi = secondi[validi], primi[validi]
+            pari = (
+                (query[secondi] == query[primi_validi]) &
+                (dice[secondi] == dice[primi_validi]) &
+                (self._riga_principale[candidati[secondi]] != self._riga_principale[candidati[primi_validi]])
+            )
+            punteggio[inizio + query[primi_validi[pari]]] = 0.0
+        return migliore, punteggio
+
+    # Funzione per cercare i nomi a un solo errore di battitura: id del nome nell'indice, -1 se assente o
+    # ambiguo. Sui nomi troppo corti un solo errore pesa più della soglia e non viene cercato.
+    def _cerca_un_errore(self, nomi):
+        trovati = np.full(len(nomi), -1, dtype=np.int64)
+        nomi_variante = self._nomi_variante.get
+        for i, nome in enumerate(nomi):
+            if len(nome) <= 1 or 1 - 1 / len(nome) < self.soglia:
+                continue
+            candidati = set(nomi_variante(nome, ())).union(*[nomi_variante(nome[:j] + nome[j + 1:], ()) for j in range(len(nome))])
+            if len(candidati) == 1:
+                trovati[i] = candidati.pop()
+            elif candidati:
+                trovati[i] = self._spareggio(nome, candidati)
+        return trovati
+
+    # Funzione per scegliere tra più nomi candidati: vince l'unico davvero a un errore; se sono più d'uno (o
+    # nessuno) quello con più bigrammi in comune, se l'unico; altrimenti la corrispondenza è ambigua (-1)
+    def _spareggio(self, nome, candidati):
+        a_un_solo_errore = [c for c in candidati if a_un_errore(nome, self._nomi[c])]
+        if len(a_un_solo_errore) == 1:
+            return a_un_solo_errore[0]
+        bigrammi_nome = ngrammi(nome, 2)
+        punteggi = sorted(
+            ((len(bigrammi_nome & ngrammi(self._nomi[c], 2)) / len(bigrammi_nome | ngrammi(self._nomi[c], 2)), c)
+             for c in (a_un_solo_errore or candidati)),
+            reverse=True
+        )
+        return punteggi[0][1] if punteggi[0][0] != punteggi[1][0] else -1
+
+    # Funzione per risolvere un elenco di nomi distinti: id del nome nell'indice (-1 se non trovato) e confidenza
+    def risolvi_nomi(self, nomi):
+        normalizzati = [normalizza_nome(nome) for nome in nomi]
+        trovati = np.full(len(normalizzati), -1, dtype=np.int64)
+        confidenza = np.zeros(len(normalizzati), dtype=np.float64)
+
+        # Corrispondenze esatte, anche a meno degli spazi
+        da_correggere = []
+        for i, nome in enumerate(normalizzati):
+            id_nome = self.id_nomi.get(nome)
+            if id_nome is not None:
+                trovati[i] = id_nome
+                confidenza[i] = 1.0
+                continue
+            id_nome = self.id_senza_spazi.get(nome.replace(' ', ''))
+            if id_nome is None:
+                # "S. Remo" -> "sanremo"
+                id_nome = self.id_senza_spazi.get(''.join('san' if p == 's' else p for p in nome.split()))
+            if id_nome is not None:
+                trovati[i] = id_nome
+                confidenza[i] = CONFIDENZA_SENZA_SPAZI
+            elif nome:
+                da_correggere.append(i)
+
+        # Corrispondenze a un errore di battitura
+        da_cercare = np.array(da_correggere, dtype=np.int64)
+        if len(da_cercare):
+            corretti = self._cerca_un_errore([normalizzati[i] for i in da_cercare])
+            validi = corretti >= 0
+            trovati[da_cercare[validi]] = corretti[validi]
+            confidenza[da_cercare[validi]] = [1 - 1 / len(normalizzati[i]) for i in da_cercare[validi]]
+            da_cercare = da_cercare[~validi]
+
+        # Corrispondenze fuzzy sugli n-grammi per i nomi rimanenti
+        if len(da_cercare):
+            migliore, punteggio = self._cerca_fuzzy([normalizzati[i] for i in da_cercare])
+            accettati = (migliore >= 0) & (punteggio >= self.soglia)
+            trovati[da_cercare[accettati]] = migliore[accettati]
+            confidenza[da_cercare[accettati]] = punteggio[accettati]
+        return trovati, confidenza
+
+    # Funzione per risolvere una colonna di città: il lavoro è fatto una volta per valore distinto
+    def risolvi(self, citta):
+        codici, uniche = pd.factorize(citta)
+        trovati_unici, confidenza_unica = self.risolvi_nomi(list(uniche))
+        presenti = codici >= 0
+        trovati = np.full(len(codici), -1, dtype=np.int64)
+        confidenza = np.full(len(codici), np.nan)
+        trovati[presenti] = trovati_unici[codici[presenti]]
+        confidenza[presenti] = confidenza_unica[codici[presenti]]
+        confidenza[trovati < 0] = np.nan
+        return trovati, confidenza
+
+    # Funzione per espandere gli id dei nomi nelle coppie (indice del record, riga candidata del database)
+    def righe_candidate(self, id_nomi):
+        record = np.flatnonzero(id_nomi >= 0)
+        inizi = self._inizio_righe[id_nomi[record]]
+        conteggi = self._inizio_righe[id_nomi[record] + 1] - inizi
+        scostamenti = np.arange(int(conteggi.sum())) - np.repeat(np.cumsum(conteggi) - conteggi, conteggi)
+        return np.repeat(record, conteggi), self._righe[np.repeat(inizi, conteggi) + scostamenti]
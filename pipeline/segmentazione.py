@@ -0,0 +1,83 @@
+# Segmentazione dei record lavorabili per provincia e residenza nel capoluogo, in un solo passaggio
+
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+
+# Definizione dei segmenti di una sede: province di interesse (nome -> sigla usata nei nomi file)
+# e nome file del segmento con i record fuori da queste province
+@dataclass(frozen=True)
+class DefinizioneSegmenti:
+    province: dict = field(default_factory=lambda: {'Genova': 'ge', 'Savona': 'sv', 'La Spezia': 'sp', 'Imperia': 'im'})
+    file_fuori_province: str = 'data_fuori_liguria.csv'
+
+    # Nomi file ed etichette dei segmenti (provincia, residente_citta), nell'ordine dei codici di segmento
+    def combinazioni(self):
+        combinazioni = []
+        for provincia, sigla in self.province.items():
+            combinazioni.append((f'data_{sigla}_citta.csv', provincia, True, f'{provincia} Città'))
+            combinazioni.append((f'data_{sigla}_prov.csv', provincia, False, f'{provincia} Prov'))
+        return combinazioni
+
+
+# Segmentazione predefinita della sede ligure
+SEGMENTI_LIGURIA = DefinizioneSegmenti()
+
+
+# Risultato della segmentazione: posizioni delle righe di ogni segmento, calcolate una sola volta
+@dataclass
+class Segmentazione:
+    definizione: DefinizioneSegmenti
+    posizioni: dict
+    posizioni_fuori_province: np.ndarray
+
+    # Numero di record per segmento (nome file -> conteggio)
+    def conteggi(self):
+        return {file_name: len(posizioni) for file_name, posizioni in self.posizioni.items()}
+
+    # Conteggi per provincia (incluse le altre province) per il grafico di distribuzione
+    def conteggi_province(self):
+        conteggi = {'Altra provincia': len(self.posizioni_fuori_province)}
+        for file_name, provincia, _, _ in self.definizione.combinazioni():
+            conteggi[provincia] = conteggi.get(provincia, 0) + len(self.posizioni[file_name])
+        return conteggi
+
+    # Conteggi per provincia e residente_citta per il grafico di distribuzione
+    def conteggi_residente(self):
+        return {etichetta: len(self.posizioni[file_name]) for file_name, _, _, etichetta in self.definizione.combinazioni()}
+
+    # Funzione per estrarre i record di un segmento
+    def segmento(self, lavorabili_data, file_name):
+        if file_name == self.definizione.file_fuori_province:
+            return lavorabili_data.iloc[self.posizioni_fuori_province]
+        return lavorabili_data.iloc[self.posizioni[file_name]]
+
+    # Nomi file dei segmenti per provincia e residente_citta non vuoti
+    def file_non_vuoti(self):
+        return [file_name for file_name, posizioni in self.posizioni.items() if len(posizioni) > 0]
+
+    # Segmenti per provincia e residente_citta non vuoti (nome file -> dati)
+    def segmenti(self, lavorabili_data):
+        return {
+            file_name: lavorabili_data.iloc[posizioni]
+            for file_name, posizioni in self.posizioni.items() if len(posizioni) > 0
+        }
+
+
+# Funzione per segmentare i record lavorabili: un codice di segmento per riga calcolato dalla posizione della
+# provincia tra quelle di interesse (-1 per le altre) e da residente_citta, poi un unico ordinamento per raccogliere le righe di ogni segmento
+def segmenta(lavorabili_data, definizione=SEGMENTI_LIGURIA):
+    province = list(definizione.province)
+    codici_provincia = pd.Index(province).get_indexer(lavorabili_data['provincia']).astype(np.int64, copy=False)
+    non_residente = ~lavorabili_data['residente_citta'].fillna(False).to_numpy(dtype=bool)
+
+    # Codice 2*p per i residenti nel capoluogo della provincia p, 2*p+1 per il resto della provincia,
+    # 2*len(province) per i record fuori dalle province di interesse
+    codici = np.where(codici_provincia >= 0, 2 * codici_provincia + non_residente, 2 * len(province))
+    conteggi = np.bincount(codici, minlength=2 * len(province) + 1)
+    gruppi = np.split(np.argsort(codici, kind='stable'), np.cumsum(conteggi)[:-1])
+
+    posizioni = {file_name: gruppi[codice] for codice, (file_name, _, _, _) in enumerate(definizione.combinazioni())}
+    return Segmentazione(definizione, posizioni, gruppi[-1])
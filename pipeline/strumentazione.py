@@ -0,0 +1,144 @@
+# Strumentazione delle fasi: tempi, righe, memoria e uso della cache. Registra solo conteggi e tempi, mai dati dei record
+
+import json
+import logging
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - Windows: la memoria viene stimata con tracemalloc
+    resource = None
+
+# Logger delle misure: una riga JSON per misura
+logger = logging.getLogger('pipeline.strumentazione')
+
+# Misure conservate al massimo (le più vecchie vengono scartate)
+MISURE_MASSIME = 500
+
+# Prefisso delle metriche in formato Prometheus
+PREFISSO_METRICHE = 'pipeline'
+
+
+# Funzione per leggere la memoria residente del processo in MB; dove /proc non esiste si usa il picco del processo
+# e senza il modulo resource (Windows) la memoria allocata da Python e numpy tracciata da tracemalloc
+def memoria_residente_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for riga in f:
+                if riga.startswith('VmRSS:'):
+                    return int(riga.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        return tracemalloc.get_traced_memory()[0] / (1024 * 1024)
+    # ru_maxrss è in kB su Linux e in bytes su macOS
+    picco = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return picco / (1024 * 1024) if sys.platform == 'darwin' else picco / 1024
+
+
+# Misura di una fase o di un'esportazione
+@dataclass
+class Misura:
+    fase: str
+    esecuzione: int
+    secondi: float = 0.0
+    righe_in: int = None
+    righe_out: int = None
+    delta_memoria_mb: float = None
+    cache: str = None
+    dettaglio: str = None
+
+
+class Strumentazione:
+    """Raccolta delle misure delle fasi di una sessione o di un'esecuzione batch.
+
+    Ogni misura viene conservata (per il pannello di diagnostica e le metriche) e scritta nel logger
+    `pipeline.strumentazione` come riga JSON. Le misure contengono solo nomi di fase, conteggi e tempi.
+    """
+
+    def __init__(self, misure_massime=MISURE_MASSIME):
+        self.misure_massime = misure_massime
+        self.esecuzione = 0
+        self._misure = []
+        self._lock = threading.Lock()
+
+    # Funzione per iniziare una nuova esecuzione (un rerun dell'app o un file del batch)
+    def nuova_esecuzione(self):
+        with self._lock:
+            self.esecuzione += 1
+        return self.esecuzione
+
+    # Funzione per misurare un blocco di codice. `righe_out` e l'uso della cache ('hit' o 'miss', dall'esito della
+    # lettura dalla CacheFasi) si impostano sulla misura restituita. `esecuzione` attribuisce la misura a
+    # un'esecuzione diversa dall'ultima (ad esempio quella di un lavoro in background)
+    @contextmanager
+    def misura(self, fase, righe_in=None, dettaglio=None, esecuzione=None):
+        misura = Misura(fase, self.esecuzione if esecuzione is None else esecuzione, righe_in=righe_in, dettaglio=dettaglio)
+        memoria_iniziale = memoria_residente_mb()
+        inizio = time.perf_counter()
+        try:
+            yield misura
+        finally:
+            misura.secondi = round(time.perf_counter() - inizio, 6)
+            misura.delta_memoria_mb = round(memoria_residente_mb() - memoria_iniziale, 1)
+            self.registra(misura)
+
+    # Funzione per conservare una misura e scriverla nel log
+    def registra(self, misura):
+        with self._lock:
+            self._misure.append(misura)
+            del self._misure[:-self.misure_massime]
+        logger.info(json.dumps({'evento': 'misura', **{k: v for k, v in asdict(misura).items() if v is not None}}))
+
+    # Funzione per ottenere le misure, eventualmente di una sola esecuzione
+    def misure(self, esecuzione=None):
+        with self._lock:
+            return [misura for misura in self._misure if esecuzione is None or misura.esecuzione == esecuzione]
+
+    # Funzione per esportare le misure in formato testuale Prometheus, per un collector locale
+    # (ad esempio il textfile collector di node_exporter); per ogni fase vale l'ultima misura
+    def metriche_prometheus(self):
+        ultime = {}
+        for misura in self.misure():
+            ultime[(misura.fase, misura.dettaglio)] = misura
+        righe = []
+        for nome, campo, descrizione in [
+            ('secondi_fase', 'secondi', 'Durata della fase in secondi'),
+            ('righe_in_fase', 'righe_in', 'Righe in ingresso alla fase'),
+            ('righe_out_fase', 'righe_out', 'Righe in uscita dalla fase'),
+            ('delta_memoria_mb_fase', 'delta_memoria_mb', 'Variazione della memoria residente in MB'),
+        ]:
+            righe.append(f'# HELP {PREFISSO_METRICHE}_{nome} {descrizione}')
+            righe.append(f'# TYPE {PREFISSO_METRICHE}_{nome} gauge')
+            for (fase, dettaglio), misura in ultime.items():
+                valore = getattr(misura, campo)
+                if valore is None:
+                    continue
+                etichette = f'fase="{_valore_etichetta(fase)}"' + (f',dettaglio="{_valore_etichetta(dettaglio)}"' if dettaglio else '')
+                if misura.cache:
+                    etichette += f',cache="{_valore_etichetta(misura.cache)}"'
+                righe.append(f'{PREFISSO_METRICHE}_{nome}{{{etichette}}} {valore}')
+        return '\n'.join(righe) + '\n'
+
+
+# Funzione per scrivere il valore di un'etichetta nel formato testuale di Prometheus: barra rovesciata, virgolette
+# e a capo vanno preceduti da una barra rovesciata
+def _valore_etichetta(valore):
+    return str(valore).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Funzione per misurare un blocco anche senza strumentazione (None): semplifica il codice delle fasi
+@contextmanager
+def misura_fase(strumentazione, fase, righe_in=None, dettaglio=None):
+    if strumentazione is None:
+        yield Misura(fase, 0)
+        return
+    with strumentazione.misura(fase, righe_in, dettaglio) as misura:
+        yield misura
@@ -0,0 +1,215 @@
+# Elaborazione di più esportazioni (una per sede) in parallelo e unione in un solo insieme di segmenti:
+# ogni file viene letto e preparato (formattazione, età) in un processo separato, poi le fasi sull'insieme dei record
+# (validazione con i duplicati tra file diversi, comuni, segmentazione) vengono eseguite una volta sull'unione
+
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+from .comuni import COMUNI_DB_PATH, carica_comuni_db
+from .date_nascita import DIMENSIONE_CAMPIONE_DATE, CampioneDate
+from .lettura import colonne_mappate, leggi_anteprima, leggi_file, mappatura_predefinita
+from .motore import RisultatoPipeline, Statistiche, elabora_record, esecutore_misurato, prepara_record
+from .segmentazione import SEGMENTI_LIGURIA
+from .strumentazione import misura_fase
+from .validazione import StatisticheValidazione, validazione_dati
+
+# Colonna con il nome del file di provenienza di ogni record
+COLONNA_FILE_ORIGINE = 'file_origine'
+
+# Pool di processi condiviso tra le unioni successive (ad esempio i lavori dell'app), con la sua chiave
+_pool = {'esecutore': None, 'chiave': None}
+_lock_pool = threading.Lock()
+
+
+# Statistiche di un file dell'unione: conteggi della validazione del file da solo e record rimasti lavorabili
+# dopo la validazione dell'unione (che scarta anche le email ripetute in file diversi)
+@dataclass
+class StatisticheFile:
+    file: str
+    righe_lette: int = 0
+    formati_data_nascita: dict = field(default_factory=dict)
+    validazione: StatisticheValidazione = field(default_factory=StatisticheValidazione)
+    lavorabili_unione: int = 0
+    errore: str = None
+
+
+# Risultato dell'unione: pipeline sull'insieme dei file e statistiche di ogni file
+@dataclass
+class RisultatoUnione:
+    risultato: RisultatoPipeline
+    file: list
+
+
+# Funzione per ottenere il pool di processi: lo stesso pool viene riusato finché il numero di processi non cambia,
+# così le unioni successive non pagano di nuovo l'avvio dei processi. I processi vengono avviati solo quando servono.
+def _esecutore_unione(processi):
+    with _lock_pool:
+        if _pool['esecutore'] is None or _pool['chiave'] != processi:
+            if _pool['esecutore'] is not None:
+                # I task in corso di altre unioni vengono completati prima della chiusura del vecchio pool
+                _pool['esecutore'].shutdown(wait=False)
+            # forkserver (o spawn) invece di fork: sicuro anche da processi con thread attivi, come il server dell'app
+            metodo = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            _pool['esecutore'] = ProcessPoolExecutor(max_workers=processi, mp_context=multiprocessing.get_context(metodo))
+            _pool['chiave'] = processi
+        return _pool['esecutore']
+
+
+# Funzione per scartare un pool interrotto (un processo terminato in modo anomalo): l'unione successiva ne crea uno nuovo
+def _scarta_esecutore(esecutore):
+    with _lock_pool:
+        if _pool['esecutore'] is esecutore:
+            _pool['esecutore'] = _pool['chiave'] = None
+    esecutore.shutdown(wait=False, cancel_futures=True)
+
+
+# Funzione per aprire una sorgente: percorso, oppure coppia (nome, bytes) per i file caricati nell'app
+def _apri_sorgente(sorgente):
+    if isinstance(sorgente, tuple):
+        nome, contenuto = sorgente
+        buffer = io.BytesIO(contenuto)
+        buffer.name = nome
+        return nome, buffer
+    return os.path.basename(sorgente), sorgente
+
+
+# Funzione per dare un nome univoco a ogni sorgente, usato per `file_origine` e per le statistiche dei file: il nome
+# del file, oppure, per i nomi ripetuti, il percorso dalla cartella comune (es. a/export.csv e b/export.csv); i nomi
+# ancora uguali (file caricati con lo stesso nome, o lo stesso file indicato due volte) ricevono " (2)", " (3)", ...
+def nomi_sorgenti(sorgenti):
+    nomi = [_apri_sorgente(sorgente)[0] for sorgente in sorgenti]
+    for nome in set(nomi):
+        posizioni = [i for i, altro in enumerate(nomi) if altro == nome]
+        percorsi = [os.path.abspath(sorgenti[i]) for i in posizioni if not isinstance(sorgenti[i], tuple)]
+        if len(posizioni) > 1 and len(percorsi) == len(posizioni):
+            comune = os.path.commonpath([os.path.dirname(percorso) for percorso in percorsi])
+            for i, percorso in zip(posizioni, percorsi):
+                nomi[i] = os.path.relpath(percorso, comune).replace(os.sep, '/')
+    visti = {}
+    for i, nome in enumerate(nomi):
+        visti[nome] = visti.get(nome, 0) + 1
+        if visti[nome] > 1:
+            nomi[i] = f'{nome} ({visti[nome]})'
+    return nomi
+
+
+# Funzione per decidere l'ordine delle date a barre una volta per tutti i file: le prime righe di ogni file, in ordine,
+# formano un solo campione, così giorno e mese vengono letti nello stesso ordine in ogni file dell'unione
+def mese_per_primo_unione(sorgenti, header_option=0, mappatura=None, fogli=0):
+    campione = CampioneDate()
+    for sorgente in sorgenti:
+        _, sorgente = _apri_sorgente(sorgente)
+        try:
+            anteprima = leggi_anteprima(sorgente, header_option, fogli[0] if isinstance(fogli, list) else fogli, righe=DIMENSIONE_CAMPIONE_DATE)
+        except Exception:
+            # Il file illeggibile viene riportato con il suo errore dalla preparazione
+            continue
+        colonna = {**mappatura_predefinita(anteprima.columns), **(mappatura or {})}.get('Data_Nascita')
+        if colonna in anteprima.columns:
+            campione.aggiungi(anteprima[colonna])
+    return campione.mese_per_primo()
+
+
+# Funzione eseguita in un processo per ogni file: lettura delle colonne mappate, preparazione dei record (come nella
+# pipeline) e conteggi della validazione del solo file. Restituisce i record preparati con la provenienza.
+# `mese_primo` è l'ordine delle date a barre deciso su tutti i file (mese_per_primo_unione); `nome`, se indicato,
+# sostituisce il nome del file (nomi_sorgenti).
+def prepara_file(sorgente, header_option=0, mappatura=None, data_riferimento=None, fogli=0, compatto=False, mese_primo=None,
+                 nome=None):
+    nome_file, sorgente = _apri_sorgente(sorgente)
+    nome = nome or nome_file
+    statistiche = StatisticheFile(nome)
+    intestazione = leggi_anteprima(sorgente, header_option, fogli[0] if isinstance(fogli, list) else fogli, righe=0).columns
+    # Le colonne non indicate restano sulla mappatura predefinita del file
+    mappatura = {**mappatura_predefinita(intestazione), **(mappatura or {})}
+    df = leggi_file(sorgente, header_option, colonne_mappate(mappatura), fogli)
+    statistiche.righe_lette = df.shape[0]
+
+    df, statistiche.formati_data_nascita = prepara_record(df, mappatura, data_riferimento, compatto, mese_primo=mese_primo)
+    statistiche.validazione = validazione_dati(df, copia=False).statistiche
+    df[COLONNA_FILE_ORIGINE] = pd.Series(nome, index=df.index, dtype='category' if compatto else None)
+    return df, statistiche
+
+
+# Funzione per concatenare i file preparati; le colonne categoriche restano categoriche sull'unione delle categorie
+def _concatena(preparati):
+    df = pd.concat(preparati, ignore_index=True)
+    for colonna in preparati[0].select_dtypes('category').columns:
+        if df[colonna].dtype != 'category':
+            df[colonna] = df[colonna].astype('category')
+    return df
+
+
+# Funzione per elaborare più file in parallelo e unirli. `sorgenti` sono percorsi o coppie (nome, bytes). I file con
+# errori vengono saltati e il messaggio è riportato nelle loro statistiche. `progresso(completati, totale)` riceve
+# l'avanzamento. Sull'unione le fasi sono quelle della pipeline, con il database dei comuni di `comuni_db_path` e il
+# `risolutore` (costruito se non indicato) e, con una `definizione_sedi`, le distanze dalle sedi. I processi restano
+# attivi per le unioni successive. Con `compatto=True` i tipi sono compattati e i sottoinsiemi non copiati.
+def elabora_e_unisci(sorgenti, comuni_db_path=COMUNI_DB_PATH, header_option=0, mappatura=None, data_riferimento=None,
+                     definizione_segmenti=SEGMENTI_LIGURIA, fogli=0, processi=None, strumentazione=None, progresso=None,
+                     definizione_sedi=None, compatto=False, risolutore=None):
+    if data_riferimento is None:
+        data_riferimento = pd.Timestamp.today().normalize()
+    data_riferimento = pd.Timestamp(data_riferimento)
+    processi = max(1, processi or os.cpu_count() or 1)
+    comuni_db_data = carica_comuni_db(comuni_db_path)
+
+    with misura_fase(strumentazione, 'ordine_date', dettaglio=f'{len(sorgenti)} file'):
+        mese_primo = mese_per_primo_unione(sorgenti, header_option, mappatura, fogli)
+
+    nomi = nomi_sorgenti(sorgenti)
+    preparati, statistiche_file = [], []
+    dettaglio = f'{len(sorgenti)} file, {min(processi, len(sorgenti))} processi'
+    with misura_fase(strumentazione, 'preparazione_file', dettaglio=dettaglio) as misura:
+        esecutore = _esecutore_unione(processi)
+        futuri = [esecutore.submit(prepara_file, sorgente, header_option, mappatura, data_riferimento, fogli, compatto, mese_primo, nome)
+                  for sorgente, nome in zip(sorgenti, nomi)]
+        try:
+            # I risultati sono raccolti nell'ordine dei file, così l'unione non dipende dai tempi dei processi
+            for completati, (nome, futuro) in enumerate(zip(nomi, futuri), start=1):
+                try:
+                    df, statistiche = futuro.result()
+                    preparati.append(df)
+                except Exception as e:
+                    if isinstance(e, BrokenProcessPool):
+                        _scarta_esecutore(esecutore)
+                    statistiche = StatisticheFile(nome, errore=str(e))
+                statistiche_file.append(statistiche)
+                if progresso is not None:
+                    progresso(completati, len(sorgenti))
+        except BaseException:
+            # Interruzione (ad esempio l'annullamento dal progresso): i file non ancora iniziati non vengono elaborati
+            for futuro in futuri:
+                futuro.cancel()
+            raise
+        misura.righe_out = sum(df.shape[0] for df in preparati)
+    if not preparati:
+        raise ValueError("Nessun file è stato elaborato correttamente.")
+
+    statistiche = Statistiche(data_riferimento=data_riferimento.strftime('%Y-%m-%d'))
+    for statistiche_singolo in statistiche_file:
+        statistiche.righe_lette += statistiche_singolo.righe_lette
+        for formato, numero in statistiche_singolo.formati_data_nascita.items():
+            statistiche.formati_data_nascita[formato] = statistiche.formati_data_nascita.get(formato, 0) + numero
+
+    with misura_fase(strumentazione, 'unione', statistiche.righe_lette) as misura:
+        df = _concatena(preparati)
+        del preparati
+        misura.righe_out = df.shape[0]
+
+    # Fasi sull'insieme dei record come nella pipeline: i duplicati sono calcolati su tutti i file insieme e i quasi
+    # duplicati anche tra file diversi (il file di revisione riporta la provenienza di ogni record)
+    risultato = elabora_record(df, comuni_db_data, statistiche, risolutore, definizione_segmenti,
+                               compatto, definizione_sedi=definizione_sedi, esegui_fase=esecutore_misurato(strumentazione))
+    del df
+    lavorabili_per_file = risultato.lavorabili[COLONNA_FILE_ORIGINE].value_counts()
+    for statistiche_singolo in statistiche_file:
+        statistiche_singolo.lavorabili_unione = int(lavorabili_per_file.get(statistiche_singolo.file, 0))
+    return RisultatoUnione(risultato, statistiche_file)
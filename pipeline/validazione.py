@@ -0,0 +1,124 @@
+# Validazione delle email e separazione dei record lavorabili da quelli per la gestione manuale
+
+import re
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+# Pattern delle email valide, compilato una sola volta
+PATTERN_EMAIL = re.compile(r'[\w\.-]+@[\w\.-]+\.\w+')
+
+
+# Conteggi prodotti dalla validazione, senza alcun dato dei record
+@dataclass
+class StatisticheValidazione:
+    email_vuote: int = 0
+    email_non_valide: int = 0
+    duplicati_email: int = 0
+    duplicati_email_nome_cognome: int = 0
+    invalid_data_nascita: int = 0
+    numero_lavorabili: int = 0
+    numero_scaricabili_email: int = 0
+    numero_scaricabili_no_email: int = 0
+
+    # Tabella riassuntiva mostrata dall'app e scritta dalla CLI
+    def come_tabella(self):
+        return pd.DataFrame({
+            "Categoria": [
+                "Email vuote",
+                "Email non valide",
+                "Duplicati Email",
+                "Duplicati Email, Nome, Cognome",
+                "Data di nascita non valida",
+                "Record lavorabili",
+                "Record scaricabili (con Email)",
+                "Record scaricabili (senza Email)"
+            ],
+            "Numero di record": [
+                self.email_vuote,
+                self.email_non_valide,
+                self.duplicati_email,
+                self.duplicati_email_nome_cognome,
+                self.invalid_data_nascita,
+                self.numero_lavorabili,
+                self.numero_scaricabili_email,
+                self.numero_scaricabili_no_email
+            ]
+        })
+
+
+# Risultato della validazione: i tre sottoinsiemi di record e le statistiche
+@dataclass
+class RisultatoValidazione:
+    lavorabili: pd.DataFrame
+    scaricabili_email: pd.DataFrame
+    scaricabili_no_email: pd.DataFrame
+    statistiche: StatisticheValidazione
+
+
+# Funzione per validare l'email
+def valida_email(email):
+    return PATTERN_EMAIL.fullmatch(str(email)) is not None
+
+
+# Funzione per calcolare la maschera delle email valide (False per le email vuote).
+# Il pattern viene valutato una sola volta per ogni email distinta e riportato sulle righe tramite i codici.
+def maschera_email_valide(email):
+    codici, email_uniche = pd.factorize(email)
+    valide_uniche = np.fromiter((valida_email(e) for e in email_uniche), dtype=bool, count=len(email_uniche))
+    maschera = np.zeros(len(codici), dtype=bool)
+    presenti = codici >= 0
+    maschera[presenti] = valide_uniche[codici[presenti]]
+    return pd.Series(maschera, index=email.index)
+
+
+# Funzione per calcolare le maschere dei duplicati: righe con Email ripetuta e righe con la terna
+# Email, Nome, Cognome (tutti presenti) ripetuta
+def maschere_duplicati(df):
+    email_duplicate = df['Email'].notna() & df['Email'].duplicated(keep=False)
+    terne = df[['Email', 'Nome', 'Cognome']]
+    terne_duplicate = terne.notna().all(axis=1) & terne.duplicated(keep=False)
+    return email_duplicate, terne_duplicate
+
+
+# Funzione per validare i dati. Con `copia=False` i sottoinsiemi sono estratti una sola volta dal DataFrame
+# validato, senza la copia difensiva (con copy-on-write di pandas le modifiche successive non lo toccano).
+# `duplicati` permette di passare maschere dei duplicati calcolate altrove (es. sull'intero file nella lettura a blocchi)
+def validazione_dati(df, copia=True, duplicati=None):
+    email_presenti = df['Email'].notna()
+    email_valide = maschera_email_valide(df['Email'])
+    email_duplicate, terne_duplicate = maschere_duplicati(df) if duplicati is None else duplicati
+    email_duplicate = email_presenti & email_duplicate
+
+    email_vuote = (~email_presenti).sum()
+    email_non_valide = (email_presenti & ~email_valide).sum()
+    duplicati_email = email_duplicate.sum()
+    duplicati_email_nome_cognome = terne_duplicate.sum()
+
+    invalid_data_nascita = df['Data_Nascita'].isna().sum()
+
+    condizione_scaricabili_email = email_presenti & (~email_valide | email_duplicate)
+    scaricabili_data_email = df[condizione_scaricabili_email]
+
+    condizione_scaricabili_no_email = ~email_presenti
+    scaricabili_data_no_email = df[condizione_scaricabili_no_email]
+
+    condizione_lavorabili = ~condizione_scaricabili_email & ~condizione_scaricabili_no_email
+    lavorabili_data = df[condizione_lavorabili]
+    if copia:
+        scaricabili_data_email = scaricabili_data_email.copy()
+        scaricabili_data_no_email = scaricabili_data_no_email.copy()
+        lavorabili_data = lavorabili_data.copy()
+
+    statistiche = StatisticheValidazione(
+        email_vuote=int(email_vuote),
+        email_non_valide=int(email_non_valide),
+        duplicati_email=int(duplicati_email),
+        duplicati_email_nome_cognome=int(duplicati_email_nome_cognome),
+        invalid_data_nascita=int(invalid_data_nascita),
+        numero_lavorabili=lavorabili_data.shape[0],
+        numero_scaricabili_email=scaricabili_data_email.shape[0],
+        numero_scaricabili_no_email=scaricabili_data_no_email.shape[0]
+    )
+    return RisultatoValidazione(lavorabili_data, scaricabili_data_email, scaricabili_data_no_email, statistiche)
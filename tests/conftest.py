@@ -0,0 +1,52 @@
+# Dati condivisi dai test: database dei comuni e risolutore, caricati una volta per sessione
+
+import os
+import sys
+
+import pytest
+
+CARTELLA_REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CARTELLA_REPO)
+
+from pipeline import COMUNI_DB_PATH, RisolutoreComuni, carica_comuni_db  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def comuni_db_data():
+    return carica_comuni_db(os.path.join(CARTELLA_REPO, COMUNI_DB_PATH))
+
+
+@pytest.fixture(scope='session')
+def risolutore(comuni_db_data):
+    return RisolutoreComuni(comuni_db_data)
+
+
+# Esportazione sintetica con i casi tipici: città liguri e non, scritte male o sconosciute, date in più formati,
+# email vuote, non valide e ripetute
+def esportazione(righe=300, seme=0, prefisso_email='u'):
+    import numpy as np
+    import pandas as pd
+
+    casuale = np.random.default_rng(seme)
+    scegli = lambda valori: casuale.choice(np.array(valori, dtype=object), righe)
+    email = pd.Series([f'{prefisso_email}{i}@esempio.it' for i in range(righe)], dtype=object)
+    email[casuale.random(righe) < 0.05] = ''
+    email[casuale.random(righe) < 0.03] = 'non-valida'
+    email[casuale.random(righe) < 0.05] = f'{prefisso_email}0@esempio.it'
+    return pd.DataFrame({
+        'Nome': scegli([' mario', 'LUCA', 'Anna Maria', 'giulia']),
+        'Cognome': scegli(['rossi', 'BIANCHI', 'De Santis']),
+        'Sesso': scegli(['M', 'F', 'm', '']),
+        'Data_Nascita': scegli(['1980-03-12', '12/03/1980', '05.06.2001', '2010-12-31', 'abc', '']),
+        'Città': scegli(['Genova', 'genova', 'Rappallo', 'Sarzana', 'Sanremo', 'Savona', 'Milano', 'Castro', 'Xyzville', '']),
+        'Email': email,
+    })
+
+
+@pytest.fixture
+def scrivi_esportazione(tmp_path):
+    def scrivi(nome='esportazione.csv', righe=300, seme=0, prefisso_email='u'):
+        percorso = tmp_path / nome
+        esportazione(righe, seme, prefisso_email).to_csv(percorso, index=False)
+        return str(percorso)
+    return scrivi
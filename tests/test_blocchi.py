@@ -0,0 +1,67 @@
+import json
+import os
+
+import pandas as pd
+
+from conftest import esportazione
+from pipeline import FILE_QUASI_DUPLICATI, PREFISSO_FILE_FASCIA, SEDI_LIGURIA, esegui_pipeline
+from pipeline.blocchi import elabora_a_blocchi
+from pipeline.cli import elabora_file
+from pipeline.esportazione import CartellaCsv
+
+
+def _elabora(percorso, cartella, comuni_db_data, risolutore, **opzioni):
+    statistiche, file_zip = elabora_a_blocchi(percorso, CartellaCsv(str(cartella)), comuni_db_data, data_riferimento='2026-01-01',
+                                              risolutore=risolutore, righe_per_blocco=100, **opzioni)
+    return statistiche, {nome: pd.read_csv(cartella / nome, dtype=str) for nome in os.listdir(cartella)}
+
+
+def test_blocchi_compatti(tmp_path, scrivi_esportazione, comuni_db_data, risolutore):
+    percorso = scrivi_esportazione(righe=450)
+    statistiche, file = _elabora(percorso, tmp_path / 'normale', comuni_db_data, risolutore)
+    statistiche_compatte, file_compatti = _elabora(percorso, tmp_path / 'compatto', comuni_db_data, risolutore, compatto=True)
+    assert statistiche_compatte == statistiche
+    assert file_compatti.keys() == file.keys()
+    for nome, df in file.items():
+        if 'eta' in df:
+            # Con i tipi compatti l'età è un intero: 46 invece di 46.0
+            df['eta'] = df['eta'].str.removesuffix('.0')
+        pd.testing.assert_frame_equal(file_compatti[nome], df)
+
+
+def test_blocchi_come_elaborazione_normale(tmp_path, scrivi_esportazione, comuni_db_data, risolutore):
+    percorso = scrivi_esportazione(righe=450)
+    file = {}
+    for modo, righe_per_blocco in (('normale', None), ('blocchi', 100)):
+        cartella = tmp_path / modo
+        cartella.mkdir()
+        elabora_file(percorso, str(cartella), comuni_db_data, data_riferimento='2026-01-01', risolutore=risolutore,
+                     righe_per_blocco=righe_per_blocco, definizione_sedi=SEDI_LIGURIA)
+        with open(cartella / 'statistiche.json', encoding='utf-8') as f:
+            statistiche = json.load(f)
+        file[modo] = statistiche, {nome: pd.read_csv(cartella / nome, dtype=str) for nome in os.listdir(cartella) if nome.endswith('.csv')}
+
+    (statistiche, normale), (statistiche_blocchi, blocchi) = file['normale'], file['blocchi']
+    # A blocchi i quasi duplicati non vengono cercati; tutto il resto coincide
+    assert statistiche.pop('gruppi_quasi_duplicati') > 0 and statistiche_blocchi.pop('gruppi_quasi_duplicati') == 0
+    assert statistiche.pop('record_quasi_duplicati') > 0 and statistiche_blocchi.pop('record_quasi_duplicati') == 0
+    assert statistiche_blocchi == statistiche
+    del normale[FILE_QUASI_DUPLICATI]
+    # Con le sedi ci sono anche i file delle fasce di distanza
+    assert any(nome.startswith(PREFISSO_FILE_FASCIA) for nome in normale)
+    assert blocchi.keys() == normale.keys()
+    for nome, df in normale.items():
+        pd.testing.assert_frame_equal(blocchi[nome], df)
+
+
+def test_ordine_date_uguale_in_tutti_i_blocchi(tmp_path, comuni_db_data, risolutore):
+    # Il primo blocco ha date chiaramente mm/gg; il secondo, da solo, sembrerebbe gg/mm
+    df = esportazione(200)
+    df['Data_Nascita'] = ['03/25/1980', '04/30/1975', '12/31/1990'] * 33 + ['12/31/1990'] + ['04/05/1980'] * 99 + ['25/03/1980']
+    percorso = tmp_path / 'esportazione.csv'
+    df.to_csv(percorso, index=False)
+    normale = esegui_pipeline(pd.read_csv(percorso, dtype=str), comuni_db_data, data_riferimento='2026-01-01', risolutore=risolutore)
+    statistiche, file = _elabora(str(percorso), tmp_path / 'blocchi', comuni_db_data, risolutore)
+    assert statistiche.formati_data_nascita == normale.statistiche.formati_data_nascita
+    date = pd.concat([df['Data_Nascita_Formatta'] for df in file.values()])
+    assert '05/04/1980' in set(date) and '04/05/1980' not in set(date)
@@ -0,0 +1,36 @@
+# Test dell'indice compilato del database dei comuni
+
+import os
+import shutil
+
+import pytest
+
+from pipeline import COMUNI_DB_PATH, carica_comuni_db, compila_comuni_db
+from pipeline.comuni import leggi_indice_comuni, percorso_indice
+
+from conftest import CARTELLA_REPO
+
+pytest.importorskip('pyarrow')
+
+
+@pytest.fixture
+def csv_comuni(tmp_path):
+    percorso = tmp_path / 'comuni.csv'
+    shutil.copy(os.path.join(CARTELLA_REPO, COMUNI_DB_PATH), percorso)
+    return str(percorso)
+
+
+def test_compilazione_senza_file_temporanei(csv_comuni, comuni_db_data):
+    indice = compila_comuni_db(csv_comuni)
+    assert sorted(os.listdir(os.path.dirname(indice))) == ['comuni.arrow', 'comuni.csv']
+    letto = leggi_indice_comuni(indice, csv_comuni)
+    assert letto.equals(comuni_db_data)
+
+
+def test_indice_troncato_ricostruito(csv_comuni, comuni_db_data):
+    indice = compila_comuni_db(csv_comuni)
+    with open(indice, 'r+b') as f:
+        f.truncate(os.path.getsize(indice) // 2)
+    assert leggi_indice_comuni(indice, csv_comuni) is None
+    assert carica_comuni_db(csv_comuni).equals(comuni_db_data)
+    assert leggi_indice_comuni(percorso_indice(csv_comuni), csv_comuni) is not None
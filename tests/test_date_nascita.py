@@ -0,0 +1,57 @@
+import datetime
+
+import pandas as pd
+
+from pipeline.date_nascita import CampioneDate, converti_date_nascita, formatta_date
+
+RIFERIMENTO = '2026-01-01'
+
+
+def test_formati_misti():
+    serie = pd.Series(['12/03/1980', ' 05.06.2001 ', '1980-03-12', '1980-03-12T10:20:00', '29221', 29221, '05-06-01',
+                       datetime.datetime(1990, 5, 4, 13), None])
+    date, formati = converti_date_nascita(serie, RIFERIMENTO)
+    assert formatta_date(date).tolist()[:-1] == ['12/03/1980', '05/06/2001', '12/03/1980', '12/03/1980', '01/01/1980', '01/01/1980',
+                                                 '05/06/2001', '04/05/1990']
+    assert pd.isna(date.iat[-1])
+    assert formati == {'gg/mm/aaaa': 2, 'gg/mm/aa': 1, 'aaaa-mm-gg': 2, 'seriale Excel': 2, 'data Excel': 1, 'vuota': 1}
+
+
+def test_anno_breve_mai_nel_futuro():
+    date, _ = converti_date_nascita(pd.Series(['05/06/25', '05/06/26', '05/06/30']), RIFERIMENTO)
+    assert date.dt.year.tolist() == [2025, 2026, 1930]
+
+
+def test_mese_per_primo_dal_campione():
+    date, formati = converti_date_nascita(pd.Series(['03/25/1980', '04/01/1981']), RIFERIMENTO)
+    assert formatta_date(date).tolist() == ['25/03/1980', '01/04/1981']
+    # In caso di dubbio vale il formato italiano
+    date, _ = converti_date_nascita(pd.Series(['04/01/1981']), RIFERIMENTO)
+    assert formatta_date(date).tolist() == ['04/01/1981']
+
+
+def test_valori_non_validi():
+    # Date impossibili, testo e anni isolati (non sono seriali di Excel) restano senza data
+    date, formati = converti_date_nascita(pd.Series(['31/02/1990', 'abc', '1980', 1980, '99/99/99']), RIFERIMENTO)
+    assert date.isna().all()
+    assert formati == {'non valida': 5}
+
+
+def test_colonna_gia_convertita():
+    serie = pd.to_datetime(pd.Series(['1980-01-01', None])).dt.tz_localize('Europe/Rome')
+    date, formati = converti_date_nascita(serie, RIFERIMENTO)
+    assert date.dt.tz is None
+    assert formati == {'data Excel': 1, 'vuota': 1}
+
+
+def test_ordine_deciso_dal_campione_dell_intero_input():
+    # Da sola la seconda parte sembra gg/mm; con la prima, l'intero input è mm/gg
+    prima, seconda = pd.Series(['03/25/1980', '04/30/1975', '12/31/1990']), pd.Series(['04/05/1980', '25/03/1980'])
+    assert formatta_date(converti_date_nascita(seconda, RIFERIMENTO)[0]).iat[0] == '04/05/1980'
+    campione = CampioneDate()
+    campione.aggiungi(prima)
+    campione.aggiungi(seconda)
+    assert campione.mese_per_primo()
+    date, formati = converti_date_nascita(seconda, RIFERIMENTO, mese_primo=campione.mese_per_primo())
+    assert formatta_date(date).iat[0] == '05/04/1980'
+    assert formati == {'gg/mm/aaaa': 1, 'non valida': 1}
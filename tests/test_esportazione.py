@@ -0,0 +1,55 @@
+import io
+import zipfile
+
+import pandas as pd
+import pytest
+
+from pipeline.esportazione import Esportazione, EsportazioneCompressa, scrivi_output
+
+
+class _SoloScrittura(io.RawIOBase):
+    """Destinazione non posizionabile, come una risposta HTTP."""
+
+    def __init__(self):
+        self.scritto = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, contenuto):
+        self.scritto += contenuto
+        return len(contenuto)
+
+
+def _segmenti():
+    return {f'data_{i}.csv': pd.DataFrame({'Nome': [f'n{j}' for j in range(50 * (i + 1))], 'eta': range(50 * (i + 1))}) for i in range(3)}
+
+
+def test_zip_in_streaming_senza_conservare_i_file():
+    esportazione = Esportazione(_segmenti())
+    destinazione = _SoloScrittura()
+    esportazione.scrivi_zip(destinazione)
+    # I file serializzati per l'archivio non restano in memoria
+    assert esportazione._file == {}
+    with zipfile.ZipFile(io.BytesIO(bytes(destinazione.scritto))) as zipf:
+        assert zipf.testzip() is None
+        assert {nome: zipf.read(nome) for nome in zipf.namelist()} == {nome: esportazione.file(nome) for nome in esportazione.nomi()}
+
+
+def test_zip_esportazione_compressa():
+    esportazione = EsportazioneCompressa()
+    for nome, df in _segmenti().items():
+        for inizio in range(0, len(df), 40):
+            esportazione.aggiungi(nome, df.iloc[inizio:inizio + 40].to_csv(index=False, header=inizio == 0).encode())
+    with zipfile.ZipFile(io.BytesIO(esportazione.zip())) as zipf:
+        assert {nome: zipf.read(nome) for nome in zipf.namelist()} == {nome: esportazione.csv(nome) for nome in esportazione.nomi()}
+
+
+def test_scrivi_output_parquet(tmp_path):
+    pytest.importorskip('pyarrow')
+    esportazione = Esportazione(_segmenti(), formato='parquet')
+    scritti = scrivi_output(str(tmp_path), esportazione, ['data_0.csv', 'data_2.csv'])
+    assert esportazione._file == {}
+    with zipfile.ZipFile(scritti[-1]) as zipf:
+        assert [voce.compress_type for voce in zipf.infolist()] == [zipfile.ZIP_STORED] * 2
+        assert zipf.read('data_2.parquet') == (tmp_path / 'data_2.parquet').read_bytes()
@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pipeline.formati import VALORE_PARTIZIONE_MANCANTE, _valore_partizione, parquet_partizionato
+
+
+def test_valore_partizione():
+    assert _valore_partizione(np.bool_(True)) == 'true'
+    assert _valore_partizione(False) == 'false'
+    assert _valore_partizione('La Spezia') == 'La%20Spezia'
+    assert _valore_partizione(None) == VALORE_PARTIZIONE_MANCANTE
+    assert _valore_partizione(np.nan) == VALORE_PARTIZIONE_MANCANTE
+
+
+def test_parquet_partizionato_con_booleani_numpy():
+    pytest.importorskip('pyarrow')
+    df = pd.DataFrame({
+        'Nome': ['Anna', 'Bruno', 'Carla'],
+        'provincia': ['Genova', 'Genova', None],
+        'residente_citta': np.array([True, False, True]),
+    })
+    file = parquet_partizionato(df)
+    assert sorted(file) == [
+        'provincia=Genova/residente_citta=false/part-0.parquet',
+        'provincia=Genova/residente_citta=true/part-0.parquet',
+        f'provincia={VALORE_PARTIZIONE_MANCANTE}/residente_citta=true/part-0.parquet',
+    ]
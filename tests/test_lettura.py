@@ -0,0 +1,30 @@
+import pandas as pd
+
+from pipeline.lettura import DIMENSIONE_LETTURA, leggi_blocchi, leggi_file
+
+
+def _scrivi_csv(cartella, righe=200_000):
+    percorso = cartella / 'dati.csv'
+    pd.DataFrame({
+        'Nome': [f'Nome {i}' for i in range(righe)],
+        'Città': ['Genova', 'NA', '', 'Savona'] * (righe // 4),
+    }).to_csv(percorso, index=False)
+    return percorso
+
+
+def test_avanzamento_csv_per_byte_letti(tmp_path):
+    percorso = _scrivi_csv(tmp_path)
+    assert percorso.stat().st_size > 2 * DIMENSIONE_LETTURA
+    passi = []
+    df = leggi_file(percorso, progresso=lambda frazione, messaggio: passi.append(frazione))
+    pd.testing.assert_frame_equal(df, pd.read_csv(percorso, dtype=str, engine='pyarrow'))
+    intermedi = [frazione for frazione in passi if 0.1 < frazione < 1.0]
+    assert len(intermedi) >= 2
+    assert passi == sorted(passi) and passi[-1] == 1.0
+
+
+def test_blocchi_con_stessi_valori_mancanti(tmp_path):
+    percorso = _scrivi_csv(tmp_path)
+    blocchi = list(leggi_blocchi(percorso, righe_per_blocco=80_000))
+    assert [len(blocco) for blocco in blocchi] == [80_000, 80_000, 40_000]
+    pd.testing.assert_frame_equal(pd.concat(blocchi, ignore_index=True), leggi_file(percorso))
@@ -0,0 +1,23 @@
+import pandas as pd
+
+from conftest import esportazione
+from pipeline import SEDI_LIGURIA, esegui_pipeline
+
+
+def test_fasi_passano_dall_esecutore(comuni_db_data, risolutore):
+    fasi = {}
+
+    def esegui_fase(nome, calcola, righe_in, righe_out):
+        fasi[nome] = calcola()
+        return fasi[nome]
+
+    df = esportazione()
+    risultato = esegui_pipeline(df, comuni_db_data, data_riferimento='2026-01-01', risolutore=risolutore,
+                                definizione_sedi=SEDI_LIGURIA, esegui_fase=esegui_fase)
+    assert list(fasi) == ['formattazione', 'eta', 'validazione', 'quasi_duplicati', 'comuni', 'distanze', 'segmentazione']
+    # Il risultato è composto dai risultati delle fasi restituiti dall'esecutore
+    assert risultato.lavorabili is fasi['distanze']
+    assert risultato.segmentazione is fasi['segmentazione']
+    pd.testing.assert_frame_equal(risultato.lavorabili, esegui_pipeline(
+        df, comuni_db_data, data_riferimento='2026-01-01', risolutore=risolutore, definizione_sedi=SEDI_LIGURIA
+    ).lavorabili)
@@ -0,0 +1,94 @@
+# Test della risoluzione tollerante dei nomi di città
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pipeline import map_comune_info, normalizza_nome
+from pipeline.risoluzione import CONFIDENZA_SENZA_SPAZI, a_un_errore
+
+
+# Funzione per risolvere un solo nome: denominazione del comune (None se non trovato) e confidenza
+def risolvi(risolutore, comuni_db_data, nome):
+    trovati, confidenza = risolutore.risolvi_nomi([nome])
+    if trovati[0] < 0:
+        return None, confidenza[0]
+    _, righe = risolutore.righe_candidate(trovati)
+    return comuni_db_data['denominazione_ita'].iat[righe[0]], confidenza[0]
+
+
+def test_normalizza_nome():
+    assert normalizza_nome("  SANT'ANNA  d'Alfaedo ") == 's anna d alfaedo'
+    assert normalizza_nome('S. Remo') == normalizza_nome('San Remo') == 's remo'
+    assert normalizza_nome(None) == ''
+
+
+@pytest.mark.parametrize('nome, comune', [
+    ('Genova', 'Genova'),
+    ('GENOVA', 'Genova'),
+    ('Aglie', 'Agliè'),
+    ('Bozen', 'Bolzano'),
+    ('S. Margherita Ligure', 'Santa Margherita Ligure'),
+])
+def test_corrispondenze_esatte(risolutore, comuni_db_data, nome, comune):
+    assert risolvi(risolutore, comuni_db_data, nome) == (comune, 1.0)
+
+
+@pytest.mark.parametrize('nome, comune', [
+    ('Laspezia', 'La Spezia'),
+    ('S. Remo', 'Sanremo'),
+    ('Santamargheritaligure', 'Santa Margherita Ligure'),
+    ("SantoStefanod'Aveto", "Santo Stefano d'Aveto"),
+    ('Torresantasusanna', 'Torre Santa Susanna'),
+    ('SantaMargherita Ligure', 'Santa Margherita Ligure'),
+])
+def test_corrispondenze_senza_spazi(risolutore, comuni_db_data, nome, comune):
+    assert risolvi(risolutore, comuni_db_data, nome) == (comune, CONFIDENZA_SENZA_SPAZI)
+
+
+@pytest.mark.parametrize('nome, comune', [
+    ('Rappallo', 'Rapallo'),
+    ('Genva', 'Genova'),
+    ('Mialno', 'Milano'),
+    ('Genvoa', 'Genova'),
+])
+def test_corrispondenze_a_un_errore(risolutore, comuni_db_data, nome, comune):
+    trovato, confidenza = risolvi(risolutore, comuni_db_data, nome)
+    assert trovato == comune
+    assert confidenza == pytest.approx(1 - 1 / len(normalizza_nome(nome)))
+
+
+def test_nomi_non_trovati(risolutore, comuni_db_data):
+    for nome in ('Xyzzy', '', 'Parigi'):
+        assert risolvi(risolutore, comuni_db_data, nome)[0] is None
+
+
+def test_a_un_errore():
+    assert a_un_errore('mialno', 'milano')
+    assert a_un_errore('rapallo', 'rappallo')
+    assert a_un_errore('genva', 'genova')
+    assert a_un_errore('genoba', 'genova')
+    assert not a_un_errore('mialno', 'mirano')
+    assert not a_un_errore('genova', 'genova')
+
+
+def test_omonimi_distinti_da_provincia_e_cap(comuni_db_data, risolutore):
+    # Castro esiste in provincia di Bergamo e di Lecce
+    record = pd.DataFrame({
+        'Città': ['Castro', 'Castro', 'Castro', 'Castro'],
+        'Provincia_Indicata': ['BG', 'Lecce', None, None],
+        'CAP_Indicato': [None, None, '73030', None],
+    })
+    arricchiti, _, citta_ambigue = map_comune_info(record, comuni_db_data, risolutore)
+    assert arricchiti['provincia'].astype(object).tolist()[:3] == ['Bergamo', 'Lecce', 'Lecce']
+    assert arricchiti['comune_ambiguo'].tolist() == [False, False, False, True]
+    assert pd.isna(arricchiti['comune'].iat[3])
+    assert list(citta_ambigue) == ['Castro']
+
+
+def test_cap_indicato_del_comune(comuni_db_data, risolutore):
+    record = pd.DataFrame({'Città': ['Genova', 'Genova'], 'CAP_Indicato': ['16145', '20100']})
+    arricchiti, _, _ = map_comune_info(record, comuni_db_data, risolutore)
+    # Il CAP indicato vale solo se appartiene al comune; altrimenti resta il CAP principale
+    assert arricchiti['cap'].tolist() == ['16145', '16121']
+    assert np.all(arricchiti['residente_citta'].to_numpy())
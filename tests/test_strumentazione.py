@@ -0,0 +1,51 @@
+import threading
+
+from pipeline.cache import CacheFasi
+from pipeline.strumentazione import Strumentazione, memoria_residente_mb
+
+
+def test_esito_della_lettura_dalla_cache():
+    cache = CacheFasi()
+    assert cache.ottieni_con_esito('eta', 1, lambda: 'calcolato') == ('calcolato', False)
+    assert cache.ottieni_con_esito('eta', 1, lambda: 'ricalcolato') == ('calcolato', True)
+    assert cache.ottieni('eta', 2, lambda: 'altro') == 'altro'
+    assert (cache.calcolati, cache.riusati) == (2, 1)
+
+
+def test_esito_non_influenzato_da_calcoli_concorrenti():
+    cache = CacheFasi()
+    cache.ottieni('lettura', 'a', lambda: 'letto')
+    rilascia = threading.Event()
+    lavoro = threading.Thread(target=cache.ottieni, args=('segmentazione', 'b', lambda: rilascia.wait() and 'segmenti'))
+    lavoro.start()
+    strumentazione = Strumentazione()
+    with strumentazione.misura('lettura') as misura:
+        risultato, riusato = cache.ottieni_con_esito('lettura', 'a', lambda: 'ricalcolato')
+        # Durante la misura il lavoro in background completa un calcolo: la lettura resta un riuso
+        rilascia.set()
+        lavoro.join()
+        misura.cache = 'hit' if riusato else 'miss'
+    assert (risultato, cache.calcolati) == ('letto', 2)
+    assert strumentazione.misure()[-1].cache == 'hit'
+
+
+def test_misure_e_memoria():
+    assert memoria_residente_mb() > 0
+    strumentazione = Strumentazione(misure_massime=2)
+    esecuzione = strumentazione.nuova_esecuzione()
+    for fase in ('lettura', 'eta', 'validazione'):
+        with strumentazione.misura(fase, righe_in=10) as misura:
+            misura.righe_out = 8
+            misura.cache = 'miss'
+    assert [misura.fase for misura in strumentazione.misure(esecuzione)] == ['eta', 'validazione']
+    assert 'pipeline_righe_out_fase{fase="validazione",cache="miss"} 8' in strumentazione.metriche_prometheus()
+
+
+def test_etichette_prometheus_con_caratteri_speciali():
+    strumentazione = Strumentazione()
+    with strumentazione.misura('serializzazione_csv', righe_in=3, dettaglio='sede "nord"\\export\n.csv') as misura:
+        misura.righe_out = 3
+    metriche = strumentazione.metriche_prometheus()
+    assert 'pipeline_righe_out_fase{fase="serializzazione_csv",dettaglio="sede \\"nord\\"\\\\export\\n.csv"} 3' in metriche
+    # Ogni misura resta su una sola riga
+    assert all(riga.startswith(('#', 'pipeline_')) for riga in metriche.splitlines())
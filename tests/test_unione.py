@@ -0,0 +1,63 @@
+import os
+
+import pandas as pd
+
+from conftest import CARTELLA_REPO, esportazione
+from pipeline import COMUNI_DB_PATH
+from pipeline.unione import COLONNA_FILE_ORIGINE, _esecutore_unione, elabora_e_unisci, mese_per_primo_unione, nomi_sorgenti
+
+COMUNI_DB = os.path.join(CARTELLA_REPO, COMUNI_DB_PATH)
+
+
+def test_processi_riusati_tra_unioni(scrivi_esportazione):
+    sorgenti = [scrivi_esportazione('sede_0.csv', seme=0), scrivi_esportazione('sede_1.csv', seme=1, prefisso_email='v')]
+    prima = elabora_e_unisci(sorgenti, COMUNI_DB, data_riferimento='2026-01-01', processi=1)
+    esecutore = _esecutore_unione(1)
+    pid = esecutore.submit(os.getpid).result()
+
+    seconda = elabora_e_unisci(sorgenti, COMUNI_DB, data_riferimento='2026-01-01', processi=1)
+    # Stesso pool e stesso processo tra le due unioni
+    assert _esecutore_unione(1) is esecutore
+    assert esecutore.submit(os.getpid).result() == pid
+    pd.testing.assert_frame_equal(prima.risultato.lavorabili, seconda.risultato.lavorabili)
+    assert set(prima.risultato.lavorabili[COLONNA_FILE_ORIGINE]) == {'sede_0.csv', 'sede_1.csv'}
+
+
+def test_unione_compatta(scrivi_esportazione):
+    sorgenti = [scrivi_esportazione('sede_0.csv', seme=0), scrivi_esportazione('sede_1.csv', seme=1, prefisso_email='v')]
+    normale = elabora_e_unisci(sorgenti, COMUNI_DB, data_riferimento='2026-01-01', processi=1).risultato
+    compatta = elabora_e_unisci(sorgenti, COMUNI_DB, data_riferimento='2026-01-01', processi=1, compatto=True).risultato
+    assert compatta.lavorabili['eta'].dtype == 'Int16'
+    assert isinstance(compatta.lavorabili[COLONNA_FILE_ORIGINE].dtype, pd.CategoricalDtype)
+    assert compatta.statistiche == normale.statistiche
+    pd.testing.assert_frame_equal(compatta.lavorabili.astype(str), normale.lavorabili.astype(str).assign(
+        eta=normale.lavorabili['eta'].astype('Int16').astype(str)), check_dtype=False)
+
+
+def test_ordine_date_uguale_in_tutti_i_file(tmp_path):
+    # Il primo file ha date chiaramente mm/gg; il secondo, da solo, sembrerebbe gg/mm
+    sorgenti = []
+    for numero, date in enumerate([['03/25/1980', '04/30/1975', '12/31/1990'] * 20, ['04/05/1980'] * 59 + ['25/03/1980']]):
+        df = esportazione(60, seme=numero, prefisso_email=f'f{numero}')
+        df['Data_Nascita'] = date
+        percorso = tmp_path / f'sede_{numero}.csv'
+        df.to_csv(percorso, index=False)
+        sorgenti.append(str(percorso))
+    assert mese_per_primo_unione(sorgenti)
+    unione = elabora_e_unisci(sorgenti, COMUNI_DB, data_riferimento='2026-01-01', processi=1)
+    date = set(unione.risultato.lavorabili['Data_Nascita_Formatta'])
+    assert '05/04/1980' in date and '04/05/1980' not in date
+    assert unione.file[1].formati_data_nascita == {'gg/mm/aaaa': 59, 'non valida': 1}
+
+
+def test_file_omonimi_in_cartelle_diverse(tmp_path, scrivi_esportazione):
+    sorgenti = []
+    for numero, cartella in enumerate(['a', 'b']):
+        (tmp_path / cartella).mkdir()
+        sorgenti.append(scrivi_esportazione(f'{cartella}/export.csv', righe=100, seme=numero, prefisso_email=cartella))
+    unione = elabora_e_unisci(sorgenti, COMUNI_DB, data_riferimento='2026-01-01', processi=1)
+    assert [statistiche.file for statistiche in unione.file] == ['a/export.csv', 'b/export.csv']
+    lavorabili_per_file = unione.risultato.lavorabili[COLONNA_FILE_ORIGINE].value_counts()
+    assert [lavorabili_per_file[statistiche.file] for statistiche in unione.file] == [statistiche.lavorabili_unione for statistiche in unione.file]
+    assert sum(statistiche.righe_lette for statistiche in unione.file) == 200
+    assert nomi_sorgenti([('export.csv', b''), ('export.csv', b'')]) == ['export.csv', 'export.csv (2)']